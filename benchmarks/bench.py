@@ -0,0 +1,410 @@
+# benchmarks/bench.py
+"""
+Hot path benchmarks for T2I and SR, runnable without the real checkpoint.
+
+Model stages (load, prompt encode, denoise step, VAE decode) run on a tiny randomly
+initialized SDXL pipeline; SR stages (tile mask, canvas merge, PNG save) on synthetic images;
+the end-to-end task runners on a stub pipeline with a fixed cost per denoising step.
+
+Usage:
+    python benchmarks/bench.py                          # full suite -> benchmarks/results.json
+    python benchmarks/bench.py --quick --only sr_       # small sizes, SR cases only
+    python benchmarks/bench.py --baseline old.json      # exit 1 on a regression > threshold
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Project root on sys.path, like src/main.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+# Prompt truncation warnings would drown the report
+os.environ.setdefault("TRANSFORMERS_VERBOSITY", "error")
+
+import numpy as np
+import torch
+from PIL import Image
+
+from src.conf import conf
+
+# Sizes per mode: SDXL image sizes for the model stages, SR output sizes, SR tile sizes
+SIZES = {
+    "full": {"image": [512, 1024], "sr": [1920, 3840], "tile": [512, 1024]},
+    "quick": {"image": [256, 512], "sr": [1024, 1920], "tile": [512]},
+}
+
+##### Section I : Timing #####
+
+def measure(fn, repeat=5, warmup=1, setup=None):
+    """
+    Runs fn() warmup + repeat times and returns timing stats in seconds.
+    setup: optional callable run before every call, not timed.
+    """
+    times = []
+    for n in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if n >= warmup:
+            times.append(elapsed)
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "mean": statistics.fmean(times),
+        "repeat": repeat,
+    }
+
+@contextlib.contextmanager
+def conf_overrides(**values):
+    """Temporarily sets conf values."""
+    old = {name: getattr(conf, name) for name in values}
+    try:
+        for name, value in values.items():
+            setattr(conf, name, value)
+        yield
+    finally:
+        for name, value in old.items():
+            setattr(conf, name, value)
+
+def synthetic_image(width, height, seed=0):
+    """Gradient + mild noise (compresses like a photo; pure noise would not)."""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+    pixels = ramp + rng.normal(0, 8, (height, width, 3)).astype(np.float32)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+##### Section II : Cases #####
+
+class Suite:
+    """Collects results as {name: {"median", "min", "mean", "repeat", "params"}}."""
+    def __init__(self, sizes, repeat, only=None, tmp_dir=None):
+        self.sizes = sizes
+        self.repeat = repeat
+        self.only = only or []
+        self.tmp_dir = tmp_dir
+        self.results = {}
+        self._tiny = None
+
+    def wanted(self, name):
+        return not self.only or any(name.startswith(prefix) for prefix in self.only)
+
+    def record(self, name, stats, **params):
+        stats["params"] = params
+        self.results[name] = stats
+        print(f"   {name:<40} {stats['median'] * 1000:10.2f} ms  (min {stats['min'] * 1000:.2f})")
+
+    @property
+    def tiny(self):
+        if self._tiny is None:
+            from benchmarks.tiny import build_tiny_pipeline
+            self._tiny = build_tiny_pipeline(tmp_dir=self.tmp_dir)
+        return self._tiny
+
+    # --- Model stages (tiny SDXL) ---
+
+    def model_load(self):
+        from diffusers import StableDiffusionXLPipeline
+
+        path = os.path.join(self.tmp_dir, "tiny_sdxl")
+        self.tiny.save_pretrained(path)
+        stats = measure(lambda: StableDiffusionXLPipeline.from_pretrained(path), repeat=max(1, self.repeat // 2))
+        self.record("model_load", stats, model="tiny-sdxl")
+
+    def prompt_encode(self):
+        from src.conf import prompt as pt
+        from src.t2i.embed import PromptEmbeddingCache, encode_prompt
+
+        pipe = self.tiny
+        stats = measure(lambda: encode_prompt(pipe, pt.PROMPT_TEXT, pt.NEGATIVE_PROMPT_TEXT), repeat=self.repeat)
+        self.record("prompt_encode", stats, model="tiny-sdxl")
+
+        cache = PromptEmbeddingCache("tiny-sdxl", max_entries=4)
+        stats = measure(lambda: cache.get(pipe, pt.PROMPT_TEXT, pt.NEGATIVE_PROMPT_TEXT), repeat=self.repeat)
+        self.record("prompt_encode_cached", stats, model="tiny-sdxl")
+
+    def denoise_step(self):
+        """One UNet call with classifier-free guidance (batch 2), as in every denoising step."""
+        unet = self.tiny.unet
+        cross_dim = unet.config.cross_attention_dim
+        for size in self.sizes["image"]:
+            latents = torch.randn(2, 4, size // 8, size // 8)
+            kwargs = {
+                "encoder_hidden_states": torch.randn(2, 77, cross_dim),
+                "added_cond_kwargs": {
+                    "text_embeds": torch.randn(2, self.tiny.text_encoder_2.config.projection_dim),
+                    "time_ids": torch.tensor([[size, size, 0, 0, size, size]] * 2, dtype=torch.float32),
+                },
+                "return_dict": False,
+            }
+
+            def step():
+                with torch.no_grad():
+                    unet(latents, 500, **kwargs)
+
+            self.record(f"denoise_step[{size}]", measure(step, repeat=self.repeat), size=size, model="tiny-sdxl")
+
+    def vae_decode(self):
+        from src.t2i import t2i
+
+        pipe = self.tiny
+        for size in self.sizes["image"]:
+            latents = torch.randn(1, 4, size // 8, size // 8)
+            stats = measure(lambda: t2i.decode_latents(pipe, latents), repeat=self.repeat)
+            self.record(f"vae_decode[{size}]", stats, size=size, model="tiny-sdxl")
+
+    def device_profiles(self, steps=2):
+        """
+        A text2img call (latent output) on the tiny pipeline per device profile that this machine
+        can run, against the untouched float32 pipeline ("baseline").
+        """
+        import copy
+        from src.utils import devices
+
+        profiles = ["baseline"] + [name for name in devices.PROFILES
+                                   if name == "cpu" or torch.cuda.is_available()]
+        threads = torch.get_num_threads()
+        size = self.sizes["image"][0]
+        for name in profiles:
+            pipe = copy.deepcopy(self.tiny)
+            profile = devices.resolve(name) if name != "baseline" else None
+            if profile is not None:
+                devices.apply(pipe, profile)
+            device = profile["device"] if profile else "cpu"
+
+            def call():
+                with torch.no_grad(), devices.autocast():
+                    pipe(prompt="bench", num_inference_steps=steps, height=size, width=size,
+                         generator=torch.Generator(device).manual_seed(0), output_type="latent")
+
+            try:
+                stats = measure(call, repeat=self.repeat)
+            finally:
+                devices._active = None
+                torch.set_num_threads(threads)
+            self.record(f"device_profile[{name},{size}]", stats, size=size, steps=steps,
+                        profile=devices.describe(profile) if profile else "float32, defaults")
+
+    # --- SR stages ---
+
+    def sr_mask_build(self):
+        from src.sr import sr
+
+        sides = {"top": True, "bottom": True, "left": True, "right": True}
+        for tile in self.sizes["tile"]:
+            for ramp in ("linear", "cosine", "gaussian"):
+                stats = measure(lambda: sr.create_tile_mask(tile, conf.SR_OVERLAP, sides, ramp),
+                                repeat=self.repeat, setup=sr._cached_tile_mask.cache_clear)
+                self.record(f"sr_mask_build[{tile},{ramp}]", stats, tile=tile, ramp=ramp)
+
+    def sr_canvas_merge(self):
+        """Blends every tile of a plan and normalizes the canvas to uint8 bands."""
+        from src.sr import sr
+        from src.sr.blend import TileBlender
+
+        for size in self.sizes["sr"]:
+            for tile in self.sizes["tile"]:
+                plan = sr.plan_tiles(size, size, tile, conf.SR_OVERLAP)
+                tile_np = synthetic_image(plan["tile_width"], plan["tile_height"]).astype(np.float32)
+                masks = [sr.create_tile_mask((plan["tile_height"], plan["tile_width"]), plan["overlap"], sides)
+                         for _, _, _, sides in plan["tiles"]]
+
+                for mode in ("memory", "memmap", "stream"):
+                    def merge():
+                        blender = TileBlender(size, size, mode=mode, tmp_dir=self.tmp_dir, sink=lambda band: None)
+                        try:
+                            for (_, x, y, _), mask in zip(plan["tiles"], masks):
+                                blender.add(tile_np, mask, x, y)
+                            blender.finish()
+                        finally:
+                            blender.close()
+
+                    self.record(f"sr_canvas_merge[{size},{tile},{mode}]", measure(merge, repeat=self.repeat),
+                                size=size, tile=tile, mode=mode, tiles=len(plan["tiles"]))
+
+    def png_save(self):
+        from src.sr.blend import PngStreamWriter
+
+        path = os.path.join(self.tmp_dir, "bench.png")
+        for size in self.sizes["sr"]:
+            pixels = synthetic_image(size, size)
+            image = Image.fromarray(pixels)
+            self.record(f"png_save[{size},pil]", measure(lambda: image.save(path), repeat=self.repeat), size=size)
+
+            def stream():
+                writer = PngStreamWriter(path, size, size)
+                for start in range(0, size, conf.SR_CANVAS_BAND_ROWS):
+                    writer.write(pixels[start:start + conf.SR_CANVAS_BAND_ROWS])
+                writer.close()
+
+            self.record(f"png_save[{size},stream]", measure(stream, repeat=self.repeat), size=size)
+
+    # --- End-to-end task runners (stub pipeline) ---
+
+    def task_t2i(self, images=4, step_cost=0.002):
+        """t2i.run_task on the stub; overhead = total minus the stub's own denoising time."""
+        from benchmarks.tiny import stub_registry
+        from src.t2i import t2i
+
+        size = self.sizes["image"][-1]
+        out_dir = os.path.join(self.tmp_dir, "t2i")
+        registry = stub_registry(step_cost)
+
+        def run():
+            shutil.rmtree(out_dir, ignore_errors=True)
+            with conf_overrides(OUTPUT_DIR_T2I=out_dir, IMAGE_HEIGHT=size, IMAGE_WIDTH=size, MANIFEST_ENABLED=False), \
+                 contextlib.redirect_stdout(open(os.devnull, "w")):
+                t2i.run_task(num_images=images, pipe=registry)
+
+        stub = registry.base
+        stats = measure(run, repeat=max(1, self.repeat // 2), setup=lambda: setattr(stub, "steps_run", 0))
+        self.record("task_t2i", stats, images=images, size=size, step_cost=step_cost)
+
+        # Every run is identical, so the last one's step count is the stub time of each
+        stub_time = stub.steps_run * step_cost
+        overhead = dict(stats, **{k: max(0.0, stats[k] - stub_time) for k in ("median", "min", "mean")})
+        self.record("task_t2i_overhead", overhead, images=images, size=size, step_cost=step_cost)
+
+    def task_sr(self, images=2, step_cost=0.002):
+        from benchmarks.tiny import stub_registry
+        from src.sr import sr
+
+        size = self.sizes["sr"][0]
+        in_dir = os.path.join(self.tmp_dir, "sr_in")
+        out_dir = os.path.join(self.tmp_dir, "sr_out")
+        os.makedirs(in_dir, exist_ok=True)
+        for n in range(images):
+            Image.fromarray(synthetic_image(size // 2, size // 2, seed=n)).save(os.path.join(in_dir, f"{n}.png"))
+        registry = stub_registry(step_cost)
+
+        def run():
+            shutil.rmtree(out_dir, ignore_errors=True)
+            with conf_overrides(OUTPUT_DIR_SR=out_dir, SR_TARGET_SIZE=size, SR_SCALE=None, MANIFEST_ENABLED=False), \
+                 contextlib.redirect_stdout(open(os.devnull, "w")):
+                sr.run_task(folder_path=in_dir, pipe=registry)
+
+        self.record("task_sr", measure(run, repeat=max(1, self.repeat // 2)), images=images, size=size,
+                    step_cost=step_cost)
+
+    # --- CLI startup (fresh interpreters) ---
+
+    def cli_startup(self):
+        """Wall time of commands that must not pay for the torch / diffusers import."""
+        main = os.path.join(ROOT, "src", "main.py")
+        commands = {
+            "import": [sys.executable, "-c", "import src.sr.sr, src.t2i.t2i, src.serve.serve"],
+            "help": [sys.executable, main, "--help"],
+            "dry_run": [sys.executable, main, "--t2i", "--nums", "4", "--dry-run"],
+        }
+        for name, command in commands.items():
+            # Outputs / manifests of the dry run go to the temporary directory
+            run = lambda: subprocess.run(command, cwd=self.tmp_dir, env=dict(os.environ, PYTHONPATH=ROOT),
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.record(f"cli_startup[{name}]", measure(run, repeat=self.repeat), command=name)
+
+    CASES = ("cli_startup", "model_load", "prompt_encode", "denoise_step", "vae_decode", "device_profiles",
+             "sr_mask_build", "sr_canvas_merge", "png_save", "task_t2i", "task_sr")
+
+    def run(self):
+        for name in self.CASES:
+            if self.wanted(name):
+                print(f"[BENCH] {name}")
+                getattr(self, name)()
+        return self.results
+
+##### Section III : Comparison #####
+
+def compare(results, baseline, threshold=0.15, min_delta=0.001):
+    """
+    Compares medians with a baseline result file (cases present in both).
+    A case regresses if it is slower by more than `threshold` (relative) and `min_delta`
+    seconds (absolute, to ignore timer noise on sub-millisecond cases).
+    Returns a list of (name, old, new, ratio, regressed).
+    """
+    rows = []
+    for name, new in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        ratio = new["median"] / old["median"] if old["median"] > 0 else float("inf")
+        regressed = ratio > 1 + threshold and new["median"] - old["median"] > min_delta
+        rows.append((name, old["median"], new["median"], ratio, regressed))
+    return rows
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DeepSese hot path benchmarks")
+    parser.add_argument("--quick", action="store_true", help="Small sizes (CI / smoke runs)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (after one warmup)")
+    parser.add_argument("--only", nargs="*", help="Run only cases whose name starts with one of these")
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads for the run")
+    parser.add_argument("--out", type=str, default=os.path.join(ROOT, "benchmarks", "results.json"),
+                        help="Result file (JSON)")
+    parser.add_argument("--baseline", type=str, default=None, help="Result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown vs baseline (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    mode = "quick" if args.quick else "full"
+    tmp_dir = tempfile.mkdtemp(prefix="deepsese_bench_")
+    try:
+        suite = Suite(SIZES[mode], max(1, args.repeat), args.only, tmp_dir)
+        results = suite.run()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {"env": environment(), "mode": mode, "results": results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("mode") != mode:
+            print(f"[WARN] Baseline was run in '{baseline.get('mode')}' mode, this run in '{mode}'")
+        rows = compare(results, baseline["results"], args.threshold)
+        print("========================================")
+        for name, old, new, ratio, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"   {name:<40} {old * 1000:10.2f} -> {new * 1000:10.2f} ms  x{ratio:.2f}{flag}")
+        regressions = [row for row in rows if row[4]]
+        if regressions:
+            print(f"[ERROR] {len(regressions)} case(s) slower than baseline by more than {args.threshold:.0%}")
+            return 1
+        print(f"[INFO] No regression above {args.threshold:.0%} ({len(rows)} cases compared)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# benchmarks/tiny.py
+
+import json
+import os
+import tempfile
+import time
+import torch
+
+##### Section I : Tiny SDXL Pipeline #####
+
+def _byte_chars():
+    """The 256 printable characters byte-level BPE uses for bytes (GPT-2 / CLIP mapping)."""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    chars, extra = [], 0
+    for b in range(256):
+        if b in printable:
+            chars.append(chr(b))
+        else:
+            chars.append(chr(256 + extra))
+            extra += 1
+    return chars
+
+def _write_tokenizer(path, vocab_size=1000):
+    """Byte-level BPE vocab with one entry per character (no merges), enough for CLIPTokenizer."""
+    chars = _byte_chars()
+    vocab = {}
+    for token in chars + [c + "</w>" for c in chars] + ["<|startoftext|>", "<|endoftext|>"]:
+        if token not in vocab and len(vocab) < vocab_size:
+            vocab[token] = len(vocab)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(path, "merges.txt"), "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+    return vocab
+
+def build_tiny_pipeline(seed=0, tmp_dir=None):
+    """
+    Randomly initialized StableDiffusionXLPipeline with the real SDXL structure (two text
+    encoders, text_time conditioning, 4-channel latents, 8x VAE) but tiny widths, so every
+    component runs the same code paths as the checkpoint in milliseconds instead of seconds.
+    """
+    from diffusers import (AutoencoderKL, EulerAncestralDiscreteScheduler,
+                           StableDiffusionXLPipeline, UNet2DConditionModel)
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
+
+    torch.manual_seed(seed)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 1),
+        projection_class_embeddings_input_dim=80,  # 6 * 8 + 32
+        cross_attention_dim=64,
+        norm_num_groups=8,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64, 64, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 4,
+        up_block_types=["UpDecoderBlock2D"] * 4,
+        latent_channels=4,
+        norm_num_groups=8,
+        sample_size=128,
+    )
+    text_config = dict(
+        bos_token_id=512, eos_token_id=513, pad_token_id=513, hidden_size=32, intermediate_size=37,
+        layer_norm_eps=1e-05, num_attention_heads=4, num_hidden_layers=2, vocab_size=1000,
+        hidden_act="gelu", projection_dim=32,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(**text_config))
+    text_encoder_2 = CLIPTextModelWithProjection(CLIPTextConfig(**text_config))
+
+    tok_dir = tempfile.mkdtemp(prefix="tiny_tok_", dir=tmp_dir)
+    _write_tokenizer(tok_dir)
+    tokenizer = CLIPTokenizer(os.path.join(tok_dir, "vocab.json"), os.path.join(tok_dir, "merges.txt"),
+                              model_max_length=77)
+    scheduler = EulerAncestralDiscreteScheduler(
+        beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear", steps_offset=1,
+        timestep_spacing="leading",
+    )
+    return StableDiffusionXLPipeline(
+        vae=vae, text_encoder=text_encoder, text_encoder_2=text_encoder_2, tokenizer=tokenizer,
+        tokenizer_2=tokenizer, unet=unet, scheduler=scheduler,
+    )
+
+##### Section II : Stub Pipeline #####
+
+class StubOutput:
+    def __init__(self, images):
+        self.images = images
+
+class StubPipeline:
+    """
+    Deterministic stand-in for every SDXL variant: costs `step_cost` seconds per denoising
+    step and image (img2img runs int(steps * strength) steps, like diffusers), and returns
+    seed-derived images or latents. Isolates the orchestration around the model (batching,
+    tiling, blending, I/O) from the model itself.
+    """
+    def __init__(self, step_cost=0.002):
+        self.step_cost = step_cost
+        self.steps_run = 0
+
+    def encode_prompt(self, prompt=None, negative_prompt=None, **kwargs):
+        return torch.zeros(1, 77, 2048), torch.zeros(1, 77, 2048), torch.zeros(1, 1280), torch.zeros(1, 1280)
+
+    def __call__(self, num_inference_steps=50, strength=1.0, generator=None, image=None,
+                 height=None, width=None, output_type="pil", **kwargs):
+        import numpy as np
+        from PIL import Image
+
+        seeds = [g.initial_seed() for g in generator] if generator else [0]
+        steps = num_inference_steps if image is None else int(num_inference_steps * strength)
+        self.steps_run += steps * len(seeds)
+        time.sleep(self.step_cost * steps * len(seeds))
+
+        if isinstance(image, list):
+            # img2img on PIL inputs (SR tiles): identity refine
+            return StubOutput([img.copy() for img in image])
+        if isinstance(image, torch.Tensor):
+            height, width = image.shape[-2] * 8, image.shape[-1] * 8
+        if output_type == "latent":
+            return StubOutput(torch.zeros(len(seeds), 4, height // 8, width // 8))
+
+        images = []
+        for seed in seeds:
+            rng = np.random.default_rng(seed)
+            # Smooth gradient + mild noise: compresses like a photo, unlike pure noise
+            ramp = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+            pixels = ramp + rng.normal(0, 8, (height, width, 3)).astype(np.float32)
+            images.append(Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)))
+        return StubOutput(images)
+
+def stub_registry(step_cost=0.002):
+    """PipelineRegistry whose text2img / img2img variants are one StubPipeline."""
+    from src.t2i import t2i
+
+    pipe = StubPipeline(step_cost)
+    registry = t2i.PipelineRegistry(pipe)
+    registry._variants.update(text2img=pipe, img2img=pipe)
+    return registry
@@ -12,6 +12,8 @@ MODEL_DIR = os.path.join(ROOT_DIR, "mod")
 OUTPUT_DIR_T2I = os.path.join(ROOT_DIR, "output/txt2img")
 # SR Output
 OUTPUT_DIR_SR = os.path.join(ROOT_DIR, "output/sr")
+# Caches (prompt embeddings, file digests, ...)
+CACHE_DIR = os.path.join(ROOT_DIR, "cache")
 
 # Step 2 : Define specific file paths
 MODEL_FILENAME = "hardcoreAsianCosplay_ilV11.safetensors"
@@ -26,6 +28,13 @@ IMAGE_WIDTH = 1024
 # T2I - Stage 1
 BASE_FILENAME_PREFIX = "cos"
 NUM_IMAGES_TO_GENERATE = 10
+# Images per pipeline call (each keeps its own seed)
+T2I_BATCH_SIZE = 1
+# Halve the batch and retry when a batch runs out of memory
+T2I_ADAPTIVE_BATCH = True
+# Fixed base seed (image n uses T2I_SEED + n - 1) makes reruns skip finished images.
+# None = random seeds per batch (an interrupted batch is still resumed with its seeds).
+T2I_SEED = None
 BASE_INFERENCE_STEPS = 30
 BASE_GUIDANCE_SCALE = 7.0
 
@@ -33,6 +42,10 @@ BASE_GUIDANCE_SCALE = 7.0
 REFINE_INFERENCE_STEPS = 50
 REFINE_GUIDANCE_SCALE = 4.0
 REFINE_STRENGTH = 0.4
+# Pass stage 1 latents straight to stage 2 instead of a VAE decode -> 8-bit PIL -> re-encode
+T2I_LATENT_HANDOFF = True
+# Also decode and save the stage 1 image ({prefix}_{n}_base.png)
+T2I_SAVE_BASE = False
 
 # SDXL Specifics
 TARGET_SIZE = (IMAGE_HEIGHT, IMAGE_WIDTH)
@@ -42,14 +55,216 @@ NEGATIVE_ORIGINAL_SIZE = (512, 512)
 ##### Section III : SR Configuration #####
 
 # Step 1 : Upscaling Dimensions
-# 1024 -> 1920 (approx 1.875x)
+# The long side of the input is scaled to SR_TARGET_SIZE (aspect ratio is kept),
+# e.g. 1024x1024 -> 1920x1920 (approx 1.875x), 832x1216 -> 1312x1920.
 SR_TARGET_SIZE = 1920
+# Set a fixed factor (e.g. 2.0) to scale by it instead of SR_TARGET_SIZE
+SR_SCALE = None
 SR_TILE_SIZE = 1024
-# Overlap is calculated: (1024 * 2) - 1920 = 2048 - 1920 = 128 pixels
+# Minimum overlap between neighbouring tiles. The planner picks the smallest
+# grid that keeps at least this overlap, e.g. for 1920: (1024 * 2) - 1920 = 128 pixels
 SR_OVERLAP = 128
 
 # Step 2 : Refinement Parameters (Per Tile)
 # We use a lower strength to preserve the original structure while adding details
 SR_STRENGTH = 0.2
 SR_GUIDANCE_SCALE = 4.0
-SR_INFERENCE_STEPS = 40
\ No newline at end of file
+SR_INFERENCE_STEPS = 40
+
+# Step 3 : Tile Batching
+# Number of tiles sent to the pipeline per call (one batch).
+# 0 = choose automatically from the memory available on the device.
+SR_TILE_BATCH_SIZE = 0
+# Rough working memory of one 1024x1024 tile in a half precision pass (CFG included).
+# Scaled by tile area, doubled for float32. Used by the automatic batch size only.
+SR_TILE_MEMORY_MB = 2048
+# Tile i always uses seed SR_SEED + i, so the output does not depend on the batch size
+SR_SEED = 42
+
+# Step 4 : Blending Canvas
+# "memory": float canvas + weight map in RAM (fastest for the default 1920 target)
+# "memmap": canvas backed by temporary files in SR_CANVAS_DIR, finalized band by band into the PNG encoder
+# "stream": only the rows still covered by upcoming tiles stay in RAM; finished rows are encoded
+#           immediately, so peak memory is bounded by the tile size instead of the output size.
+# "memmap" and "stream" always write PNG.
+SR_CANVAS_MODE = "memory"
+# "float32", or "float16" to halve the accumulator (~0.25 level precision near white)
+SR_CANVAS_DTYPE = "float32"
+# Directory for "memmap" files (None = system temp dir)
+SR_CANVAS_DIR = None
+# Rows normalized / encoded per band
+SR_CANVAS_BAND_ROWS = 256
+
+# Step 5 : Tile Masks
+# Fade shape across the overlap: "linear", "cosine" or "gaussian"
+SR_MASK_RAMP = "linear"
+# Masks only depend on (tile size, overlap, faded sides, ramp) and are cached for the whole run
+# (at most this many, 0 = no cache; read at each lookup, so --set and per-job configs apply)
+SR_MASK_CACHE_SIZE = 32
+
+# Step 6 : Content-Adaptive Tiles
+# Detail of a tile = RMS luminance gradient of its Lanczos upscale (levels per pixel): close to 0
+# for walls, sky or bed sheets, 10+ for hair, fabric and skin texture.
+# Tiles below SR_SKIP_DETAIL keep the Lanczos pixels (no diffusion); tiles below SR_REDUCE_DETAIL
+# are refined with SR_STRENGTH * SR_REDUCED_STRENGTH_SCALE (img2img then also runs fewer steps).
+# Both still blend through the tile masks. Opt-in (it changes the output): False = every tile
+# gets the full pass; enable per run with --set SR_ADAPTIVE=true.
+SR_ADAPTIVE = False
+SR_SKIP_DETAIL = 1.5
+SR_REDUCE_DETAIL = 4.0
+SR_REDUCED_STRENGTH_SCALE = 0.5
+
+##### Section IV : Cache Configuration #####
+
+# Step 1 : Prompt Embeddings
+# Text encoder outputs are keyed by (model hash, prompt, negative prompt, clip skip)
+PROMPT_CACHE_SIZE = 16
+# Also store them as safetensors in CACHE_DIR/prompt, shared across runs
+PROMPT_CACHE_PERSIST = True
+# Number of CLIP layers to skip (None = pipeline default)
+CLIP_SKIP = None
+
+##### Section V : Server Configuration #####
+
+# `main.py --serve` keeps the pipeline resident and accepts jobs on localhost only
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8765
+# Finished jobs kept in memory for status queries
+SERVE_MAX_FINISHED_JOBS = 1000
+
+##### Section VI : I/O Configuration #####
+
+# Outputs are encoded / saved on background threads while the next image is generated
+IO_WRITER_THREADS = 2
+# Max images waiting to be written; generation blocks beyond that (bounds memory)
+IO_MAX_PENDING_WRITES = 4
+# SR inputs decoded + Lanczos upscaled ahead of the one being diffused
+SR_PREFETCH_DEPTH = 2
+
+##### Section VII : Run Manifest #####
+
+# Record every job in <output dir>/manifest.jsonl (key, seed, params, status, output path).
+# Completed jobs are skipped and interrupted batches are resumed; outputs get content-addressed names.
+MANIFEST_ENABLED = True
+
+##### Section VIII : Worker Processes #####
+
+# Processes for --t2i / --sr, each with its own pipeline (1 = run in this process).
+# Workers are spread over the CUDA devices, or get an equal slice of the CPU cores
+WORKER_COUNT = 1
+# "spawn" is the only start method that is safe with CUDA and with torch thread pools
+WORKER_START_METHOD = "spawn"
+
+##### Section IX : Profiling #####
+
+# Trace every stage (model load, prompt encode, diffusion stages, SR tiles, merge, save) and
+# print a per-stage summary at the end of the run (also enabled by main.py --profile)
+PROFILE_ENABLED = False
+# "jsonl" (one event per line) or "chrome" (chrome://tracing / Perfetto)
+PROFILE_FORMAT = "jsonl"
+PROFILE_DIR = os.path.join(ROOT_DIR, "output/profile")
+# Per denoising step events via the pipeline step callback
+PROFILE_STEPS = True
+# Python heap peaks per stage (tracemalloc slows down allocation-heavy Python code)
+PROFILE_TRACEMALLOC = True
+
+##### Section X : Model Cache #####
+
+# The single-file checkpoint is converted once into a diffusers-layout safetensors cache
+# (MODEL_CACHE_DIR/<name>-<checkpoint hash>-<dtype>) that later starts memory-map instead of
+# converting again. A changed checkpoint gets a new entry and the old one is removed.
+MODEL_CACHE_ENABLED = True
+MODEL_CACHE_DIR = os.path.join(ROOT_DIR, "mod_cache")
+
+##### Section XI : Triage #####
+
+# `main.py --t2i --nums N --keep K` drafts N candidates cheaply (stage 1 only, TRIAGE_STEPS steps),
+# scores them and runs the full two-stage pipeline on the best K seeds only.
+# Drafts use the same seeds, so a kept image follows the composition of its preview.
+TRIAGE_KEEP = 0
+TRIAGE_STEPS = 10
+# Draft resolution relative to IMAGE_WIDTH x IMAGE_HEIGHT. Below 1.0 is cheaper, but the
+# initial noise has another shape, so previews only roughly match the final images.
+TRIAGE_SCALE = 1.0
+# "latent": approximate RGB straight from the latents (no VAE decode, 1/8 resolution)
+# "vae": full VAE decode of the drafts
+TRIAGE_PREVIEW = "latent"
+# Metric weights; every metric is ranked across the candidates, so weights are comparable
+TRIAGE_WEIGHTS = {"sharpness": 1.0, "exposure": 1.0, "scorer": 1.0}
+# Extra scorer "package.module:function", called as function(image, seed) -> float (higher is better)
+TRIAGE_SCORER = None
+# Save the previews and the scores (OUTPUT_DIR_T2I/triage)
+TRIAGE_SAVE_PREVIEWS = True
+
+##### Section XII : Device Profiles #####
+
+# How the pipeline is placed and run (main.py --device-profile overrides):
+# "gpu_lowvram"  : fp16, model CPU offload, VAE slicing + tiling (8GB cards, e.g. RTX 4060)
+# "gpu_highvram" : fp16, everything resident on the GPU, channels_last, no offload hooks
+# "cpu"          : fp32 weights with bf16 autocast (if the CPU supports it), channels_last,
+#                  tuned threads, no offload hooks
+# "auto"         : cpu without CUDA, else by the total VRAM of the device
+DEVICE_PROFILE = "auto"
+GPU_HIGHVRAM_MIN_GB = 16
+CPU_AUTOCAST_BF16 = True
+CPU_CHANNELS_LAST = True
+# torch.compile the UNet (slow first call, faster steps afterwards: pays off for long runs)
+CPU_COMPILE_UNET = False
+# Intra-op threads (0 = every core this process may use) and inter-op threads (0 = torch default)
+CPU_THREADS = 0
+CPU_INTEROP_THREADS = 1
+# Override the offload strategy / VAE tiling of the profile (None = profile default).
+# DEVICE_OFFLOAD: "none", "model" (components move to the GPU while they run) or
+# "sequential" (layer by layer: least VRAM, slowest). Set by --mem-budget.
+DEVICE_OFFLOAD = None
+DEVICE_VAE_TILING = None
+
+##### Section XIII : Parameter Sweeps #####
+
+# `main.py --t2i --nums N --sweep refine_strength=0.3,0.4,0.5` runs stage 1 once per seed and
+# refine / SR once per setting, then writes a comparison grid per seed (OUTPUT_DIR_T2I/sweep_<time>).
+# Also keep the stage 1 latents in CACHE_DIR/stage1, so later sweeps of the same seeds skip stage 1
+SWEEP_CACHE_DISK = True
+# Longest side of a cell in the comparison grid
+SWEEP_THUMB_SIZE = 384
+
+##### Section XIV : Fused T2I -> SR #####
+
+# `main.py --t2i --sr --nums N` generates and upscales on one model load; refined images go
+# straight into SR in memory and only the SR result is written (OUTPUT_DIR_SR).
+# Also write the refined T2I images (OUTPUT_DIR_T2I; base images too with T2I_SAVE_BASE)
+FUSED_SAVE_INTERMEDIATES = False
+
+##### Section XV : Hot Folder #####
+
+# `main.py --sr --folder DIR --watch` keeps the model loaded and upscales images as they appear
+# anywhere below DIR (Ctrl+C / SIGTERM stops after the current image).
+WATCH_POLL_SECONDS = 2.0
+# A file counts as complete once its size and mtime have not changed for this long
+WATCH_SETTLE_SECONDS = 3.0
+# Polls only re-list directories whose mtime changed. A periodic full walk also catches files
+# rewritten in place (0 = never)
+WATCH_FULL_SCAN_SECONDS = 600
+# Also upscale the images already in the folder when the watch starts
+WATCH_EXISTING = True
+
+##### Section XVI : Memory Budget #####
+
+# `main.py --mem-budget GB` picks the T2I batch size, SR tile size / tile batch, VAE tiling and
+# offload strategy that fit GB of device memory (RAM on the cpu profile), from the cost model
+# below. 0 = off: the device profile and the settings above decide.
+MEM_BUDGET_GB = 0.0
+# Cost model (MB, half precision; doubled for float32): the resident pipeline, what model /
+# sequential offload keeps on the device, and the VAE decode of a 1024x1024 image untiled / tiled.
+# Denoising costs SR_TILE_MEMORY_MB per 1024x1024 image.
+MEM_PIPELINE_MB = 7000
+MEM_MODEL_OFFLOAD_MB = 5000
+MEM_SEQUENTIAL_OFFLOAD_MB = 600
+MEM_VAE_DECODE_MB = 3072
+MEM_VAE_TILED_MB = 512
+# Largest batch and smallest SR tile the planner may pick
+MEM_MAX_BATCH = 8
+MEM_MIN_TILE_SIZE = 512
+# On out-of-memory, retry the same job one step down the ladder (smaller batch / tile batch,
+# VAE tiling, model offload, sequential offload) instead of dropping it
+MEM_OOM_FALLBACK = True
@@ -0,0 +1,249 @@
+# src/conf/runtime.py
+
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+from src.conf import conf
+
+# Environment variables DEEPSESE_<NAME> override conf.<NAME>
+ENV_PREFIX = "DEEPSESE_"
+
+# Settings whose conf.py default is None: their type when set
+OPTIONAL_TYPES = {
+    "T2I_SEED": int,
+    "SR_SCALE": float,
+    "SR_CANVAS_DIR": str,
+    "CLIP_SKIP": int,
+    "TRIAGE_SCORER": str,
+    "DEVICE_OFFLOAD": str,
+    "DEVICE_VAE_TILING": bool,
+}
+
+# Settings fixed when the pipeline is loaded: a resident pipeline cannot change them per job
+LOAD_TIME_PREFIXES = ("MODEL_", "DEVICE_", "GPU_", "CPU_", "SERVE_", "WORKER_")
+LOAD_TIME_PARAMS = {"ROOT_DIR", "MODEL_DIR", "MEM_BUDGET_GB"}
+
+# Settings conf.py derives from others, in dependency order. They follow their base settings
+# unless they were set explicitly (or already differ from the derived value).
+DERIVED = (
+    ("MODEL_DIR", lambda v: os.path.join(v["ROOT_DIR"], "mod")),
+    ("OUTPUT_DIR_T2I", lambda v: os.path.join(v["ROOT_DIR"], "output/txt2img")),
+    ("OUTPUT_DIR_SR", lambda v: os.path.join(v["ROOT_DIR"], "output/sr")),
+    ("CACHE_DIR", lambda v: os.path.join(v["ROOT_DIR"], "cache")),
+    ("PROFILE_DIR", lambda v: os.path.join(v["ROOT_DIR"], "output/profile")),
+    ("MODEL_CACHE_DIR", lambda v: os.path.join(v["ROOT_DIR"], "mod_cache")),
+    ("MODEL_PATH", lambda v: os.path.join(v["MODEL_DIR"], v["MODEL_FILENAME"])),
+    ("TARGET_SIZE", lambda v: (v["IMAGE_HEIGHT"], v["IMAGE_WIDTH"])),
+    ("ORIGINAL_SIZE", lambda v: (v["IMAGE_HEIGHT"] * 2, v["IMAGE_WIDTH"] * 2)),
+)
+
+# conf is process-wide: one config is applied at a time (re-entrant for nested tasks)
+_apply_lock = threading.RLock()
+_apply_depth = 0
+# (applying thread, conf values outside its apply()); None when no config is applied
+_outside = None
+
+##### Section I : Values #####
+
+def setting_names():
+    return sorted(name for name in dir(conf) if name.isupper())
+
+def setting_type(name):
+    """Type of a setting, from its conf.py default (OPTIONAL_TYPES for None defaults)."""
+    if name in OPTIONAL_TYPES:
+        return OPTIONAL_TYPES[name]
+    return type(getattr(conf, name))
+
+def is_load_time(name):
+    return name in LOAD_TIME_PARAMS or name.startswith(LOAD_TIME_PREFIXES)
+
+def coerce(name, value):
+    """
+    Converts `value` (JSON value, or a string from the environment / CLI) to the type of
+    setting `name`. Raises ValueError for unknown settings and values of the wrong type.
+    """
+    name = name.upper()
+    if not hasattr(conf, name) or not name.isupper():
+        raise ValueError(f"Unknown setting: {name}")
+    kind = setting_type(name)
+    if isinstance(value, str) and kind is not str:
+        text = value.strip()
+        if text.lower() in ("none", "null", ""):
+            value = None
+        elif kind is bool:
+            if text.lower() not in ("1", "0", "true", "false", "yes", "no", "on", "off"):
+                raise ValueError(f"{name} must be true or false, got {value!r}")
+            value = text.lower() in ("1", "true", "yes", "on")
+        elif kind in (tuple, list, dict):
+            # "1024,1024" or JSON
+            try:
+                value = json.loads(text)
+            except ValueError:
+                value = [int(v) if v.strip().lstrip("-").isdigit() else float(v) for v in text.split(",")]
+        else:
+            try:
+                value = kind(float(text)) if kind is int and "." in text else kind(text)
+            except ValueError:
+                raise ValueError(f"{name} must be {kind.__name__}, got {value!r}")
+
+    if value is None:
+        if getattr(conf, name) is not None and name not in OPTIONAL_TYPES:
+            raise ValueError(f"{name} cannot be None")
+        return None
+    if kind is tuple and isinstance(value, list):
+        return tuple(value)
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if kind is int and isinstance(value, float) and value.is_integer():
+        return int(value)
+    if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+        raise ValueError(f"{name} must be {kind.__name__}, got {value!r}")
+    return value
+
+##### Section II : Runtime Config #####
+
+class RuntimeConfig:
+    """
+    Typed set of every conf setting. Built from conf.py and layered with overrides
+    (file < environment < CLI < per job); override() returns a new config, the object itself
+    is read-only. Settings read as attributes: config.SR_TILE_SIZE.
+
+    The tasks read their settings from the conf module, so a config is not passed down through
+    every function: apply() swaps its values into conf while a task runs (one config at a time,
+    see apply), which lets one resident pipeline serve jobs with different settings.
+    """
+    def __init__(self, values=None):
+        # Based on the process-wide settings, not on a job config another thread has applied
+        outside = _outside[1] if _outside and _outside[0] != threading.get_ident() else {}
+        base = {name: outside[name] if name in outside else getattr(conf, name) for name in setting_names()}
+        base.update(values or {})
+        object.__setattr__(self, "_values", base)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RuntimeConfig is read-only, use override()")
+
+    def __eq__(self, other):
+        return isinstance(other, RuntimeConfig) and self._values == other._values
+
+    def to_dict(self):
+        return dict(self._values)
+
+    def diff(self, other=None):
+        """Settings that differ from `other` (default: the active conf)."""
+        other = other or RuntimeConfig()
+        return {name: value for name, value in self._values.items() if other._values.get(name) != value}
+
+    def override(self, values, load_time=True):
+        """
+        New config with `values` ({name: value}, names case-insensitive, values coerced).
+        Derived settings (paths, SDXL size conditioning) follow their base settings.
+        load_time=False rejects settings a loaded pipeline cannot change (see is_load_time).
+        """
+        values = {name.upper(): coerce(name, value) for name, value in (values or {}).items()}
+        if not load_time:
+            fixed = sorted(name for name in values if is_load_time(name))
+            if fixed:
+                raise ValueError(f"Cannot change {', '.join(fixed)} per job: they are fixed when the model is loaded")
+        merged = dict(self._values)
+        merged.update(values)
+        for name, derive in DERIVED:
+            if name not in values and self._values[name] == derive(self._values):
+                merged[name] = derive(merged)
+        return RuntimeConfig(merged)
+
+    @classmethod
+    def from_file(cls, path, base=None):
+        """Overrides from a JSON file: {"IMAGE_WIDTH": 832, "sr_tile_size": 768, ...}."""
+        with open(path, "r", encoding="utf-8") as f:
+            values = json.load(f)
+        if not isinstance(values, dict):
+            raise ValueError(f"{path}: expected a mapping of setting -> value")
+        return (base or cls()).override(values)
+
+    @classmethod
+    def from_env(cls, base=None, environ=None):
+        """Overrides from DEEPSESE_<NAME> environment variables."""
+        environ = os.environ if environ is None else environ
+        values = {key[len(ENV_PREFIX):]: value for key, value in environ.items()
+                  if key.startswith(ENV_PREFIX) and key[len(ENV_PREFIX):].isupper()}
+        return (base or cls()).override(values)
+
+    @classmethod
+    def from_args(cls, assignments, base=None):
+        """Overrides from ["NAME=VALUE", ...] (main.py --set)."""
+        values = {}
+        for assignment in assignments or []:
+            name, sep, value = assignment.partition("=")
+            if not sep or not name.strip():
+                raise ValueError(f"Setting must look like NAME=VALUE: {assignment!r}")
+            values[name.strip()] = value
+        return (base or cls()).override(values)
+
+    def validate(self, tasks=("t2i", "sr")):
+        """Problems of this config for `tasks` (empty if usable), checked before any model work."""
+        from src.t2i import t2i
+        from src.sr import sr
+
+        problems = []
+        with self.apply():
+            if "t2i" in tasks:
+                problems += t2i.check_config()
+            if "sr" in tasks:
+                problems += sr.check_config()
+                if not problems:
+                    # Tile grid of the SR output of a T2I image (the usual SR input)
+                    out_w, out_h = sr.get_output_size(self.IMAGE_WIDTH, self.IMAGE_HEIGHT)
+                    if out_w < self.IMAGE_WIDTH or out_h < self.IMAGE_HEIGHT:
+                        problems.append(f"SR output {out_w}x{out_h} is smaller than the T2I image "
+                                        f"{self.IMAGE_WIDTH}x{self.IMAGE_HEIGHT} (SR_TARGET_SIZE / SR_SCALE)")
+                    problems += sr.check_coverage(out_w, out_h)
+        return problems
+
+    @contextmanager
+    def apply(self):
+        """
+        Makes this config the active conf inside the block (restored afterwards).
+        conf is process-wide state: the block holds a lock, so a config applied by another
+        thread waits until this one is restored (nesting in one thread is fine). Threads a task
+        starts inside the block see its settings; other threads should not read conf meanwhile.
+        """
+        global _apply_depth, _outside
+        with _apply_lock:
+            old = {name: getattr(conf, name) for name in self._values if hasattr(conf, name)}
+            if _apply_depth == 0:
+                _outside = (threading.get_ident(), old)
+            _apply_depth += 1
+            try:
+                for name, value in self._values.items():
+                    setattr(conf, name, value)
+                yield self
+            finally:
+                for name, value in old.items():
+                    setattr(conf, name, value)
+                _apply_depth -= 1
+                if _apply_depth == 0:
+                    _outside = None
+
+    def install(self):
+        """Makes this config the process-wide conf for good (at startup, before tasks and threads)."""
+        with _apply_lock:
+            if _apply_depth:
+                raise RuntimeError("Cannot install a config while another one is applied")
+            for name, value in self._values.items():
+                setattr(conf, name, value)
+
+def load(config_file=None, assignments=None, environ=None):
+    """conf.py, then the config file, the environment and CLI assignments (later wins)."""
+    config = RuntimeConfig()
+    if config_file:
+        config = RuntimeConfig.from_file(config_file, base=config)
+    config = RuntimeConfig.from_env(base=config, environ=environ)
+    return RuntimeConfig.from_args(assignments, base=config)
@@ -1,6 +1,7 @@
 # src/main.py
 
 import argparse
+import json
 import sys
 import os
 
@@ -29,31 +30,270 @@ def main():
     # Define arguments
     parser.add_argument("--t2i", action="store_true", help="Run Text-to-Image generation task")
     parser.add_argument("--nums", type=int, default=None, help="Number of images to generate (T2I)")
+    parser.add_argument("--keep", type=int, default=None, help="Triage: draft --nums candidates cheaply and fully generate only the best KEEP (T2I, default: conf.TRIAGE_KEEP)")
+    parser.add_argument("--sweep", action="append", metavar="NAME=V1,V2", help="Compare refine/SR settings on --nums seeds, e.g. refine_strength=0.3,0.4,0.5 (repeatable: full grid)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Images per pipeline call (T2I, default: conf.T2I_BATCH_SIZE)")
     
+    parser.add_argument("--prompts", nargs="+", metavar="PATH", help="Run T2I for these prompt modules / folders (e.g. prompt/), --nums images each, one model load")
+    parser.add_argument("--jobs", type=str, metavar="FILE", help="Run T2I for a JSON job file mapping prompt modules to image counts")
+
     parser.add_argument("--sr", action="store_true", help="Run Super-Resolution task")
     parser.add_argument("--file", type=str, help="Single file path for SR")
     parser.add_argument("--folder", type=str, help="Folder path for SR")
+    parser.add_argument("--watch", action="store_true", help="With --sr --folder, keep the model loaded and upscale new images below the folder as they arrive (Ctrl+C stops)")
+
+    parser.add_argument("--save-intermediates", action="store_true", help="With --t2i --sr, also save the refined T2I images (default: conf.FUSED_SAVE_INTERMEDIATES)")
+
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --t2i/--sr, one pipeline each (default: conf.WORKER_COUNT)")
+
+    parser.add_argument("--config", type=str, metavar="FILE", help="JSON file of setting overrides, e.g. {\"IMAGE_WIDTH\": 832} (after conf.py, before DEEPSESE_<NAME> env vars)")
+    parser.add_argument("--set", action="append", metavar="NAME=VALUE", help="Override a conf setting for this run (repeatable, wins over --config and env)")
+    parser.add_argument("--mem-budget", type=float, metavar="GB", default=None, help="Fit batch size, SR tile size, VAE tiling and offload to GB of device memory (RAM on cpu) (default: conf.MEM_BUDGET_GB)")
+    parser.add_argument("--device-profile", choices=["auto", "gpu_lowvram", "gpu_highvram", "cpu"], default=None, help="Execution profile of the pipeline (default: conf.DEVICE_PROFILE)")
+    parser.add_argument("--convert-model", action="store_true", help="Convert the checkpoint into the fast-load model cache (conf.MODEL_CACHE_DIR) and exit")
+    parser.add_argument("--dry-run", action="store_true", help="Validate settings and print the plan of the --t2i/--sr task without loading the model")
+    parser.add_argument("--profile", action="store_true", help="Trace every stage and print a per-stage summary (conf.PROFILE_*)")
+    parser.add_argument("--profile-format", choices=["jsonl", "chrome"], default=None, help="Trace file format (default: conf.PROFILE_FORMAT)")
+
+    parser.add_argument("--serve", action="store_true", help="Keep the model loaded and accept jobs on localhost")
+    parser.add_argument("--submit", action="store_true", help="Send the --t2i/--sr task to a running server instead of loading the model")
+    parser.add_argument("--priority", type=int, default=0, help="Job priority for --submit (higher runs first)")
+    parser.add_argument("--wait", action="store_true", help="With --submit, wait until the job has finished")
+    parser.add_argument("--status", type=str, metavar="JOB_ID", help="Show the status of a submitted job")
+    parser.add_argument("--port", type=int, default=None, help="Server port (default: conf.SERVE_PORT)")
 
     args = parser.parse_args()
 
+    from src.conf import runtime
+    try:
+        config = runtime.load(args.config, args.set)
+        if args.device_profile:
+            config = config.override({"DEVICE_PROFILE": args.device_profile})
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Invalid configuration: {e}")
+        sys.exit(1)
+    # Sent along with --submit, applied by the server to that job only
+    args.overrides = config.diff()
+
+    problems = check_args(args, config)
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        sys.exit(1)
+
+    tasks = [task for task in ("t2i", "sr") if getattr(args, task)]
+    # The memory budget is fixed when the model loads: settings are planned before any job
+    if args.mem_budget is not None:
+        config = config.override({"MEM_BUDGET_GB": args.mem_budget})
+    if config.MEM_BUDGET_GB and (tasks or args.serve) and not (args.submit or args.dry_run):
+        from src.utils import budget
+        # Settings the user chose are kept, the rest is planned around them
+        explicit = set(args.overrides)
+        if args.batch_size:
+            config = config.override({"T2I_BATCH_SIZE": args.batch_size})
+            explicit.add("T2I_BATCH_SIZE")
+        try:
+            config = budget.fit(config, explicit=explicit)
+        except ValueError as e:
+            print(f"[ERROR] Invalid configuration: {e}")
+            sys.exit(1)
+
+    # Validate up front, before any model is loaded
+    if tasks and not (args.submit or args.dry_run):
+        problems = config.validate(tasks)
+        if problems:
+            for problem in problems:
+                print(f"[ERROR] {problem}")
+            sys.exit(1)
+
+    # Process-wide: worker processes and the server (and its per-job configs) start from it
+    config.install()
+    tracer = start_profiling(args)
+    try:
+        dispatch(parser, args)
+    finally:
+        if tracer is not None:
+            from src.utils import trace
+            trace.disable()
+            tracer.print_summary()
+            print(f"[PROFILE] Trace written to {tracer.path}")
+
+def check_args(args, config):
+    """Flag combinations a task would silently ignore. Returns the problems (empty if none)."""
+    problems = []
+    parallel = args.workers is not None and args.workers > 1
+    library = (args.prompts or args.jobs) and not (args.t2i and args.sr)
+    triage = args.t2i and not args.sr and not args.sweep and not library and (args.keep or config.TRIAGE_KEEP)
+    if library and parallel:
+        problems.append("--workers is not supported with --prompts / --jobs: the library runs on one pipeline")
+    if library and args.dry_run:
+        problems.append("--dry-run does not support --prompts / --jobs")
+    if args.t2i and args.sr and parallel:
+        problems.append("--workers is not supported with --t2i --sr: the fused run uses one pipeline")
+    if args.t2i and args.sr and args.dry_run:
+        problems.append("--dry-run does not support --t2i --sr: it would plan T2I-only jobs")
+    if args.t2i and args.sr and args.submit:
+        problems.append("--submit does not support --t2i --sr: the server has no fused job type")
+    sweep = args.sweep and args.t2i and not args.sr and not library
+    if sweep and parallel:
+        problems.append("--workers is not supported with --sweep: the sweep shares stage 1 results on one pipeline")
+    if sweep and args.dry_run:
+        problems.append("--dry-run does not support --sweep")
+    if triage and parallel:
+        problems.append("--workers is not supported with triage (--keep / TRIAGE_KEEP): it runs on one pipeline")
+    if triage and args.dry_run:
+        problems.append("--dry-run does not support triage (--keep / TRIAGE_KEEP)")
+    watching = args.sr and args.watch and not args.t2i
+    if watching and parallel:
+        problems.append("--workers is not supported with --watch: the hot folder runs on one pipeline")
+    if watching and args.dry_run:
+        problems.append("--dry-run does not support --watch")
+    if watching and args.submit:
+        problems.append("--submit does not support --watch: the server would upscale the folder once")
+    # Client mode: the server only runs plain t2i / sr jobs
+    if args.submit and parallel:
+        problems.append("--workers is not supported with --submit: the server runs jobs on its resident pipeline")
+    if args.submit and library:
+        problems.append("--submit does not support --prompts / --jobs: the library runs locally")
+    if args.submit and sweep:
+        problems.append("--submit does not support --sweep")
+    if args.submit and triage:
+        problems.append("--submit does not support triage (--keep / TRIAGE_KEEP)")
+    return problems
+
+def start_profiling(args):
+    """Enables tracing for local --t2i / --sr / --serve runs if --profile or conf.PROFILE_ENABLED."""
+    from src.conf import conf
+
+    if args.profile:
+        # Worker processes inherit conf, so they trace as well
+        conf.PROFILE_ENABLED = True
+    if args.profile_format:
+        conf.PROFILE_FORMAT = args.profile_format
+    if not conf.PROFILE_ENABLED or args.submit or args.status or args.dry_run:
+        return None
+    task = "serve" if args.serve else "t2i" if args.t2i else "sr" if args.sr else None
+    if task is None:
+        return None
+
+    from src.utils import trace
+    tracer = trace.start(task)
+    print(f"[PROFILE] Tracing to {tracer.path}")
+    return tracer
+
+def dispatch(parser, args):
     # Dispatch Logic
     # Note: Now we use absolute imports (src.xxx) to be consistent and safe
-    if args.t2i:
-        print("[MAIN] Mode selected: Text-to-Image (T2I)")
+    if args.serve:
+        print("[MAIN] Mode selected: Resident Server")
+        from src.serve import serve
+        serve.serve(port=args.port)
+
+    elif args.status:
+        from src.serve import serve
         try:
+            print(json.dumps(serve.get_job(args.status, port=args.port), indent=2))
+        except (OSError, RuntimeError) as e:
+            print(f"[ERROR] Could not query job {args.status}: {e}")
+            sys.exit(1)
+
+    elif args.convert_model:
+        from src.t2i import t2i
+        if t2i.convert_model() is None:
+            sys.exit(1)
+
+    elif args.dry_run and (args.t2i or args.sr):
+        if args.t2i:
             from src.t2i import t2i
-            t2i.run_task(num_images=args.nums)
+            problems = t2i.dry_run(num_images=args.nums, batch_size=args.batch_size)
+        else:
+            from src.sr import sr
+            problems = sr.dry_run(file_path=args.file, folder_path=args.folder)
+        if problems:
+            sys.exit(1)
+
+    elif args.submit and (args.t2i or args.sr):
+        from src.serve import serve
+        if args.t2i:
+            job_type, params = "t2i", {"nums": args.nums, "batch_size": args.batch_size}
+        else:
+            # The server may run in another working directory
+            job_type = "sr"
+            params = {
+                "file": os.path.abspath(args.file) if args.file else None,
+                "folder": os.path.abspath(args.folder) if args.folder else None,
+            }
+        if args.overrides:
+            params["config"] = args.overrides
+        try:
+            job = serve.submit_job(job_type, params, priority=args.priority, port=args.port)
+            print(f"[MAIN] Submitted job {job['id']} ({job_type}, priority {job['priority']})")
+            if args.wait:
+                job = serve.wait_for_job(job["id"], port=args.port)
+                print(json.dumps(job, indent=2))
+                if job["status"] == "failed":
+                    sys.exit(1)
+        except (OSError, RuntimeError) as e:
+            print(f"[ERROR] Could not reach the server: {e}")
+            sys.exit(1)
+
+    elif args.t2i and args.sr:
+        print("[MAIN] Mode selected: Fused Text-to-Image -> Super-Resolution")
+        from src.t2i import fused
+        saved = fused.run_task(num_images=args.nums, batch_size=args.batch_size,
+                               save_intermediates=args.save_intermediates or None)
+        if not saved:
+            sys.exit(1)
+
+    elif args.prompts or args.jobs:
+        print("[MAIN] Mode selected: Prompt Library (T2I)")
+        from src.conf import conf
+        from src.t2i import library
+        count = args.nums if args.nums is not None else conf.NUM_IMAGES_TO_GENERATE
+        try:
+            jobs = library.read_job_file(args.jobs) if args.jobs else []
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[ERROR] Could not read job file {args.jobs}: {e}")
+            sys.exit(1)
+        for path in args.prompts or []:
+            jobs.extend((p, count) for p in library.prompt_paths(path))
+        if not library.run_task(jobs, batch_size=args.batch_size):
+            sys.exit(1)
+
+    elif args.t2i:
+        print("[MAIN] Mode selected: Text-to-Image (T2I)")
+        try:
+            from src.conf import conf
+            if args.sweep:
+                from src.t2i import sweep
+                if sweep.run_task(args.sweep, num_images=args.nums, batch_size=args.batch_size) is None:
+                    sys.exit(1)
+            elif args.keep or conf.TRIAGE_KEEP:
+                from src.t2i import triage
+                count = args.nums if args.nums is not None else conf.NUM_IMAGES_TO_GENERATE
+                triage.run_task(count, keep=args.keep, batch_size=args.batch_size)
+            else:
+                from src.t2i import t2i
+                t2i.run_task(num_images=args.nums, batch_size=args.batch_size, workers=args.workers)
         except ImportError as e:
             print(f"[ERROR] Failed to import T2I module: {e}")
             import traceback
             traceback.print_exc()
             sys.exit(1)
             
+    elif args.sr and args.watch:
+        print("[MAIN] Mode selected: Super-Resolution Hot Folder (SR)")
+        from src.sr import watch
+        if not args.folder:
+            print("[ERROR] --watch requires --folder.")
+            sys.exit(1)
+        watch.run_task(args.folder)
+
     elif args.sr:
         print("[MAIN] Mode selected: Super-Resolution (SR)")
         try:
             from src.sr import sr
-            sr.run_task(file_path=args.file, folder_path=args.folder)
+            sr.run_task(file_path=args.file, folder_path=args.folder, workers=args.workers)
         except ImportError as e:
             print(f"[ERROR] Failed to import SR module: {e}")
             import traceback
@@ -64,6 +304,16 @@ def main():
         print("[MAIN] No valid mode selected.")
         print("Usage T2I: python src/main.py --t2i --nums 10")
         print("Usage SR : python src/main.py --sr --file 'path/to/img.png'")
+        print("Usage T2I+SR: python src/main.py --t2i --sr --nums 10")
+        print("Usage Hot: python src/main.py --sr --folder 'path/to/share' --watch")
+        print("Usage Srv: python src/main.py --serve, then python src/main.py --t2i --nums 10 --submit")
+        print("Usage Pick: python src/main.py --t2i --nums 40 --keep 5")
+        print("Usage Swp: python src/main.py --t2i --nums 2 --sweep refine_strength=0.3,0.4,0.5")
+        print("Usage Lib: python src/main.py --prompts prompt/ --nums 4")
+        print("Usage Conv: python src/main.py --convert-model")
+        print("Usage Set: python src/main.py --t2i --nums 4 --set IMAGE_WIDTH=832 --set IMAGE_HEIGHT=1216")
+        print("Usage Plan: python src/main.py --sr --folder 'path/to/dir' --dry-run")
+        print("Usage Mem: python src/main.py --t2i --sr --nums 10 --mem-budget 8")
         parser.print_help()
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+# src/serve/__init__.py
\ No newline at end of file
@@ -0,0 +1,259 @@
+# src/serve/serve.py
+
+import json
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import error, request
+
+from src.conf import conf
+
+JOB_TYPES = ("t2i", "sr")
+
+##### Section I : Job Queue #####
+
+class JobQueue:
+    """
+    Priority FIFO of jobs: higher `priority` first, submission order within a priority.
+    Every job is a dict: id, type, params, priority, status (queued/running/done/failed),
+    results (saved paths), error and timestamps.
+    """
+    def __init__(self, max_finished=1000):
+        self.max_finished = max_finished
+        self._queue = queue.PriorityQueue()
+        self._jobs = {}
+        self._finished = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def submit(self, job_type, params=None, priority=0):
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type: {job_type}")
+        if params and params.get("config"):
+            from src.conf.runtime import RuntimeConfig
+            # Names / types only: full validation runs when the job starts (on the active conf)
+            RuntimeConfig().override(params["config"], load_time=False)
+
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "type": job_type,
+            "params": dict(params or {}),
+            "priority": int(priority),
+            "status": "queued",
+            "results": [],
+            "error": None,
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+        }
+        with self._lock:
+            self._seq += 1
+            self._jobs[job["id"]] = job
+            self._queue.put((-job["priority"], self._seq, job["id"]))
+        return dict(job)
+
+    def next(self, timeout=None):
+        """Blocks for the next job and marks it running. Returns None on timeout or stop()."""
+        try:
+            _, _, job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if job_id is None:
+            return None
+
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = "running"
+            job["started"] = time.time()
+            return dict(job)
+
+    def finish(self, job_id, results=None, err=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = "failed" if err else "done"
+            job["results"] = list(results or [])
+            job["error"] = err
+            job["finished"] = time.time()
+
+            # Bound the history of finished jobs
+            self._finished.append(job_id)
+            while len(self._finished) > self.max_finished:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def stop(self):
+        """Wakes up a blocked next() so the worker can exit (sorts after every real job)."""
+        self._queue.put((float("inf"), 0, None))
+
+##### Section II : Server #####
+
+def run_job(pipe, job):
+    """
+    Runs one job on the resident pipeline and returns the saved paths.
+    params["config"]: per-job setting overrides ({name: value}) on top of the server's conf.
+    """
+    from src.conf.runtime import RuntimeConfig
+
+    params = job["params"]
+    config = RuntimeConfig().override(params.get("config"), load_time=False)
+    problems = config.validate((job["type"],))
+    if problems:
+        raise ValueError("; ".join(problems))
+    if job["type"] == "t2i":
+        from src.t2i import t2i
+        return t2i.run_task(num_images=params.get("nums"), pipe=pipe, batch_size=params.get("batch_size"),
+                            config=config)
+
+    from src.sr import sr
+    return sr.run_task(file_path=params.get("file"), folder_path=params.get("folder"), pipe=pipe, config=config)
+
+class JobServer:
+    """
+    Localhost HTTP front-end + a single worker thread that executes jobs one by one.
+
+    POST /jobs      {"type": "t2i"|"sr", "params": {...}, "priority": 0}  -> job
+    GET  /jobs      -> [job, ...]
+    GET  /jobs/<id> -> job
+    GET  /health    -> {"status": "ok", "queued": n}
+    """
+    def __init__(self, runner, host=None, port=None, max_finished=None):
+        self.runner = runner
+        self.jobs = JobQueue(max_finished or conf.SERVE_MAX_FINISHED_JOBS)
+        self.httpd = ThreadingHTTPServer((host or conf.SERVE_HOST, conf.SERVE_PORT if port is None else port),
+                                         self._make_handler())
+        self._worker = threading.Thread(target=self._work, name="job-worker", daemon=True)
+        self._running = False
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def _work(self):
+        while self._running:
+            job = self.jobs.next()
+            if job is None:
+                continue
+            print(f"\n[SERVE] Job {job['id']} ({job['type']}) started: {job['params']}")
+            try:
+                results = self.runner(job)
+                self.jobs.finish(job["id"], results=results)
+                print(f"[SERVE] Job {job['id']} done: {len(results or [])} file(s)")
+            except BaseException as e:
+                # SystemExit from a task must not kill the resident server
+                self.jobs.finish(job["id"], err=f"{type(e).__name__}: {e}")
+                print(f"[ERROR] Job {job['id']} failed: {e}")
+
+    def _make_handler(self):
+        jobs = self.jobs
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, code, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    queued = sum(1 for j in jobs.list() if j["status"] == "queued")
+                    return self._send(200, {"status": "ok", "queued": queued})
+                if self.path == "/jobs":
+                    return self._send(200, jobs.list())
+                if self.path.startswith("/jobs/"):
+                    job = jobs.get(self.path[len("/jobs/"):])
+                    if job:
+                        return self._send(200, job)
+                    return self._send(404, {"error": "unknown job"})
+                self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                if self.path != "/jobs":
+                    return self._send(404, {"error": "not found"})
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    job = jobs.submit(payload.get("type"), payload.get("params"), payload.get("priority", 0))
+                except (ValueError, TypeError) as e:
+                    return self._send(400, {"error": str(e)})
+                self._send(202, job)
+
+            def log_message(self, fmt, *args):
+                # Keep the console for task output
+                pass
+
+        return Handler
+
+    def start(self):
+        """Starts the worker and serves HTTP in a background thread."""
+        self._running = True
+        self._worker.start()
+        threading.Thread(target=self.httpd.serve_forever, name="job-http", daemon=True).start()
+
+    def serve_forever(self):
+        """Blocks until Ctrl+C, then stops accepting jobs and waits for the running one."""
+        self.start()
+        host, port = self.address
+        print(f"[SERVE] Listening on http://{host}:{port} (Ctrl+C to stop)")
+        try:
+            while self._worker.is_alive():
+                self._worker.join(timeout=0.5)
+        except KeyboardInterrupt:
+            print("\n[SERVE] Shutting down, waiting for the running job...")
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self._running = False
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.jobs.stop()
+        if self._worker.is_alive():
+            self._worker.join()
+
+def serve(host=None, port=None):
+    """Entry point of `main.py --serve`: loads the pipeline once and serves jobs until stopped."""
+    from src.t2i import t2i
+
+    # Variants are built once and reused by every job
+    pipe = t2i.as_registry(t2i.load_initial_pipeline(conf.MODEL_PATH))
+    server = JobServer(lambda job: run_job(pipe, job), host=host, port=port)
+    server.serve_forever()
+
+##### Section III : Client #####
+
+def _call(method, path, payload=None, host=None, port=None, timeout=10):
+    url = f"http://{host or conf.SERVE_HOST}:{conf.SERVE_PORT if port is None else port}{path}"
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except error.HTTPError as e:
+        raise RuntimeError(f"Server error {e.code}: {e.read().decode('utf-8', 'replace')}")
+
+def submit_job(job_type, params=None, priority=0, host=None, port=None):
+    """Submits a job to a running server and returns its record (with the job id)."""
+    return _call("POST", "/jobs", {"type": job_type, "params": params or {}, "priority": priority}, host, port)
+
+def get_job(job_id, host=None, port=None):
+    return _call("GET", f"/jobs/{job_id}", host=host, port=port)
+
+def wait_for_job(job_id, poll=1.0, host=None, port=None):
+    """Polls until the job is done or failed and returns its final record."""
+    while True:
+        job = get_job(job_id, host, port)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(poll)
@@ -0,0 +1,233 @@
+# src/sr/blend.py
+
+import os
+import struct
+import tempfile
+import zlib
+import numpy as np
+from PIL import Image
+
+##### Section I : Streaming PNG Encoder #####
+
+class PngStreamWriter:
+    """
+    Writes an RGB PNG row band by row band, so the full image never has to exist in memory.
+    Rows are encoded with the PNG "Up" filter (vectorized) and deflated incrementally into
+    <path>.tmp, which close() renames to path: an interrupted encode never leaves a truncated
+    PNG under the output name.
+    """
+    def __init__(self, path, width, height, level=6):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+
+        self._file = open(self.tmp_path, "wb")
+        self._zip = zlib.compressobj(level)
+        self._prev = np.zeros((1, width * 3), dtype=np.uint8)
+
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        # Bit depth 8, colour type 2 (RGB), default compression / filter / interlace
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, tag, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(tag)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    def write(self, rows):
+        """rows: uint8 array of shape (n, width, 3), top to bottom."""
+        flat = rows.reshape(rows.shape[0], self.width * 3)
+
+        # Up filter: each byte minus the byte above it (uint8 wrap-around)
+        above = np.concatenate([self._prev, flat[:-1]], axis=0)
+        filtered = np.empty((flat.shape[0], flat.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        np.subtract(flat, above, out=filtered[:, 1:])
+
+        data = self._zip.compress(filtered.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+
+        self._prev = flat[-1:].copy()
+        self.rows_written += flat.shape[0]
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self._chunk(b"IDAT", self._zip.flush())
+            self._chunk(b"IEND", b"")
+        except BaseException:
+            self.abort()
+            raise
+        self._file.close()
+        self._file = None
+
+        if self.rows_written != self.height:
+            self.abort()
+            raise ValueError(f"PNG {self.path}: wrote {self.rows_written} of {self.height} rows")
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Closes and removes the partially written file (an existing output is left alone)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+##### Section II : Blending Canvas #####
+
+class TileBlender:
+    """
+    Accumulates mask-weighted tiles into an output canvas and normalizes it band by band.
+
+    mode:
+        "memory" : float canvas + weight map in RAM.
+        "memmap" : canvas + weight map backed by temporary files (numpy memmap) in tmp_dir.
+        "stream" : only the rows still touched by upcoming tiles are kept in RAM. Finished rows
+                   are handed to `sink` as soon as a tile starts below them, so tiles must be
+                   added in row-major order (as plan_tiles returns them).
+    dtype: "float32" or "float16" accumulator.
+    sink: callable(rows_uint8) receiving the final image top to bottom (required for "stream").
+    """
+    def __init__(self, width, height, mode="memory", dtype="float32", band_rows=256, tmp_dir=None, sink=None):
+        if mode not in ("memory", "memmap", "stream"):
+            raise ValueError(f"Unknown canvas mode: {mode}")
+        if mode == "stream" and sink is None:
+            raise ValueError("Canvas mode 'stream' needs a sink")
+
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.dtype = np.dtype(dtype)
+        self.band_rows = max(1, band_rows)
+        self.sink = sink
+
+        self._files = []
+        # First canvas row held in the buffers (always 0 unless streaming)
+        self._top = 0
+
+        if mode == "memory":
+            self._canvas = np.zeros((height, width, 3), dtype=self.dtype)
+            self._weight = np.zeros((height, width, 1), dtype=self.dtype)
+        elif mode == "memmap":
+            self._canvas = self._open_memmap(tmp_dir, (height, width, 3))
+            self._weight = self._open_memmap(tmp_dir, (height, width, 1))
+        else:
+            # Allocated on the first tile, one tile high
+            self._canvas = None
+            self._weight = None
+
+    def _open_memmap(self, tmp_dir, shape):
+        fd, path = tempfile.mkstemp(prefix="sr_canvas_", suffix=".dat", dir=tmp_dir)
+        os.close(fd)
+        self._files.append(path)
+        # mode w+ creates a zero-filled (sparse) file
+        return np.memmap(path, dtype=self.dtype, mode="w+", shape=shape)
+
+    def _reserve_rows(self, y, rows):
+        """Streaming: flush every row above y and make [y, y + rows) addressable."""
+        if self._canvas is None:
+            self._canvas = np.zeros((rows, self.width, 3), dtype=self.dtype)
+            self._weight = np.zeros((rows, self.width, 1), dtype=self.dtype)
+
+        if y < self._top:
+            raise ValueError(f"Tile at row {y} arrived after rows up to {self._top} were flushed")
+
+        if y > self._top:
+            done = min(y - self._top, self._canvas.shape[0])
+            self._emit(self._canvas[:done], self._weight[:done])
+            # Shift the remaining rows up and clear the freed tail
+            keep = self._canvas.shape[0] - done
+            self._canvas[:keep] = self._canvas[done:]
+            self._weight[:keep] = self._weight[done:]
+            self._canvas[keep:] = 0
+            self._weight[keep:] = 0
+            self._top += done
+            if y > self._top:
+                # Rows never touched by any tile (not produced by plan_tiles)
+                self._emit_blank(y - self._top)
+                self._top = y
+
+        need = y + rows - self._top
+        if need > self._canvas.shape[0]:
+            grow = need - self._canvas.shape[0]
+            self._canvas = np.concatenate([self._canvas, np.zeros((grow, self.width, 3), dtype=self.dtype)])
+            self._weight = np.concatenate([self._weight, np.zeros((grow, self.width, 1), dtype=self.dtype)])
+
+    def add(self, tile_np, mask, x, y):
+        """
+        Accumulates tile_np (h, w, 3) weighted by mask (h, w, 1) at (x, y), in place.
+        """
+        h, w = tile_np.shape[:2]
+        if self.mode == "stream":
+            self._reserve_rows(y, h)
+        row = y - self._top
+
+        weighted = np.multiply(tile_np, mask, dtype=np.float32)
+        canvas = self._canvas[row:row + h, x:x + w]
+        canvas += weighted.astype(self.dtype, copy=False)
+        self._weight[row:row + h, x:x + w] += mask.astype(self.dtype, copy=False)
+
+    def _finalize(self, canvas, weight):
+        """Normalizes one band to uint8 (band-sized temporaries only)."""
+        band = canvas.astype(np.float32)
+        band /= np.maximum(weight, 1e-5)
+        np.clip(band, 0, 255, out=band)
+        return band.astype(np.uint8)
+
+    def _emit(self, canvas, weight):
+        for start in range(0, canvas.shape[0], self.band_rows):
+            stop = start + self.band_rows
+            self.sink(self._finalize(canvas[start:stop], weight[start:stop]))
+
+    def _emit_blank(self, rows):
+        for start in range(0, rows, self.band_rows):
+            self.sink(np.zeros((min(self.band_rows, rows - start), self.width, 3), dtype=np.uint8))
+
+    def bands(self):
+        """Yields the final image as uint8 bands of up to band_rows rows ("memory"/"memmap")."""
+        if self.mode == "stream":
+            raise ValueError("Canvas mode 'stream' emits its bands through the sink")
+        for start in range(0, self.height, self.band_rows):
+            stop = start + self.band_rows
+            yield self._finalize(self._canvas[start:stop], self._weight[start:stop])
+
+    def finish(self):
+        """Sends every remaining band to the sink."""
+        if self.mode == "stream":
+            if self._canvas is not None:
+                rows = self.height - self._top
+                self._emit(self._canvas[:rows], self._weight[:rows])
+                self._top = self.height
+            elif self.height:
+                self._emit_blank(self.height)
+        else:
+            for band in self.bands():
+                self.sink(band)
+
+    def to_image(self):
+        """Builds the final PIL image ("memory"/"memmap" only)."""
+        out = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        row = 0
+        for band in self.bands():
+            out[row:row + band.shape[0]] = band
+            row += band.shape[0]
+        return Image.fromarray(out)
+
+    def close(self):
+        """Releases the buffers and removes the memmap files."""
+        self._canvas = None
+        self._weight = None
+        for path in self._files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._files = []
@@ -2,186 +2,505 @@
 
 import os
 import sys
+import math
+import time
+import functools
+import threading
 import numpy as np
+from collections import OrderedDict
 from PIL import Image
-import torch
-from diffusers import AutoPipelineForImage2Image
 
 # Import shared config and t2i pipeline loader
 from src.conf import conf
 from src.conf import prompt as pt
 from src.t2i import t2i
+from src.t2i.embed import get_prompt_embeds
+from src.sr.blend import TileBlender, PngStreamWriter
+from src.utils.background import BackgroundWriter, Prefetcher
+from src.utils import trace
+from src.utils import devices
+from src.utils import budget
+from src.utils import manifest as manifest_lib
+from src.utils.manifest import RunManifest
+from src.utils.hashing import file_digest, text_digest
+
+# Input images of an SR run (files named SR_* are outputs)
+INPUT_EXTENSIONS = (".png", ".jpg", ".jpeg")
 
 ##### Section I : Helper Logic (Lanczos & Tiling) #####
 
 def upscale_lanczos(image, target_size):
-    """Upscales image using Lanczos resampling."""
-    return image.resize((target_size, target_size), Image.LANCZOS)
+    """
+    Upscales image using Lanczos resampling.
+    target_size: int for a square output, or (width, height).
+    """
+    if isinstance(target_size, int):
+        target_size = (target_size, target_size)
+    return image.resize(tuple(target_size), Image.LANCZOS)
+
+def get_output_size(width, height, target_size=None, scale=None):
+    """
+    Returns the (width, height) of the SR output for an input of (width, height).
+    The aspect ratio is preserved and both sides are rounded to a multiple of 8 (SDXL latent grid).
+    """
+    if scale is None:
+        scale = conf.SR_SCALE
+    if scale is None:
+        scale = (target_size or conf.SR_TARGET_SIZE) / max(width, height)
+
+    out_w = max(8, int(round(width * scale / 8.0)) * 8)
+    out_h = max(8, int(round(height * scale / 8.0)) * 8)
+    return out_w, out_h
 
-def get_tile_coordinates():
+def _plan_axis(length, tile, overlap):
+    """
+    Splits one axis into the fewest tiles of size `tile` that share at least `overlap` pixels.
+    Returns (tile_length, starts). The slack is spread evenly over all seams.
     """
-    Returns a list of (name, x, y, fade_sides) for 4 overlapping tiles.
+    if length <= tile:
+        return length, [0]
+
+    step = tile - overlap
+    count = int(math.ceil((length - overlap) / float(step)))
+    span = length - tile
+    starts = [int(round(i * span / float(count - 1))) for i in range(count)]
+    return tile, starts
+
+def _axis_labels(count, first, last, middle):
+    """Grid labels along one axis, e.g. 2 -> [T, B], 3 -> [T, M1, B], 1 -> ['']."""
+    if count == 1:
+        return [""]
+    return [first] + [f"{middle}{i}" for i in range(1, count - 1)] + [last]
+
+def plan_tiles(width, height, tile_size=None, min_overlap=None):
+    """
+    Computes the smallest grid of overlapping tiles that covers a (width, height) output.
+
+    Returns a dict:
+        width, height            : output size
+        tile_width, tile_height  : size of every tile (clamped to the output size)
+        overlap                  : smallest overlap between neighbouring tiles (fade length)
+        rows, cols               : grid shape
+        tiles                    : list of (name, x, y, fade_sides), row-major
+    fade_sides: {"top", "bottom", "left", "right"} - True for internal edges that need fading.
+    """
+    tile_size = tile_size or conf.SR_TILE_SIZE
+    min_overlap = conf.SR_OVERLAP if min_overlap is None else min_overlap
+    if min_overlap >= tile_size:
+        raise ValueError(f"SR overlap ({min_overlap}) must be smaller than the tile size ({tile_size})")
+
+    tile_w, xs = _plan_axis(width, tile_size, min_overlap)
+    tile_h, ys = _plan_axis(height, tile_size, min_overlap)
+
+    # Actual overlap is >= min_overlap, since the slack is spread over the seams
+    seams = [tile_w - (b - a) for a, b in zip(xs, xs[1:])]
+    seams += [tile_h - (b - a) for a, b in zip(ys, ys[1:])]
+    overlap = min(seams) if seams else 0
+
+    row_labels = _axis_labels(len(ys), "T", "B", "M")
+    col_labels = _axis_labels(len(xs), "L", "R", "C")
+
+    tiles = []
+    for r, y in enumerate(ys):
+        for c, x in enumerate(xs):
+            name = (row_labels[r] + col_labels[c]) or "FULL"
+            sides = {
+                "top": r > 0,
+                "bottom": r < len(ys) - 1,
+                "left": c > 0,
+                "right": c < len(xs) - 1,
+            }
+            tiles.append((name, x, y, sides))
+
+    return {
+        "width": width,
+        "height": height,
+        "tile_width": tile_w,
+        "tile_height": tile_h,
+        "overlap": overlap,
+        "rows": len(ys),
+        "cols": len(xs),
+        "tiles": tiles,
+    }
+
+def get_tile_coordinates(width=None, height=None):
+    """
+    Returns a list of (name, x, y, fade_sides) for the tiles covering a (width, height) output.
+    Defaults to the square SR_TARGET_SIZE, i.e. 4 overlapping tiles (TL/TR/BL/BR) for 1920.
     fade_sides order: [Top, Bottom, Left, Right] - Boolean
     """
-    size = conf.SR_TARGET_SIZE
-    tile = conf.SR_TILE_SIZE
-    offset = size - tile # 896
-    
-    # Define which sides should act as borders (overlap) and need fading.
-    # True = Fade this side (Internal edge)
-    # False = Keep opaque (External edge)
-    
-    coords = [
-        # TL: Fade Bottom, Right
-        ("TL", 0, 0, {"top": False, "bottom": True, "left": False, "right": True}),
-        
-        # TR: Fade Bottom, Left
-        ("TR", offset, 0, {"top": False, "bottom": True, "left": True, "right": False}),
-        
-        # BL: Fade Top, Right
-        ("BL", 0, offset, {"top": True, "bottom": False, "left": False, "right": True}),
-        
-        # BR: Fade Top, Left
-        ("BR", offset, offset, {"top": True, "bottom": False, "left": True, "right": False})
-    ]
-    return coords
+    width = width or conf.SR_TARGET_SIZE
+    height = height or conf.SR_TARGET_SIZE
+    return plan_tiles(width, height)["tiles"]
+
+def fade_ramp(overlap, ramp="linear"):
+    """
+    1-D fade 0 -> 1 over `overlap` pixels.
+    ramp: "linear", "cosine" (smooth start/end) or "gaussian" (most of the weight near the inside).
+    """
+    t = np.linspace(0, 1, overlap)
+    if ramp == "linear":
+        return t
+    if ramp == "cosine":
+        return 0.5 - 0.5 * np.cos(np.pi * t)
+    if ramp == "gaussian":
+        g = np.exp(-0.5 * ((1.0 - t) / 0.35) ** 2)
+        # Rescale so the ramp still starts at exactly 0
+        return (g - g[0]) / (1.0 - g[0])
+    raise ValueError(f"Unknown mask ramp: {ramp}")
+
+def _fade_profile(length, overlap, fade_start, fade_end, ramp):
+    """Per-row (or per-column) weights: 1.0 with a ramp on the requested ends."""
+    profile = np.ones(length, dtype=np.float64)
+    if overlap > 0:
+        curve = fade_ramp(overlap, ramp)
+        # Multiply (not assign) so ramps overlapping in a tiny tile still combine
+        if fade_start:
+            profile[:overlap] *= curve
+        if fade_end:
+            profile[length - overlap:] *= curve[::-1]
+    return profile
+
+# (tile_h, tile_w, overlap, top, bottom, left, right, ramp) -> mask, least recently used first.
+# Bounded by SR_MASK_CACHE_SIZE at each lookup, so runtime overrides of the setting apply.
+_mask_cache = OrderedDict()
+_mask_cache_lock = threading.Lock()
+
+def clear_mask_cache():
+    with _mask_cache_lock:
+        _mask_cache.clear()
+
+def _trim_mask_cache():
+    # Caller holds _mask_cache_lock
+    while len(_mask_cache) > max(0, conf.SR_MASK_CACHE_SIZE):
+        _mask_cache.popitem(last=False)
 
-def create_tile_mask(tile_size, overlap, sides):
+def _cached_tile_mask(tile_h, tile_w, overlap, top, bottom, left, right, ramp):
+    key = (tile_h, tile_w, overlap, top, bottom, left, right, ramp)
+    with _mask_cache_lock:
+        mask = _mask_cache.get(key)
+        if mask is not None:
+            _mask_cache.move_to_end(key)
+            _trim_mask_cache()
+            return mask
+
+    # Corners are the product of the two fades, as with the old per-row loops
+    rows = _fade_profile(tile_h, overlap, top, bottom, ramp).astype(np.float32)
+    cols = _fade_profile(tile_w, overlap, left, right, ramp).astype(np.float32)
+    mask = rows[:, np.newaxis, np.newaxis] * cols[np.newaxis, :, np.newaxis]
+    # Shared between tiles and images: never modify in place
+    mask.setflags(write=False)
+
+    with _mask_cache_lock:
+        _mask_cache[key] = mask
+        _trim_mask_cache()
+    return mask
+
+def create_tile_mask(tile_size, overlap, sides, ramp=None):
     """
-    Creates a smart weight mask.
+    Creates a smart weight mask (outer product of two 1-D fades, cached).
+    tile_size: int for a square tile, or (height, width).
     sides: dict {"top": bool, "bottom": bool, ...}
+    ramp: fade shape, see fade_ramp(). Defaults to SR_MASK_RAMP.
+    Returns a read-only (H, W, 1) float32 array.
     """
-    # Start with a mask of all 1.0
-    mask = np.ones((tile_size, tile_size), dtype=np.float32)
-    
-    # Generate a linear gradient 0 -> 1
-    # We use explicit indices to ensure robust fading
-    fade_ramp = np.linspace(0, 1, overlap)
-    
-    # Apply fade to specific sides if requested
-    
-    if sides["top"]:
-        # Fade the top rows (0 to overlap) from 0 to 1
-        # We multiply the existing values to support corners (where two fades meet)
-        for i in range(overlap):
-            mask[i, :] *= fade_ramp[i]
-            
-    if sides["bottom"]:
-        # Fade the bottom rows from 1 to 0
-        for i in range(overlap):
-            mask[tile_size - 1 - i, :] *= fade_ramp[i]
-            
-    if sides["left"]:
-        # Fade the left columns from 0 to 1
-        for i in range(overlap):
-            mask[:, i] *= fade_ramp[i]
-            
-    if sides["right"]:
-        # Fade the right columns from 1 to 0
-        for i in range(overlap):
-            mask[:, tile_size - 1 - i] *= fade_ramp[i]
+    if isinstance(tile_size, int):
+        tile_size = (tile_size, tile_size)
+    tile_h, tile_w = tile_size
+
+    return _cached_tile_mask(
+        tile_h, tile_w, overlap,
+        bool(sides["top"]), bool(sides["bottom"]), bool(sides["left"]), bool(sides["right"]),
+        ramp or conf.SR_MASK_RAMP,
+    )
+
+def choose_tile_batch_size(tile_w, tile_h, num_tiles, device):
+    """
+    Picks how many tiles fit in one pipeline call from the free memory on device.
+    Uses SR_TILE_MEMORY_MB (per 1024x1024 tile) as the cost model and keeps 20% headroom.
+    """
+    free = t2i.get_available_memory(device)
+    if not free:
+        return 1
 
-    # Add an extra channel dimension for broadcasting: (H, W, 1)
-    return mask[:, :, np.newaxis]
+    per_tile = conf.SR_TILE_MEMORY_MB * 1024 * 1024 * (tile_w * tile_h) / float(1024 * 1024)
+    if device != "cuda":
+        # float32 on CPU
+        per_tile *= 2
+
+    return int(max(1, min(num_tiles, (free * 0.8) // per_tile)))
 
 ##### Section II : Core SR Logic #####
 
-def process_single_image_sr(pipe, image_path, output_dir):
-    filename = os.path.basename(image_path)
-    print(f"\n[SR] Processing: {filename}")
-    
-    try:
-        original_img = Image.open(image_path).convert("RGB")
-    except Exception as e:
-        print(f"[ERROR] Could not open image {image_path}: {e}")
-        return
+def tile_detail(tile_img):
+    """RMS luminance gradient of a tile in levels per pixel (0 for a flat area)."""
+    gray = np.asarray(tile_img.convert("L"), dtype=np.float32)
+    dx = np.diff(gray, axis=1)
+    dy = np.diff(gray, axis=0)
+    return float(np.sqrt((np.mean(dx * dx) + np.mean(dy * dy)) / 2))
 
-    # 1. Pre-upscale
-    print("   |-- [1/4] Lanczos Upscaling to 1920x1920...")
-    upscaled_img = upscale_lanczos(original_img, conf.SR_TARGET_SIZE)
-    
-    # 2. Prepare for Tiling
-    coords = get_tile_coordinates()
-    
-    # Prepare canvas
-    canvas = np.zeros((conf.SR_TARGET_SIZE, conf.SR_TARGET_SIZE, 3), dtype=np.float32)
-    weight_map = np.zeros((conf.SR_TARGET_SIZE, conf.SR_TARGET_SIZE, 1), dtype=np.float32)
-    
-    # Ensure pipe is in Img2Img mode
-    if not isinstance(pipe, AutoPipelineForImage2Image):
-        pipe = AutoPipelineForImage2Image.from_pipe(pipe)
+def tile_strength(detail):
+    """Img2Img strength for a tile of the given detail; None keeps its Lanczos pixels (SR_ADAPTIVE)."""
+    if not conf.SR_ADAPTIVE or detail >= conf.SR_REDUCE_DETAIL:
+        return conf.SR_STRENGTH
+    if detail < conf.SR_SKIP_DETAIL:
+        return None
+    strength = conf.SR_STRENGTH * conf.SR_REDUCED_STRENGTH_SCALE
+    # A strength that runs no denoising step is a skip
+    return strength if int(conf.SR_INFERENCE_STEPS * strength) >= 1 else None
+
+def refine_tile_batch(pipe, tile_imgs, seeds, tile_w, tile_h, strength=None):
+    """
+    Runs one Img2Img call over a batch of tiles.
+    Every tile gets its own generator, so the result does not depend on how tiles are batched.
+    strength: img2img strength of the batch (default: SR_STRENGTH).
+    """
+    import torch
 
-    # Auto-detect device (Fix for CI/CD compatibility)
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    generator = torch.Generator(device).manual_seed(42)
+    generators = [torch.Generator(device).manual_seed(seed) for seed in seeds]
+    count = len(tile_imgs)
+    embeds = get_prompt_embeds(pipe, pt.PROMPT_SR_TEXT, pt.NEGATIVE_PROMPT_TEXT, count=count)
 
-    # 3. Process Tiles
-    print("   |-- [2/4] Processing Tiles (Img2Img)...")
-    for name, x, y, sides in coords:
-        print(f"       > Tile {name} at ({x}, {y})...")
-        
-        # Crop
-        box = (x, y, x + conf.SR_TILE_SIZE, y + conf.SR_TILE_SIZE)
-        tile_img = upscaled_img.crop(box)
-        
-        # Generate Mask for this specific tile position
-        tile_mask_3d = create_tile_mask(conf.SR_TILE_SIZE, conf.SR_OVERLAP, sides)
-        
-        # Img2Img Refinement
-        # [FIX] We Force original_size to match target_size (1024)
-        # This prevents SDXL from shrinking the content/adding black borders
-        refined_tile = pipe(
-            prompt=pt.PROMPT_SR_TEXT,
-            negative_prompt=pt.NEGATIVE_PROMPT_TEXT,
-            image=tile_img,
-            strength=conf.SR_STRENGTH,
+    # [FIX] We Force original_size to match target_size (tile size)
+    # This prevents SDXL from shrinking the content/adding black borders
+    with trace.span("sr.tiles", tiles=count, size=[tile_w, tile_h]), devices.autocast():
+        return pipe(
+            **embeds,
+            image=tile_imgs,
+            strength=strength or conf.SR_STRENGTH,
             guidance_scale=conf.SR_GUIDANCE_SCALE,
             num_inference_steps=conf.SR_INFERENCE_STEPS,
-            target_size=(conf.SR_TILE_SIZE, conf.SR_TILE_SIZE), 
-            original_size=(conf.SR_TILE_SIZE, conf.SR_TILE_SIZE), # FIX: Do not use 2048 here
+            target_size=(tile_h, tile_w),
+            original_size=(tile_h, tile_w), # FIX: Do not use 2048 here
             negative_original_size=conf.NEGATIVE_ORIGINAL_SIZE,
-            generator=generator,
-            output_type="pil"
-        ).images[0]
-        
-        refined_np = np.array(refined_tile).astype(np.float32)
-        
-        # Add to canvas
-        # Note: tile_mask_3d is (1024, 1024, 1), implicit broadcast works for refined_np (1024, 1024, 3)
-        canvas[y:y+conf.SR_TILE_SIZE, x:x+conf.SR_TILE_SIZE] += refined_np * tile_mask_3d
-        
-        # Accumulate weights (squeeze the last dim for weight map if needed, or keep 3d)
-        # Here we keep weight_map as (H, W, 1) to divide easily
-        weight_map[y:y+conf.SR_TILE_SIZE, x:x+conf.SR_TILE_SIZE] += tile_mask_3d
+            generator=generators,
+            output_type="pil",
+            callback_on_step_end=trace.step_callback("sr.tiles"),
+        ).images
+
+def load_sr_input(image_path):
+    """
+    Decodes an SR input and pre-upscales it with Lanczos (aspect ratio preserved).
+    Pure CPU / PIL work, safe to run on a prefetch thread while another image is diffusing.
+    """
+    with trace.span("sr.load", path=image_path):
+        original_img = Image.open(image_path).convert("RGB")
+        return upscale_lanczos(original_img, get_output_size(*original_img.size))
+
+def diffuse_tiles(pipe, upscaled_img, plan, blender, batch_size):
+    """
+    Refines the tiles of `plan` and adds them to `blender` in plan order (the streaming canvases
+    need row-major order). With SR_ADAPTIVE, every tile first gets a strength from its detail:
+    consecutive tiles with the same strength share a pipeline call of up to batch_size tiles,
+    skipped tiles are blended straight from the Lanczos upscale.
+    Tile i always uses seed SR_SEED + i, however the tiles are batched or skipped.
+    Returns a report: tiles, skipped, reduced, steps (tile steps run), steps_full (without
+    skipping), diffuse_time and time_saved (estimated from the measured time per tile step).
+    """
+    tile_w, tile_h = plan["tile_width"], plan["tile_height"]
+    tiles = plan["tiles"]
+    full_steps = int(conf.SR_INFERENCE_STEPS * conf.SR_STRENGTH)
+    report = {"tiles": len(tiles), "skipped": 0, "reduced": 0, "steps": 0,
+              "steps_full": full_steps * len(tiles), "diffuse_time": 0.0, "time_saved": None}
+    pending = []
+    pending_strength = None
+
+    def blend(batch, tile_imgs):
+        with trace.span("sr.blend", tiles=len(batch)):
+            for (name, x, y, sides), tile_img in zip(batch, tile_imgs):
+                # Generate Mask for this specific tile position: (tile_h, tile_w, 1)
+                tile_mask_3d = create_tile_mask((tile_h, tile_w), plan["overlap"], sides)
+
+                # Accumulate tile * mask and the weights in place
+                blender.add(np.asarray(tile_img), tile_mask_3d, x, y)
+
+    def flush():
+        if not pending:
+            return
+        seeds = [conf.SR_SEED + index for index, _, _ in pending]
+        start = time.perf_counter()
+        # Img2Img Refinement
+        refined_tiles = refine_tile_batch(pipe, [img for _, _, img in pending], seeds, tile_w, tile_h,
+                                          strength=pending_strength)
+        report["diffuse_time"] += time.perf_counter() - start
+        report["steps"] += int(conf.SR_INFERENCE_STEPS * pending_strength) * len(pending)
+        blend([tile for _, tile, _ in pending], refined_tiles)
+        pending.clear()
+
+    for index, tile in enumerate(tiles):
+        name, x, y, _ = tile
+        # Crop
+        tile_img = upscaled_img.crop((x, y, x + tile_w, y + tile_h))
+        if conf.SR_ADAPTIVE:
+            detail = tile_detail(tile_img)
+            strength = tile_strength(detail)
+            level = "skip" if strength is None else "full" if strength == conf.SR_STRENGTH else "reduced"
+            print(f"       > Tile {name} at ({x}, {y}), detail {detail:.1f}: {level}")
+        else:
+            strength = conf.SR_STRENGTH
+            print(f"       > Tile {name} at ({x}, {y})...")
+
+        if pending and (strength != pending_strength or len(pending) == batch_size):
+            flush()
+        if strength is None:
+            report["skipped"] += 1
+            blend([tile], [tile_img])
+            continue
+        if strength != conf.SR_STRENGTH:
+            report["reduced"] += 1
+        pending_strength = strength
+        pending.append((index, tile, tile_img))
+    flush()
+
+    if report["steps"]:
+        per_step = report["diffuse_time"] / report["steps"]
+        report["time_saved"] = per_step * (report["steps_full"] - report["steps"])
+    elif not report["steps_full"]:
+        report["time_saved"] = 0.0
+    return report
+
+def merge_canvas(blender, out_w, out_h):
+    """Normalizes an in-memory canvas into the final image and releases it."""
+    try:
+        with trace.span("sr.merge", size=[out_w, out_h]):
+            return blender.to_image()
+    finally:
+        blender.close()
+
+def process_single_image_sr(pipe, image_path, output_dir, upscaled_img=None, image_writer=None,
+                            save_name=None, on_saved=None, stats=None):
+    """
+    upscaled_img: result of load_sr_input(image_path) if it was prefetched.
+    image_writer: BackgroundWriter that encodes the result off the main thread ("memory" canvas).
+    save_name: output file name (default: SR_<input name>).
+    on_saved: callable run once the output file is complete.
+    stats: dict that the tile report of this image (see diffuse_tiles) is added to.
+    Out of memory: retried one fallback step lower (smaller tile batch, VAE tiling, offload;
+    see budget.recover), re-raised once no step is left. A smaller tile batch only applies to
+    this image.
+    Returns the output path (written, or queued on image_writer), None on failure.
+    """
+    registry = t2i.as_registry(pipe)
+    filename = os.path.basename(image_path)
+    retried = False
+    tile_batch = conf.SR_TILE_BATCH_SIZE
+    try:
+        while True:
+            try:
+                save_path = _process_single_image_sr(registry, image_path, output_dir, upscaled_img, image_writer,
+                                                     save_name, on_saved, stats)
+            except Exception as e:
+                if t2i.is_oom_error(e) and budget.recover(registry, "sr", filename):
+                    retried = True
+                    continue
+                raise
+            if retried and save_path:
+                budget.report(registry, "sr", filename)
+            return save_path
+    finally:
+        conf.SR_TILE_BATCH_SIZE = tile_batch
+
+def _process_single_image_sr(pipe, image_path, output_dir, upscaled_img, image_writer, save_name, on_saved, stats):
+    filename = os.path.basename(image_path)
+    print(f"\n[SR] Processing: {filename}")
+    
+    # 1. Pre-upscale (aspect ratio preserved)
+    if upscaled_img is None:
+        try:
+            upscaled_img = load_sr_input(image_path)
+        except Exception as e:
+            print(f"[ERROR] Could not open image {image_path}: {e}")
+            return
         
-    # 4. Merge
-    print("   |-- [3/4] Merging Tiles...")
-    # Normalize
-    weight_map = np.maximum(weight_map, 1e-5)
-    final_np = canvas / weight_map
+    out_w, out_h = upscaled_img.size
+    print(f"   |-- [1/4] Lanczos Upscaling to {out_w}x{out_h}...")
     
-    final_np = np.clip(final_np, 0, 255).astype(np.uint8)
-    final_img = Image.fromarray(final_np)
+    # 2. Prepare for Tiling
+    plan = plan_tiles(out_w, out_h)
+    tile_w, tile_h = plan["tile_width"], plan["tile_height"]
+    print(f"       > Plan: {plan['cols']}x{plan['rows']} tiles of {tile_w}x{tile_h}, overlap {plan['overlap']}px")
     
-    # Save
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
-    save_name = f"SR_{filename}"
+    save_name = save_name or f"SR_{filename}"
+    mode = conf.SR_CANVAS_MODE
+    if mode != "memory":
+        # Out-of-core modes stream straight into the PNG encoder
+        save_name = f"{os.path.splitext(save_name)[0]}.png"
     save_path = os.path.join(output_dir, save_name)
-    final_img.save(save_path)
+    
+    # Prepare canvas
+    writer = None
+    if mode != "memory":
+        writer = PngStreamWriter(save_path, out_w, out_h)
+    blender = TileBlender(
+        out_w, out_h,
+        mode=mode,
+        dtype=conf.SR_CANVAS_DTYPE,
+        band_rows=conf.SR_CANVAS_BAND_ROWS,
+        tmp_dir=conf.SR_CANVAS_DIR,
+        sink=writer.write if writer else None,
+    )
+    
+    # Img2Img variant, built once per registry
+    pipe = t2i.as_registry(pipe).img2img()
+
+    # Auto-detect device (Fix for CI/CD compatibility)
+    import torch
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    tiles = plan["tiles"]
+    batch_size = conf.SR_TILE_BATCH_SIZE or choose_tile_batch_size(tile_w, tile_h, len(tiles), device)
+
+    try:
+        # 3. Process Tiles
+        print(f"   |-- [2/4] Processing Tiles (Img2Img, {batch_size} per batch)...")
+        report = diffuse_tiles(pipe, upscaled_img, plan, blender, batch_size)
+        if conf.SR_ADAPTIVE:
+            saved_time = f", ~{report['time_saved']:.1f}s saved" if report["time_saved"] is not None else ""
+            print(f"       > Adaptive: {report['skipped']} of {report['tiles']} tiles skipped, "
+                  f"{report['reduced']} reduced; {report['steps']} of {report['steps_full']} tile steps run{saved_time}")
+        if stats is not None:
+            for name, value in report.items():
+                stats[name] = (stats.get(name) or 0) + (value or 0)
+            
+        # 4. Merge (normalized band by band)
+        print("   |-- [3/4] Merging Tiles...")
+        if writer is None and image_writer is not None:
+            # Normalized and encoded on the writer thread, while the next image diffuses
+            image_writer.submit(functools.partial(merge_canvas, blender, out_w, out_h), save_path, on_saved=on_saved)
+            on_saved = None
+            blender = None
+        elif writer is None:
+            final_img = merge_canvas(blender, out_w, out_h)
+            with trace.span("save", path=save_path):
+                final_img.save(save_path)
+        else:
+            # Normalizing and PNG encoding are one pass in the streaming modes
+            with trace.span("sr.merge", size=[out_w, out_h], streamed=True):
+                blender.finish()
+                writer.close()
+        if on_saved is not None:
+            on_saved()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+    finally:
+        if blender is not None:
+            blender.close()
+        
     print(f"   |-- [4/4] Saved: {save_path}")
+    return save_path
 
 ##### Section III : Module Entry #####
 
-def run_task(file_path=None, folder_path=None):
-    if not file_path and not folder_path:
-        print("[ERROR] SR Task requires --file or --folder argument.")
-        return
+def is_input(filename):
+    return filename.lower().endswith(INPUT_EXTENSIONS) and "SR_" not in filename
 
-    # Load Model
-    pipe = t2i.load_initial_pipeline(conf.MODEL_PATH)
-    
+def resolve_targets(file_path=None, folder_path=None):
+    """Input images of an SR run: the file and/or the images of the folder (not SR outputs)."""
     targets = []
     
     if file_path:
@@ -192,23 +511,244 @@ def run_task(file_path=None, folder_path=None):
             
     if folder_path:
         if os.path.isdir(folder_path):
-            valid_exts = ('.png', '.jpg', '.jpeg')
             for f in os.listdir(folder_path):
-                if f.lower().endswith(valid_exts) and "SR_" not in f:
+                if is_input(f):
                     targets.append(os.path.join(folder_path, f))
         else:
             print(f"[ERROR] Folder not found: {folder_path}")
-            
+    return targets
+
+def check_config():
+    """Returns the problems of the SR settings (empty if they are usable)."""
+    problems = []
+    if conf.SR_TILE_SIZE <= 0 or conf.SR_TILE_SIZE % 8:
+        problems.append(f"SR_TILE_SIZE ({conf.SR_TILE_SIZE}) must be a positive multiple of 8")
+    if not 0 <= conf.SR_OVERLAP < conf.SR_TILE_SIZE:
+        problems.append(f"SR_OVERLAP ({conf.SR_OVERLAP}) must be in [0, SR_TILE_SIZE)")
+    if not 0 < conf.SR_STRENGTH <= 1:
+        problems.append(f"SR_STRENGTH ({conf.SR_STRENGTH}) must be in (0, 1]")
+    elif int(conf.SR_INFERENCE_STEPS * conf.SR_STRENGTH) < 1:
+        problems.append(f"SR_INFERENCE_STEPS * SR_STRENGTH ({conf.SR_INFERENCE_STEPS} * {conf.SR_STRENGTH}) "
+                        "runs no denoising step")
+    if conf.SR_CANVAS_MODE not in ("memory", "memmap", "stream"):
+        problems.append(f"SR_CANVAS_MODE ({conf.SR_CANVAS_MODE!r}) must be memory, memmap or stream")
+    if conf.SR_CANVAS_DTYPE not in ("float32", "float16"):
+        problems.append(f"SR_CANVAS_DTYPE ({conf.SR_CANVAS_DTYPE!r}) must be float32 or float16")
+    if conf.SR_MASK_RAMP not in ("linear", "cosine", "gaussian"):
+        problems.append(f"SR_MASK_RAMP ({conf.SR_MASK_RAMP!r}) must be linear, cosine or gaussian")
+    if conf.SR_SCALE is None and not conf.SR_TARGET_SIZE:
+        problems.append("Either SR_SCALE or SR_TARGET_SIZE must be set")
+    if conf.SR_ADAPTIVE and not 0 <= conf.SR_SKIP_DETAIL <= conf.SR_REDUCE_DETAIL:
+        problems.append(f"SR_SKIP_DETAIL ({conf.SR_SKIP_DETAIL}) must be in [0, SR_REDUCE_DETAIL "
+                        f"({conf.SR_REDUCE_DETAIL})]")
+    if conf.SR_ADAPTIVE and not 0 < conf.SR_REDUCED_STRENGTH_SCALE <= 1:
+        problems.append(f"SR_REDUCED_STRENGTH_SCALE ({conf.SR_REDUCED_STRENGTH_SCALE}) must be in (0, 1]")
+    return problems
+
+def check_coverage(width, height):
+    """
+    Problems of the tile grid for a (width, height) SR output: every pixel must be covered and
+    neighbouring tiles must share at least SR_OVERLAP pixels (rounding of the tile starts must
+    not eat into the fade).
+    """
+    problems = []
+    try:
+        plan = plan_tiles(width, height)
+    except ValueError as e:
+        return [str(e)]
+    for axis, length, tile, starts in (("x", width, plan["tile_width"], sorted({t[1] for t in plan["tiles"]})),
+                                       ("y", height, plan["tile_height"], sorted({t[2] for t in plan["tiles"]}))):
+        if starts[0] != 0 or starts[-1] + tile < length:
+            problems.append(f"SR tiles of {tile}px do not cover {length}px along {axis}")
+        for a, b in zip(starts, starts[1:]):
+            if tile - (b - a) < min(conf.SR_OVERLAP, tile):
+                problems.append(f"SR tiles at {axis}={a} and {axis}={b} overlap by {tile - (b - a)}px, "
+                                f"less than SR_OVERLAP ({conf.SR_OVERLAP})")
+    return problems
+
+def dry_run(file_path=None, folder_path=None):
+    """
+    Validates the settings and prints what run_task would do (tile plans, outputs, steps)
+    without importing torch / diffusers or loading the model. Returns the list of problems.
+    """
+    problems = check_config()
+    # Tile plans of an invalid configuration are meaningless (or divide by zero)
+    targets = resolve_targets(file_path, folder_path) if not problems else []
+    if not file_path and not folder_path:
+        problems.append("SR Task requires --file or --folder argument.")
+    if not os.path.isfile(conf.MODEL_PATH):
+        problems.append(f"Model file not found: {conf.MODEL_PATH}")
+
+    # Hashing a multi-GB checkpoint is the real run's job
+    model = manifest_lib.model_hash(cached_only=True)
+    # Resolving the device profile imports torch
+    precision = devices.precision(cached_only=True)
+    manifest = RunManifest(conf.OUTPUT_DIR_SR) if conf.MANIFEST_ENABLED else None
+    steps_per_tile = int(conf.SR_INFERENCE_STEPS * conf.SR_STRENGTH)
+
+    print("========================================")
+    print(f"SR Dry Run: {len(targets)} images, {steps_per_tile} steps per tile")
+    print("========================================")
+    if model is None:
+        print("   |-- Output names are provisional: the checkpoint has not been hashed yet")
+    if precision is None:
+        print("   |-- Output names are provisional: the device profile is resolved by the real run")
+    total_steps = 0
+    for job in plan_jobs(targets, model=model or "unhashed",
+                         precision=precision or {"dtype": "unresolved", "autocast": None}):
+        try:
+            with Image.open(job["input"]) as img:
+                in_w, in_h = img.size
+        except OSError as e:
+            problems.append(f"Could not open image {job['input']}: {e}")
+            continue
+        out_w, out_h = get_output_size(in_w, in_h)
+        plan = plan_tiles(out_w, out_h)
+        done = bool(manifest and manifest.is_done(job["key"]))
+        steps = len(plan["tiles"]) * steps_per_tile
+        if not done:
+            total_steps += steps
+        print(f"   |-- [{'done' if done else 'todo'}] {os.path.basename(job['input'])} {in_w}x{in_h} -> {out_w}x{out_h}: "
+              f"{plan['cols']}x{plan['rows']} tiles of {plan['tile_width']}x{plan['tile_height']} "
+              f"(overlap {plan['overlap']}px), {steps} steps")
+        print(f"       > {job['output']}")
+    print(f"   |-- Steps to run: {total_steps}")
+    for problem in problems:
+        print(f"[ERROR] {problem}")
+    return problems
+
+def _stored_name(save_name):
+    """Name actually written for save_name (the out-of-core canvas modes always write PNG)."""
+    if conf.SR_CANVAS_MODE != "memory":
+        return f"{os.path.splitext(save_name)[0]}.png"
+    return save_name
+
+def plan_jobs(targets, model=None, digests=None, precision=None):
+    """
+    One job per input: key over model hash, prompt hash, settings, seed and input file hash.
+    Outputs are named SR_<input stem>_<key prefix><ext>, so a changed input or setting never
+    overwrites (or is mistaken for) an earlier result.
+    model: checkpoint digest (default: manifest.model_hash()).
+    digests: {path: content digest} already known (not read again).
+    precision: devices.precision() of the run (default: resolved now).
+    """
+    model = model or manifest_lib.model_hash()
+    prompt_hash = text_digest(pt.PROMPT_SR_TEXT, pt.NEGATIVE_PROMPT_TEXT)
+    params = manifest_lib.output_params("sr", precision)
+
+    jobs = []
+    for path in targets:
+        input_hash = (digests or {}).get(path) or file_digest(path)
+        key = manifest_lib.job_key(model, prompt_hash, params, conf.SR_SEED, input_hash)
+        stem, ext = os.path.splitext(os.path.basename(path))
+        save_name = f"SR_{stem}_{key[:12]}{ext}"
+        jobs.append({
+            "key": key,
+            "task": "sr",
+            "seed": conf.SR_SEED,
+            "input": os.path.abspath(path),
+            "input_hash": input_hash,
+            "model_hash": model,
+            "prompt_hash": prompt_hash,
+            "params": params,
+            "save_name": save_name,
+            "output": os.path.join(conf.OUTPUT_DIR_SR, _stored_name(save_name)),
+        })
+    return jobs
+
+def process_job(registry, job, upscaled_img, image_writer, manifest=None, stats=None):
+    """Runs one planned SR job and records it in the manifest. Returns the output path or None."""
+    on_saved = None
+    if manifest:
+        on_saved = lambda key=job["key"], name=job["save_name"]: manifest.mark(
+            key, "done", output=os.path.join(conf.OUTPUT_DIR_SR, _stored_name(name)))
+    with trace.span("sr.image", path=job["input"]):
+        save_path = process_single_image_sr(registry, job["input"], conf.OUTPUT_DIR_SR,
+                                            upscaled_img=upscaled_img, image_writer=image_writer,
+                                            save_name=job["save_name"], on_saved=on_saved, stats=stats)
+    if not save_path and manifest:
+        manifest.mark(job["key"], "failed")
+    return save_path
+
+def run_task(file_path=None, folder_path=None, pipe=None, workers=None, config=None):
+    """
+    Entry point for the SR module.
+    pipe: an already loaded pipeline (e.g. resident in the server); loaded from MODEL_PATH if None.
+    workers: number of worker processes, each with its own pipeline (default: WORKER_COUNT).
+             Ignored when pipe is given.
+    config: RuntimeConfig of this run (default: the active conf).
+    Returns the list of saved file paths.
+    """
+    if config is not None:
+        with config.apply():
+            return run_task(file_path, folder_path, pipe, workers)
+
+    saved = []
+    if not file_path and not folder_path:
+        print("[ERROR] SR Task requires --file or --folder argument.")
+        return saved
+
+    problems = check_config()
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        return saved
+
+    targets = resolve_targets(file_path, folder_path)
     if not targets:
         print("[WARN] No images found to process.")
-        return
+        return saved
+
+    # Skip inputs already upscaled with the same model / prompt / settings
+    manifest = RunManifest(conf.OUTPUT_DIR_SR) if conf.MANIFEST_ENABLED else None
+    jobs = plan_jobs(targets)
+    if manifest:
+        done, jobs = manifest.split_done(jobs)
+        for job in done:
+            print(f"[SKIP] Already done: {os.path.basename(job['input'])} -> {job['save_name']}")
+            saved.append(job["output"])
+
+    if not jobs:
+        print("[INFO] All images are already done.")
+        return saved
+
+    workers = workers or conf.WORKER_COUNT
+    if pipe is None and workers > 1:
+        # Every worker process loads its own pipeline; this process only writes the outputs
+        from src.workers import pool
+        return saved + pool.run_sharded("sr", jobs, workers, manifest=manifest)
+
+    # Load Model
+    if pipe is None:
+        pipe = t2i.load_initial_pipeline(conf.MODEL_PATH)
+    registry = t2i.as_registry(pipe)
 
     print("========================================")
-    print(f"SR Task: {len(targets)} images")
+    print(f"SR Task: {len(jobs)} images")
     print("========================================")
 
-    for img_path in targets:
-        process_single_image_sr(pipe, img_path, conf.OUTPUT_DIR_SR)
+    # Decode + pre-upscale the next inputs and encode finished outputs in the background
+    image_writer = BackgroundWriter(conf.IO_WRITER_THREADS, conf.IO_MAX_PENDING_WRITES)
+    prefetcher = Prefetcher(jobs, lambda job: load_sr_input(job["input"]), depth=conf.SR_PREFETCH_DEPTH)
+    stats = {}
+    try:
+        for job, upscaled_img, err in prefetcher:
+            if err is not None:
+                print(f"\n[ERROR] Could not open image {job['input']}: {err}")
+                if manifest:
+                    manifest.mark(job["key"], "failed")
+                continue
+            save_path = process_job(registry, job, upscaled_img, image_writer, manifest, stats)
+            if save_path:
+                saved.append(save_path)
+    finally:
+        failed = image_writer.close()
+    saved = [p for p in saved if p not in {path for path, _ in failed}]
         
     print("========================================")
-    print("SR tasks completed!")
\ No newline at end of file
+    if conf.SR_ADAPTIVE and stats.get("tiles"):
+        print(f"[INFO] Adaptive tiles: {stats['skipped']} of {stats['tiles']} skipped, {stats['reduced']} reduced, "
+              f"{stats['steps']} of {stats['steps_full']} tile steps run, ~{stats['time_saved']:.1f}s saved")
+    print(f"[INFO] Pipeline variants built: {registry.build_counts}")
+    print("SR tasks completed!")
+    return saved
\ No newline at end of file
@@ -0,0 +1,339 @@
+# src/sr/watch.py
+
+import os
+import json
+import time
+import queue
+import signal
+import threading
+
+from src.conf import conf
+from src.sr import sr
+from src.t2i import t2i
+from src.utils.background import BackgroundWriter
+from src.utils import manifest as manifest_lib
+from src.utils.hashing import file_digest, text_digest
+from src.utils.manifest import RunManifest
+
+# Coarsest directory mtime resolution of the file systems a share may use (FAT / SMB: 2s).
+# A directory modified more recently than this is re-listed even if its mtime looks unchanged.
+MTIME_GRANULARITY = 2.0
+
+##### Section I : Incremental Discovery #####
+
+class FolderScanner:
+    """
+    Recursive discovery of SR inputs below `root` that only pays for what changed.
+
+    Adding, removing or renaming a file changes the mtime of its directory, so a scan stats
+    every directory but only lists those whose mtime moved (or is too recent to trust), and only
+    stats the new names in them. The cost of a poll grows with the number of directories and
+    changes, not with the number of files already seen. full=True lists and stats everything
+    (catches files rewritten in place).
+    """
+    def __init__(self, root, exclude=()):
+        self.root = os.path.abspath(root)
+        self.exclude = {os.path.abspath(path) for path in exclude}
+        # dir -> (mtime_ns, input file names, subdir names)
+        self._dirs = {}
+        # file -> (size, mtime_ns) when last reported
+        self._files = {}
+        self.listed = 0
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def scan(self, full=False):
+        """Paths of input files that are new or changed since the last scan."""
+        changed = []
+        visited = set()
+        stack = [self.root]
+        now = time.time()
+        while stack:
+            path = stack.pop()
+            visited.add(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = self._dirs.get(path)
+            stable = entry and entry[0] == st.st_mtime_ns and now - st.st_mtime > MTIME_GRANULARITY
+            if stable and not full:
+                stack.extend(os.path.join(path, name) for name in entry[2])
+                continue
+
+            files, subdirs = set(), set()
+            try:
+                with os.scandir(path) as it:
+                    for item in it:
+                        if item.is_dir(follow_symlinks=False):
+                            if item.path not in self.exclude:
+                                subdirs.add(item.name)
+                        elif sr.is_input(item.name) and not item.name.startswith("."):
+                            files.add(item.name)
+            except OSError:
+                continue
+            self.listed += 1
+
+            known = entry[1] if entry else set()
+            for name in files:
+                if name in known and not full:
+                    continue
+                file_path = os.path.join(path, name)
+                try:
+                    stamp = self._stamp(file_path)
+                except OSError:
+                    continue
+                if self._files.get(file_path) != stamp:
+                    self._files[file_path] = stamp
+                    changed.append(file_path)
+            for name in known - files:
+                self._files.pop(os.path.join(path, name), None)
+            self._dirs[path] = (st.st_mtime_ns, files, subdirs)
+            stack.extend(os.path.join(path, name) for name in subdirs)
+
+        for path in [d for d in self._dirs if d not in visited]:
+            for name in self._dirs.pop(path)[1]:
+                self._files.pop(os.path.join(path, name), None)
+        return changed
+
+##### Section II : Hot Folder #####
+
+class DigestIndex:
+    """
+    Append-only (path, size, mtime) -> sha256 log of the watched files, so a restart does not
+    re-read the whole share. Loaded once; each new file costs one appended line.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._digests = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._digests[record["path"]] = (tuple(record["stamp"]), record["sha256"])
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+    def digest(self, path, stamp):
+        known = self._digests.get(path)
+        if known and known[0] == tuple(stamp):
+            return known[1]
+        digest = file_digest(path)
+        self._digests[path] = (tuple(stamp), digest)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"path": path, "stamp": list(stamp), "sha256": digest}) + "\n")
+        except OSError as e:
+            print(f"[WARN] Could not update watch index {self.path}: {e}")
+        return digest
+
+class HotFolder:
+    """
+    Turns scans of a folder into SR jobs: files are held back until their size and mtime have
+    been unchanged for WATCH_SETTLE_SECONDS, then hashed; content seen before (another name, a
+    re-copy) and jobs already done (manifest) are skipped.
+    """
+    def __init__(self, root, manifest=None, include_existing=None):
+        self.root = os.path.abspath(root)
+        self.manifest = manifest
+        self.scanner = FolderScanner(root, exclude=[conf.OUTPUT_DIR_SR])
+        self.index = DigestIndex(os.path.join(conf.CACHE_DIR, "watch", f"{text_digest(self.root)[:16]}.jsonl"))
+        # path -> (stamp, time since which the stamp has not changed)
+        self.pending = {}
+        # Content digests of jobs handed out and not failed (release() forgets failed ones)
+        self.queued = set()
+        self._lock = threading.Lock()
+        self.last_full = time.time()
+        self.model = None
+
+        include_existing = conf.WATCH_EXISTING if include_existing is None else include_existing
+        existing = self.scanner.scan()
+        if include_existing:
+            for path in existing:
+                try:
+                    stamp = self.scanner._stamp(path)
+                except OSError:
+                    continue
+                # Settled since its last modification (a file still being copied is not)
+                self.pending[path] = (stamp, stamp[1] / 1e9)
+
+    def poll(self):
+        """New jobs that are ready for SR (planned with sr.plan_jobs, marked pending)."""
+        now = time.time()
+        full = conf.WATCH_FULL_SCAN_SECONDS and now - self.last_full >= conf.WATCH_FULL_SCAN_SECONDS
+        if full:
+            self.last_full = now
+        for path in self.scanner.scan(full=bool(full)):
+            if path not in self.pending:
+                self.pending[path] = (None, now)
+
+        ready = []
+        for path, (stamp, since) in list(self.pending.items()):
+            try:
+                current = self.scanner._stamp(path)
+            except OSError:
+                # Removed (or renamed) before it settled
+                del self.pending[path]
+                continue
+            if current != stamp:
+                self.pending[path] = (current, now)
+            elif now - since >= conf.WATCH_SETTLE_SECONDS:
+                del self.pending[path]
+                ready.append((path, current))
+
+        jobs = []
+        for path, stamp in ready:
+            try:
+                digest = self.index.digest(path, stamp)
+            except OSError as e:
+                print(f"[WARN] Could not read {path}: {e}")
+                # Retried once it has settled again
+                self.pending[path] = (None, now)
+                continue
+            with self._lock:
+                if digest in self.queued:
+                    print(f"[SKIP] Same content as an earlier input: {os.path.relpath(path, self.root)}")
+                    continue
+                self.queued.add(digest)
+            self.model = self.model or manifest_lib.model_hash()
+            job = sr.plan_jobs([path], model=self.model, digests={os.path.abspath(path): digest})[0]
+            if self.manifest and self.manifest.is_done(job["key"]):
+                continue
+            if self.manifest:
+                self.manifest.mark(job["key"], "pending", **job)
+            jobs.append(job)
+        return jobs
+
+    def release(self, job):
+        """Forgets a failed job's content, so the same image saved again is retried."""
+        with self._lock:
+            self.queued.discard(job["input_hash"])
+
+##### Section III : Module Execution Entry #####
+
+def _install_stop_handlers(stop):
+    """SIGINT / SIGTERM set `stop` (a second Ctrl+C aborts). Returns the previous handlers."""
+    if threading.current_thread() is not threading.main_thread():
+        return {}
+
+    def handler(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print("\n[WATCH] Stopping after the current image (Ctrl+C again to abort)...")
+        stop.set()
+
+    previous = {}
+    for sig in (signal.SIGINT, getattr(signal, "SIGTERM", None)):
+        if sig is not None:
+            previous[sig] = signal.signal(sig, handler)
+    return previous
+
+def run_task(folder_path, pipe=None, stop=None, config=None):
+    """
+    Watches `folder_path` (recursively) and upscales every new or changed image once it is
+    complete, on one loaded model, until `stop` is set (SIGINT / SIGTERM when run from main).
+    Discovery runs on its own thread and streams settled files, decoded and pre-upscaled, into
+    the SR loop (at most SR_PREFETCH_DEPTH ahead).
+    Returns the list of saved file paths.
+    """
+    if config is not None:
+        with config.apply():
+            return run_task(folder_path, pipe, stop)
+
+    saved = []
+    if not folder_path or not os.path.isdir(folder_path):
+        print(f"[ERROR] Folder not found: {folder_path}")
+        return saved
+    problems = sr.check_config()
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        return saved
+
+    if pipe is None:
+        if not os.path.exists(conf.MODEL_PATH):
+            print(f"[ERROR] Model file not found: {conf.MODEL_PATH}")
+            return saved
+        pipe = t2i.load_initial_pipeline(conf.MODEL_PATH)
+    registry = t2i.as_registry(pipe)
+
+    os.makedirs(conf.OUTPUT_DIR_SR, exist_ok=True)
+    manifest = RunManifest(conf.OUTPUT_DIR_SR) if conf.MANIFEST_ENABLED else None
+    folder = HotFolder(folder_path, manifest)
+    print("========================================")
+    print(f"SR Watch: {folder.root} ({len(folder.scanner._files)} images present, "
+          f"{len(folder.pending)} queued), polling every {conf.WATCH_POLL_SECONDS}s")
+    print("========================================")
+
+    stop = stop or threading.Event()
+    previous = _install_stop_handlers(stop)
+    # (job, upscaled image, error); bounded, so discovery waits while SR is behind
+    loaded = queue.Queue(maxsize=max(1, conf.SR_PREFETCH_DEPTH))
+
+    def discover():
+        while not stop.is_set():
+            try:
+                jobs = folder.poll()
+            except Exception as e:
+                print(f"[ERROR] Watch scan failed: {e}")
+                jobs = []
+            for job in jobs:
+                try:
+                    item = (job, sr.load_sr_input(job["input"]), None)
+                except Exception as e:
+                    item = (job, None, e)
+                while not stop.is_set():
+                    try:
+                        loaded.put(item, timeout=0.2)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    # Jobs not started stay pending in the manifest and run on the next start
+                    break
+            stop.wait(conf.WATCH_POLL_SECONDS)
+
+    scanner = threading.Thread(target=discover, name="watch-scan", daemon=True)
+    scanner.start()
+    image_writer = BackgroundWriter(conf.IO_WRITER_THREADS, conf.IO_MAX_PENDING_WRITES)
+    stats = {}
+    try:
+        while not stop.is_set():
+            try:
+                job, upscaled_img, err = loaded.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            save_path = None
+            if err is not None:
+                print(f"\n[ERROR] Could not open image {job['input']}: {err}")
+            else:
+                try:
+                    save_path = sr.process_job(registry, job, upscaled_img, image_writer, manifest, stats)
+                except Exception as e:
+                    # e.g. out of memory with every fallback step taken: the watch keeps running
+                    print(f"\n[ERROR] SR failed for {job['input']}: {e}")
+                    err = e
+            if save_path:
+                saved.append(save_path)
+                continue
+            if err is not None and manifest:
+                manifest.mark(job["key"], "failed")
+            folder.release(job)
+    finally:
+        stop.set()
+        scanner.join()
+        failed = image_writer.close()
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
+    saved = [p for p in saved if p not in {path for path, _ in failed}]
+
+    print("========================================")
+    print(f"[INFO] Watch stopped: {len(saved)} images upscaled, {folder.scanner.listed} directory listings")
+    print("SR watch completed!")
+    return saved
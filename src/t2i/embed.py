@@ -0,0 +1,138 @@
+# src/t2i/embed.py
+
+import os
+import threading
+from collections import OrderedDict
+
+from src.conf import conf
+from src.utils import devices, trace
+from src.utils.hashing import model_digest, text_digest
+
+EMBED_KEYS = (
+    "prompt_embeds",
+    "negative_prompt_embeds",
+    "pooled_prompt_embeds",
+    "negative_pooled_prompt_embeds",
+)
+
+##### Section I : Prompt Embedding Cache #####
+
+class PromptEmbeddingCache:
+    """
+    Caches SDXL text encoder outputs for one model.
+
+    Entries are keyed by (model file hash, precision, prompt, negative prompt, clip skip), kept
+    in an in-process LRU and optionally persisted as safetensors in cache_dir. The precision
+    (see precision()) keeps fp16 GPU and fp32 / bf16 CPU embeddings apart.
+    Tensors are stored on CPU; the pipelines move them to their execution device.
+    """
+    def __init__(self, model_path, max_entries=16, cache_dir=None):
+        self.model_path = model_path
+        self.max_entries = max(1, max_entries)
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_hash = None
+
+    @property
+    def model_hash(self):
+        if self._model_hash is None:
+            # Not a real checkpoint (e.g. mocked) gives a "path:" identity: only cached in-process
+            self._model_hash = model_digest(self.model_path, os.path.join(conf.CACHE_DIR, "digests.json"))
+        return self._model_hash
+
+    def _disk_path(self, key):
+        if not self.cache_dir or self.model_hash.startswith("path:"):
+            return None
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def get(self, pipe, prompt, negative_prompt, clip_skip=None):
+        """
+        Returns a dict of prompt_embeds / negative_prompt_embeds / pooled_prompt_embeds /
+        negative_pooled_prompt_embeds for one prompt (batch dimension 1).
+        """
+        key = text_digest(self.model_hash, precision(pipe), prompt, negative_prompt, clip_skip)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        embeds = None
+        disk_path = self._disk_path(key)
+        if disk_path and os.path.isfile(disk_path):
+            try:
+                from safetensors.torch import load_file
+                embeds = load_file(disk_path)
+            except Exception as e:
+                print(f"[WARN] Ignoring unreadable prompt cache {disk_path}: {e}")
+
+        if embeds is None:
+            embeds = encode_prompt(pipe, prompt, negative_prompt, clip_skip)
+            if disk_path:
+                try:
+                    from safetensors.torch import save_file
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    save_file({k: v.contiguous() for k, v in embeds.items()}, disk_path)
+                except Exception as e:
+                    print(f"[WARN] Could not persist prompt cache {disk_path}: {e}")
+
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = embeds
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embeds
+
+def precision(pipe):
+    """Dtype the text encoders run at: the pipeline's, and the autocast of the active profile."""
+    profile = devices.active() or {}
+    return f"{getattr(pipe, 'dtype', None)}/{profile.get('autocast')}".replace("torch.", "")
+
+def encode_prompt(pipe, prompt, negative_prompt, clip_skip=None):
+    """Runs both SDXL text encoders once (with CFG) and returns the embeddings on CPU."""
+    import torch
+
+    device = getattr(pipe, "_execution_device", None)
+    with trace.span("prompt_encode"), torch.no_grad():
+        outputs = pipe.encode_prompt(
+            prompt=prompt,
+            device=device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=True,
+            negative_prompt=negative_prompt,
+            clip_skip=clip_skip,
+        )
+    return {k: v.detach().to("cpu") for k, v in zip(EMBED_KEYS, outputs)}
+
+def repeat_embeds(embeds, count):
+    """Expands cached (batch 1) embeddings to a batch of `count` images."""
+    if count == 1:
+        return dict(embeds)
+    return {k: v.repeat(count, *([1] * (v.dim() - 1))) for k, v in embeds.items()}
+
+##### Section II : Module Level Access #####
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(model_path=None):
+    """Returns the shared cache of a model (default: conf.MODEL_PATH)."""
+    model_path = model_path or conf.MODEL_PATH
+    with _caches_lock:
+        if model_path not in _caches:
+            cache_dir = os.path.join(conf.CACHE_DIR, "prompt") if conf.PROMPT_CACHE_PERSIST else None
+            _caches[model_path] = PromptEmbeddingCache(model_path, conf.PROMPT_CACHE_SIZE, cache_dir)
+        return _caches[model_path]
+
+def get_prompt_embeds(pipe, prompt, negative_prompt, count=1, model_path=None):
+    """
+    Cached embeddings for (prompt, negative_prompt), ready to pass to an SDXL pipeline call
+    as **kwargs for a batch of `count` images.
+    """
+    embeds = get_cache(model_path).get(pipe, prompt, negative_prompt, conf.CLIP_SKIP)
+    return repeat_embeds(embeds, count)
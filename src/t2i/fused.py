@@ -0,0 +1,156 @@
+# src/t2i/fused.py
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.conf import conf
+from src.t2i import t2i
+from src.sr import sr
+from src.utils import trace
+from src.utils.background import BackgroundWriter
+from src.utils.manifest import RunManifest
+
+##### Section I : Jobs #####
+
+def plan_jobs(count, manifest=None):
+    """
+    T2I jobs (t2i.plan_jobs, keyed on the T2I and SR settings and prompts) whose output is the
+    SR image in OUTPUT_DIR_SR. The refined image keeps its T2I path as "intermediate".
+    """
+    jobs = t2i.plan_jobs(count, manifest, tasks=("t2i", "sr"))
+    for job in jobs:
+        stem = os.path.splitext(os.path.basename(job["output"]))[0]
+        job["task"] = "t2i_sr"
+        job["intermediate"] = job["output"]
+        job["save_name"] = f"SR_{stem}.png"
+        job["output"] = os.path.join(conf.OUTPUT_DIR_SR, sr._stored_name(job["save_name"]))
+    return jobs
+
+def upscale(image):
+    """Lanczos pre-upscale of a refined image to the SR output size (CPU only)."""
+    with trace.span("sr.load", size=list(image.size)):
+        return sr.upscale_lanczos(image, sr.get_output_size(*image.size))
+
+##### Section II : Module Execution Entry #####
+
+def run_task(num_images=None, pipe=None, batch_size=None, save_intermediates=None, config=None):
+    """
+    T2I followed by SR on one loaded model, without a round trip through PNG files: every
+    refined image goes straight into SR and only the SR result is written (OUTPUT_DIR_SR).
+    Stages overlap: the Lanczos pre-upscale of batch k runs on a thread while batch k+1 is
+    generated, and the canvas merge + PNG encode of an image runs on the writer threads while
+    the next one diffuses.
+    save_intermediates: also write the refined T2I images (default: FUSED_SAVE_INTERMEDIATES).
+    config: RuntimeConfig of this run (default: the active conf).
+    Returns the list of saved SR paths (including outputs completed by an earlier run).
+    """
+    if config is not None:
+        with config.apply():
+            return run_task(num_images, pipe, batch_size, save_intermediates)
+
+    count = num_images if num_images is not None else conf.NUM_IMAGES_TO_GENERATE
+    batch_size = max(1, batch_size or conf.T2I_BATCH_SIZE)
+    if save_intermediates is None:
+        save_intermediates = conf.FUSED_SAVE_INTERMEDIATES
+    saved = []
+
+    problems = t2i.check_config() + sr.check_config()
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        return saved
+
+    os.makedirs(conf.OUTPUT_DIR_SR, exist_ok=True)
+    if save_intermediates:
+        os.makedirs(conf.OUTPUT_DIR_T2I, exist_ok=True)
+
+    manifest = RunManifest(conf.OUTPUT_DIR_SR) if conf.MANIFEST_ENABLED else None
+    jobs = plan_jobs(count, manifest)
+    if manifest:
+        done, jobs = manifest.split_done(jobs)
+        for job in done:
+            print(f"[SKIP] Already done: {os.path.basename(job['output'])} (Seed: {job['seed']})")
+            saved.append(job["output"])
+    if not jobs:
+        print("[INFO] All images of this batch are already done.")
+        return saved
+
+    if pipe is None:
+        if not os.path.exists(conf.MODEL_PATH):
+            print(f"[ERROR] Model file not found: {conf.MODEL_PATH}")
+            return saved
+        # One model load for both stages
+        pipe = t2i.load_initial_pipeline(conf.MODEL_PATH)
+    registry = t2i.as_registry(pipe)
+
+    print("========================================")
+    print(f"Fused T2I -> SR Task: {len(jobs)} images"
+          f"{' (saving intermediates)' if save_intermediates else ''}")
+    print("========================================")
+
+    image_writer = BackgroundWriter(conf.IO_WRITER_THREADS, conf.IO_MAX_PENDING_WRITES)
+    upscaler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upscale")
+    # (job, future of the upscaled image) of the last generated batch
+    pending = deque()
+    stats = {}
+    start = time.perf_counter()
+
+    def finish(job, future):
+        on_saved = None
+        if manifest:
+            on_saved = lambda key=job["key"], path=job["output"]: manifest.mark(key, "done", output=path)
+        try:
+            upscaled_img = future.result()
+            with trace.span("sr.image", seed=job["seed"]):
+                save_path = sr.process_single_image_sr(registry, job["save_name"], conf.OUTPUT_DIR_SR,
+                                                       upscaled_img=upscaled_img, image_writer=image_writer,
+                                                       save_name=job["save_name"], on_saved=on_saved, stats=stats)
+        except Exception as e:
+            if t2i.is_oom_error(e):
+                raise
+            print(f"[ERROR] SR failed for seed {job['seed']}: {e}")
+            save_path = None
+        if save_path:
+            saved.append(save_path)
+            print(f"[SUCCESS] Saved: {os.path.basename(save_path)} (Seed: {job['seed']})")
+        elif manifest:
+            manifest.mark(job["key"], "failed")
+
+    try:
+        for batch, results in t2i.iter_batches(registry, jobs, count, batch_size):
+            ready = list(pending)
+            pending.clear()
+            for job, (base_img, refined_img, seed) in zip(batch, results):
+                if save_intermediates and base_img is not None and conf.T2I_SAVE_BASE:
+                    image_writer.submit(base_img, job["intermediate"].replace("_final.png", "_base.png"))
+                if not refined_img:
+                    if manifest:
+                        manifest.mark(job["key"], "failed")
+                    print(f"[SKIP] Failed to generate image {job['index']}")
+                    continue
+                if save_intermediates:
+                    image_writer.submit(refined_img, job["intermediate"])
+                # Upscaled while the previous batch goes through SR and the next one is generated
+                pending.append((job, upscaler.submit(upscale, refined_img)))
+            # SR of the previous batch: its upscale ran during this batch's generation
+            for job, future in ready:
+                finish(job, future)
+        while pending:
+            finish(*pending.popleft())
+    finally:
+        for _, future in pending:
+            future.cancel()
+        upscaler.shutdown(wait=True)
+        failed = image_writer.close()
+    saved = [p for p in saved if p not in {path for path, _ in failed}]
+
+    print("========================================")
+    print(f"[INFO] {(time.perf_counter() - start) / len(jobs):.2f}s per image (T2I + SR)")
+    if conf.SR_ADAPTIVE and stats.get("tiles"):
+        print(f"[INFO] Adaptive tiles: {stats['skipped']} of {stats['tiles']} skipped, {stats['reduced']} reduced, "
+              f"{stats['steps']} of {stats['steps_full']} tile steps run")
+    print(f"[INFO] Pipeline variants built: {registry.build_counts}")
+    print("Fused T2I -> SR tasks completed!")
+    return saved
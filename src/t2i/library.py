@@ -0,0 +1,148 @@
+# src/t2i/library.py
+
+import os
+import json
+import importlib.util
+from contextlib import contextmanager
+
+from src.conf import conf
+from src.conf import prompt as pt
+from src.t2i import t2i
+
+PROMPT_NAMES = ("PROMPT_TEXT", "NEGATIVE_PROMPT_TEXT", "PROMPT_REFINE_TEXT", "PROMPT_SR_TEXT")
+
+##### Section I : Prompt Modules #####
+
+def load_prompt_module(path):
+    """
+    Reads a prompt module (e.g. prompt/001_RaidenShogun_Selfie.py) into a dict with name (file
+    stem), path and the PROMPT_NAMES. PROMPT_TEXT is required; PROMPT_REFINE_TEXT and
+    PROMPT_SR_TEXT default to PROMPT_TEXT, NEGATIVE_PROMPT_TEXT to the one of src/conf/prompt.py.
+    """
+    path = os.path.abspath(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(f"_prompt_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    if not isinstance(getattr(module, "PROMPT_TEXT", None), str):
+        raise ValueError(f"{path} does not define PROMPT_TEXT")
+    prompts = {"name": name, "path": path, "PROMPT_TEXT": module.PROMPT_TEXT}
+    prompts["NEGATIVE_PROMPT_TEXT"] = getattr(module, "NEGATIVE_PROMPT_TEXT", pt.NEGATIVE_PROMPT_TEXT)
+    prompts["PROMPT_REFINE_TEXT"] = getattr(module, "PROMPT_REFINE_TEXT", module.PROMPT_TEXT)
+    prompts["PROMPT_SR_TEXT"] = getattr(module, "PROMPT_SR_TEXT", module.PROMPT_TEXT)
+    return prompts
+
+@contextmanager
+def use_prompts(prompts):
+    """Makes `prompts` the active prompt set (src/conf/prompt.py values) inside the block."""
+    old = {name: getattr(pt, name) for name in PROMPT_NAMES}
+    try:
+        for name in PROMPT_NAMES:
+            setattr(pt, name, prompts[name])
+        yield
+    finally:
+        for name, value in old.items():
+            setattr(pt, name, value)
+
+##### Section II : Job Lists #####
+
+def prompt_paths(path):
+    """Prompt module paths of a file or directory (sorted, skipping __init__.py etc.)."""
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path))
+                if f.endswith(".py") and not f.startswith("_")]
+    return [path]
+
+def read_job_file(path):
+    """
+    Job file (JSON): {"prompt/001_RaidenShogun_Selfie.py": 4, ...} or
+    {"jobs": [{"prompt": "prompt/001_RaidenShogun_Selfie.py", "count": 4}, ...]}.
+    Relative prompt paths are resolved against the job file's directory.
+    Returns a list of (prompt path, count).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "jobs" in data:
+        entries = [(job["prompt"], job.get("count", conf.NUM_IMAGES_TO_GENERATE)) for job in data["jobs"]]
+    elif isinstance(data, dict):
+        entries = list(data.items())
+    else:
+        raise ValueError(f"{path}: expected a mapping of prompt module -> count or a 'jobs' list")
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for prompt_path, count in entries:
+        prompt_path = prompt_path if os.path.isabs(prompt_path) else os.path.join(base, prompt_path)
+        jobs.extend((p, int(count)) for p in prompt_paths(prompt_path))
+    return jobs
+
+def group_jobs(jobs):
+    """
+    Merges (prompt path, count) entries by prompt module, keeping the order of first appearance,
+    so every prompt is encoded once and its images are batched together.
+    Returns a list of (prompts, count) with prompts as returned by load_prompt_module.
+    """
+    counts = {}
+    for path, count in jobs:
+        path = os.path.abspath(path)
+        counts[path] = counts.get(path, 0) + count
+    return [(load_prompt_module(path), count) for path, count in counts.items() if count > 0]
+
+##### Section III : Module Execution Entry #####
+
+def run_task(jobs, pipe=None, batch_size=None):
+    """
+    Runs T2I for every prompt group on one loaded model. Each group runs with its prompt set
+    active and writes to OUTPUT_DIR_T2I/<prompt name> (own manifest, so reruns skip finished
+    images per prompt). The text embeddings of a prompt are encoded once for its whole group.
+    jobs: list of (prompt module path, count).
+    Returns {prompt name: [saved paths]}.
+    """
+    try:
+        groups = group_jobs(jobs)
+    except (OSError, SyntaxError, ValueError) as e:
+        print(f"[ERROR] Could not load prompt module: {e}")
+        return {}
+    if not groups:
+        print("[WARN] No prompt jobs to run.")
+        return {}
+    names = [prompts["name"] for prompts, _ in groups]
+    if len(set(names)) != len(names):
+        print(f"[ERROR] Prompt module names must be unique (they name the output folders): {names}")
+        return {}
+
+    problems = t2i.check_config()
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        return {}
+    if pipe is None:
+        if not os.path.exists(conf.MODEL_PATH):
+            print(f"[ERROR] Model file not found: {conf.MODEL_PATH}")
+            return {}
+        # One model load for every prompt
+        pipe = t2i.load_initial_pipeline(conf.MODEL_PATH)
+    registry = t2i.as_registry(pipe)
+
+    print("========================================")
+    print(f"Prompt Library: {len(groups)} prompts, {sum(count for _, count in groups)} images")
+    for prompts, count in groups:
+        print(f"   |-- {prompts['name']}: {count} images")
+    print("========================================")
+
+    results = {}
+    output_root = conf.OUTPUT_DIR_T2I
+    try:
+        for prompts, count in groups:
+            print(f"\n[PROMPT] {prompts['name']} ({count} images)")
+            conf.OUTPUT_DIR_T2I = os.path.join(output_root, prompts["name"])
+            with use_prompts(prompts):
+                results[prompts["name"]] = t2i.run_task(num_images=count, pipe=registry, batch_size=batch_size)
+    finally:
+        conf.OUTPUT_DIR_T2I = output_root
+
+    print("========================================")
+    for name, saved in results.items():
+        print(f"[INFO] {name}: {len(saved)} images in {os.path.join(output_root, name)}")
+    print("Prompt library completed!")
+    return results
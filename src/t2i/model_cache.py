@@ -0,0 +1,196 @@
+# src/t2i/model_cache.py
+
+import os
+import json
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from src.conf import conf
+from src.utils import trace
+from src.utils.hashing import model_digest
+
+MARKER_FILENAME = "cache.json"
+# A conversion directory (*.tmp) untouched for this long was left by a process that died
+TMP_STALE_SECONDS = 3600
+# A lock older than this was left by a process that died while renaming its conversion
+LOCK_STALE_SECONDS = 60
+
+##### Section I : Cache Layout #####
+
+def _dtype_name(dtype):
+    return str(dtype).replace("torch.", "")
+
+def checkpoint_digest(model_path):
+    # Same digest index as the manifest / prompt cache: a checkpoint is hashed once per (size, mtime)
+    return model_digest(model_path, os.path.join(conf.CACHE_DIR, "digests.json"))
+
+def cache_path(model_path, dtype, digest=None):
+    """
+    Cache directory of a checkpoint converted to `dtype`: MODEL_CACHE_DIR/<name>-<hash>-<dtype>.
+    A changed checkpoint has a new hash and therefore a new directory.
+    """
+    digest = digest or checkpoint_digest(model_path)
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(conf.MODEL_CACHE_DIR, f"{name}-{digest[:16]}-{_dtype_name(dtype)}")
+
+def _read_marker(path):
+    try:
+        with open(os.path.join(path, MARKER_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_valid(path, digest, dtype):
+    """True if `path` holds a complete conversion of the checkpoint `digest` in `dtype`."""
+    marker = _read_marker(path)
+    return bool(marker) and marker.get("sha256") == digest and marker.get("dtype") == _dtype_name(dtype)
+
+def _idle_seconds(path):
+    """Seconds since anything below `path` was last modified."""
+    newest = os.path.getmtime(path)
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                pass
+    return time.time() - newest
+
+def prune(model_path, digest=None):
+    """
+    Removes cache entries of older versions of `model_path` (another checkpoint digest; every
+    dtype of the current version is kept) and unfinished conversions abandoned by an interrupted
+    run (conversions still being written by another process are left alone). Returns the removed paths.
+    """
+    if not os.path.isdir(conf.MODEL_CACHE_DIR):
+        return []
+    digest = digest or checkpoint_digest(model_path)
+    source = os.path.abspath(model_path)
+    removed = []
+    for entry in os.listdir(conf.MODEL_CACHE_DIR):
+        path = os.path.join(conf.MODEL_CACHE_DIR, entry)
+        if not os.path.isdir(path):
+            continue
+        marker = _read_marker(path)
+        if marker:
+            stale = marker.get("source") == source and marker.get("sha256") != digest
+        else:
+            try:
+                stale = entry.endswith(".tmp") and _idle_seconds(path) > TMP_STALE_SECONDS
+            except OSError:
+                continue
+        if stale:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+    return removed
+
+@contextmanager
+def _lock(path, timeout=None):
+    """
+    Exclusive lock file `path`.lock for the short step that replaces a cache entry. A lock older
+    than LOCK_STALE_SECONDS is taken over. Raises TimeoutError after `timeout` seconds.
+    """
+    lock_path = path + ".lock"
+    deadline = time.monotonic() + (timeout if timeout is not None else LOCK_STALE_SECONDS * 2)
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_STALE_SECONDS:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for {lock_path}")
+            time.sleep(0.1)
+    try:
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+##### Section II : Load / Store #####
+
+def load(model_path, dtype, digest=None):
+    """
+    Loads the pipeline from its diffusers-layout cache, or returns None if there is no valid one.
+    Weights are safetensors that diffusers memory-maps, already in `dtype`, so nothing is remapped
+    or cast: only the pages actually touched are read.
+    """
+    if not conf.MODEL_CACHE_ENABLED or not os.path.isfile(model_path):
+        return None
+    from src.t2i import t2i
+
+    digest = digest or checkpoint_digest(model_path)
+    path = cache_path(model_path, dtype, digest)
+    if not is_valid(path, digest, dtype):
+        return None
+    with trace.span("load_model.cache", path=path):
+        try:
+            pipe = t2i.StableDiffusionXLPipeline.from_pretrained(
+                path,
+                torch_dtype=dtype,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+            )
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable model cache {path}: {e}")
+            return None
+    print(f"[INFO] Loaded converted model from cache: {path}")
+    return pipe
+
+def store(pipe, model_path, dtype, digest=None):
+    """
+    Writes a freshly converted pipeline as a diffusers-layout safetensors cache (before any
+    offload hooks are attached) and removes the entries of older versions of the checkpoint.
+    Every writer fills its own temporary directory, which is renamed under a lock once complete,
+    so an interrupted conversion is never loaded and concurrent writers (worker processes that
+    all missed the cache) never mix their files: the first complete one wins, the others are
+    discarded. Returns the cache path, or None on failure.
+    """
+    if not conf.MODEL_CACHE_ENABLED or not os.path.isfile(model_path):
+        return None
+    digest = digest or checkpoint_digest(model_path)
+    path = cache_path(model_path, dtype, digest)
+    if is_valid(path, digest, dtype):
+        return path
+
+    print(f"[INFO] Writing converted model cache: {path} ...")
+    start = time.perf_counter()
+    tmp_path = None
+    with trace.span("model_cache.store", path=path):
+        try:
+            os.makedirs(conf.MODEL_CACHE_DIR, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=conf.MODEL_CACHE_DIR)
+            pipe.save_pretrained(tmp_path, safe_serialization=True)
+            # The marker is written last: its presence means the conversion is complete
+            with open(os.path.join(tmp_path, MARKER_FILENAME), "w", encoding="utf-8") as f:
+                json.dump({"source": os.path.abspath(model_path), "sha256": digest, "dtype": _dtype_name(dtype)},
+                          f, indent=1)
+            with _lock(path):
+                if is_valid(path, digest, dtype):
+                    # Another process finished the same conversion first
+                    print(f"[INFO] Model cache was written by another process: {path}")
+                else:
+                    shutil.rmtree(path, ignore_errors=True)
+                    os.replace(tmp_path, path)
+                    tmp_path = None
+        except Exception as e:
+            print(f"[WARN] Could not write model cache {path}: {e}")
+            return None
+        finally:
+            if tmp_path:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+    for stale in prune(model_path, digest):
+        print(f"[INFO] Removed stale model cache: {stale}")
+    print(f"[INFO] Model cache written in {time.perf_counter() - start:.1f}s")
+    return path
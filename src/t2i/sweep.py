@@ -0,0 +1,304 @@
+# src/t2i/sweep.py
+
+import os
+import io
+import json
+import time
+import uuid
+import itertools
+from contextlib import contextmanager
+
+from PIL import Image, ImageDraw
+
+from src.conf import conf
+from src.conf import prompt as pt
+from src.t2i import t2i
+from src.utils import trace
+from src.utils import devices
+from src.utils import manifest as manifest_lib
+from src.utils.hashing import text_digest
+
+# Settings a sweep may vary, by the stage they belong to
+REFINE_PARAMS = ("REFINE_STRENGTH", "REFINE_GUIDANCE_SCALE", "REFINE_INFERENCE_STEPS")
+SR_PARAMS = ("SR_STRENGTH", "SR_GUIDANCE_SCALE", "SR_INFERENCE_STEPS")
+# Settings stage 1 depends on (its memo key)
+STAGE1_PARAMS = ("IMAGE_HEIGHT", "IMAGE_WIDTH", "BASE_INFERENCE_STEPS", "BASE_GUIDANCE_SCALE", "TARGET_SIZE",
+                 "ORIGINAL_SIZE", "NEGATIVE_ORIGINAL_SIZE", "CLIP_SKIP", "T2I_LATENT_HANDOFF")
+
+##### Section I : Grid #####
+
+def parse_sweep(specs):
+    """
+    Parses ["refine_strength=0.3,0.4,0.5", ...] into an ordered {conf name: [values]}.
+    Values get the type of the current conf value (int / float). Raises ValueError for
+    malformed specs and settings given twice.
+    """
+    grid = {}
+    for spec in specs:
+        name, sep, values = spec.partition("=")
+        name = name.strip().upper()
+        if not sep or not values.strip():
+            raise ValueError(f"Sweep must look like name=v1,v2,...: {spec!r}")
+        if name not in REFINE_PARAMS + SR_PARAMS:
+            raise ValueError(f"Cannot sweep {name}: choose from {', '.join(REFINE_PARAMS + SR_PARAMS)}")
+        if name in grid:
+            raise ValueError(f"{name} is swept twice: list all its values in one spec ({name.lower()}=v1,v2,...)")
+        cast = int if isinstance(getattr(conf, name), int) else float
+        try:
+            grid[name] = [cast(v) for v in values.split(",") if v.strip()]
+        except ValueError:
+            raise ValueError(f"{name} values must be {cast.__name__}s: {values!r}")
+    return grid
+
+def grid_cells(grid):
+    """Every combination of the swept values, as {conf name: value} dicts (first name varies slowest)."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def cell_label(cell):
+    return "_".join(f"{name.lower()}-{value}" for name, value in cell.items())
+
+@contextmanager
+def overrides(values):
+    """Temporarily sets conf values."""
+    old = {name: getattr(conf, name) for name in values}
+    try:
+        for name, value in values.items():
+            setattr(conf, name, value)
+        yield
+    finally:
+        for name, value in old.items():
+            setattr(conf, name, value)
+
+##### Section II : Memoized Nodes #####
+
+class Stage1Memo:
+    """
+    Stage 1 results per seed: the latents (or PIL base with T2I_LATENT_HANDOFF off) plus the
+    generator state after stage 1, so a refine node continues exactly like a normal two-stage
+    run with that seed. Kept in memory; latents are also stored as safetensors in cache_dir,
+    keyed by model, prompt, stage 1 settings, device profile and seed.
+    """
+    def __init__(self, model_hash, cache_dir=None):
+        self.model_hash = model_hash
+        self.cache_dir = cache_dir
+        self.computed = 0
+        self.loaded = 0
+        self._entries = {}
+
+    def key(self, seed):
+        params = {name: getattr(conf, name) for name in STAGE1_PARAMS}
+        profile = devices.active()
+        device = profile["name"] if profile else None
+        return text_digest(self.model_hash, pt.PROMPT_TEXT, pt.NEGATIVE_PROMPT_TEXT,
+                           json.dumps(params, sort_keys=True, default=str), device, seed)
+
+    def _disk_path(self, key):
+        if not self.cache_dir or not conf.T2I_LATENT_HANDOFF or self.model_hash.startswith("path:"):
+            return None
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def _load(self, key):
+        path = self._disk_path(key)
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            from safetensors.torch import load_file
+            tensors = load_file(path)
+            return tensors["latents"], tensors["generator_state"]
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable stage 1 cache {path}: {e}")
+            return None
+
+    def _store(self, key, entry):
+        path = self._disk_path(key)
+        if not path:
+            return
+        try:
+            from safetensors.torch import save_file
+            os.makedirs(self.cache_dir, exist_ok=True)
+            save_file({"latents": entry[0].contiguous(), "generator_state": entry[1]}, path)
+        except Exception as e:
+            print(f"[WARN] Could not write stage 1 cache {path}: {e}")
+
+    def get(self, registry, seeds, batch_size):
+        """{seed: (stage 1 output, generator state)}, computing the missing seeds in batches."""
+        import torch
+
+        keys = {seed: self.key(seed) for seed in seeds}
+        missing = []
+        for seed in seeds:
+            if keys[seed] in self._entries:
+                continue
+            entry = self._load(keys[seed])
+            if entry is not None:
+                self._entries[keys[seed]] = entry
+                self.loaded += 1
+            else:
+                missing.append(seed)
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        output_type = "latent" if conf.T2I_LATENT_HANDOFF else "pil"
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            print(f"   |-- [Stage 1] Seeds {batch} (computed once for every grid cell)")
+            generators = [torch.Generator(device).manual_seed(seed) for seed in batch]
+            outputs = t2i.generate_stage1(registry, generators, output_type=output_type)
+            for n, (seed, generator) in enumerate(zip(batch, generators)):
+                output = outputs[n:n + 1] if output_type == "latent" else outputs[n]
+                entry = (output.cpu() if output_type == "latent" else output, generator.get_state())
+                self._entries[keys[seed]] = entry
+                self._store(keys[seed], entry)
+                self.computed += 1
+        return {seed: self._entries[keys[seed]] for seed in seeds}
+
+def refine_node(registry, stage1, seeds, batch_size):
+    """Stage 2 of the memoized stage 1 outputs with the current conf. Returns {seed: image}."""
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    refined = {}
+    for i in range(0, len(seeds), batch_size):
+        batch = seeds[i:i + batch_size]
+        generators = []
+        for seed in batch:
+            generator = torch.Generator(device)
+            generator.set_state(stage1[seed][1])
+            generators.append(generator)
+        if conf.T2I_LATENT_HANDOFF:
+            base = torch.cat([stage1[seed][0] for seed in batch]).to(device)
+        else:
+            base = [stage1[seed][0] for seed in batch]
+        for seed, image in zip(batch, t2i.refine_stage2(registry, base, generators)):
+            refined[seed] = image
+    return refined
+
+def sr_node(registry, image, out_dir, save_name):
+    """SR of an in-memory refined image with the current conf. Returns the saved path."""
+    from src.sr import sr
+
+    upscaled = sr.upscale_lanczos(image, sr.get_output_size(*image.size))
+    return sr.process_single_image_sr(registry, save_name, out_dir, upscaled_img=upscaled, save_name=save_name)
+
+##### Section III : Comparison Grid #####
+
+def comparison_grid(images, labels, rows, cols, thumb_size=None):
+    """Lays out images (row-major) in a rows x cols sheet with a label strip above every cell."""
+    thumb_size = thumb_size or conf.SWEEP_THUMB_SIZE
+    thumbs = []
+    for image in images:
+        image = image.copy()
+        image.thumbnail((thumb_size, thumb_size))
+        thumbs.append(image)
+    cell_w = max(t.width for t in thumbs)
+    cell_h = max(t.height for t in thumbs)
+    strip = 16 * max(1, max(label.count("\n") + 1 for label in labels))
+    sheet = Image.new("RGB", (cols * cell_w, rows * (cell_h + strip)), (255, 255, 255))
+    draw = ImageDraw.Draw(sheet)
+    for n, (thumb, label) in enumerate(zip(thumbs, labels)):
+        x, y = (n % cols) * cell_w, (n // cols) * (cell_h + strip)
+        draw.multiline_text((x + 4, y + 2), label, fill=(0, 0, 0))
+        sheet.paste(thumb, (x, y + strip))
+    return sheet
+
+##### Section IV : Module Execution Entry #####
+
+def run_task(specs, num_images=None, pipe=None, batch_size=None):
+    """
+    Sweeps refine / SR settings over `num_images` seeds as a small DAG:
+    stage 1 (once per seed, memoized) -> refine (once per seed and refine setting) -> SR (per cell,
+    only if SR settings are swept). Writes every cell and one comparison grid per seed to
+    OUTPUT_DIR_T2I/sweep_<time>_<id>. Returns the output folder, or None on failure.
+    specs: ["refine_strength=0.3,0.4,0.5", ...].
+    """
+    try:
+        grid = parse_sweep(specs)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return None
+    cells = grid_cells(grid)
+    count = num_images if num_images is not None else conf.NUM_IMAGES_TO_GENERATE
+    batch_size = max(1, batch_size or conf.T2I_BATCH_SIZE)
+    with_sr = any(name in SR_PARAMS for name in grid)
+
+    problems = []
+    for cell in cells:
+        with overrides(cell):
+            problems += [f"{cell_label(cell)}: {p}" for p in t2i.check_config()]
+            if with_sr:
+                from src.sr import sr
+                problems += [f"{cell_label(cell)}: {p}" for p in sr.check_config()]
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        return None
+
+    if pipe is None:
+        if not os.path.exists(conf.MODEL_PATH):
+            print(f"[ERROR] Model file not found: {conf.MODEL_PATH}")
+            return None
+        pipe = t2i.load_initial_pipeline(conf.MODEL_PATH)
+    registry = t2i.as_registry(pipe)
+
+    if conf.T2I_SEED is not None:
+        seeds = [(conf.T2I_SEED + n) % 2**32 for n in range(count)]
+    else:
+        seeds = [t2i.new_seed() for _ in range(count)]
+    out_dir = os.path.join(conf.OUTPUT_DIR_T2I, f"sweep_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    print("========================================")
+    print(f"Sweep: {len(seeds)} seeds x {len(cells)} settings ({', '.join(grid)})")
+    print("========================================")
+    start = time.perf_counter()
+
+    memo = Stage1Memo(manifest_lib.model_hash(),
+                      os.path.join(conf.CACHE_DIR, "stage1") if conf.SWEEP_CACHE_DISK else None)
+    stage1 = memo.get(registry, seeds, batch_size)
+
+    # Refine nodes only depend on the refine part of a cell
+    refine_names = [name for name in grid if name in REFINE_PARAMS]
+    refined = {}
+    outputs = {seed: [] for seed in seeds}
+    for cell in cells:
+        refine_key = tuple((name, cell[name]) for name in refine_names)
+        label = cell_label(cell)
+        with overrides(cell):
+            if refine_key not in refined:
+                print(f"   |-- [Stage 2] {cell_label(dict(refine_key)) or 'base settings'}")
+                refined[refine_key] = refine_node(registry, stage1, seeds, batch_size)
+            for seed in seeds:
+                name = f"seed{seed}_{label}.png"
+                if with_sr:
+                    path = sr_node(registry, refined[refine_key][seed], out_dir, name)
+                    # Only the grid needs it: keep a thumbnail, not the file handle or full image
+                    with Image.open(path) as opened:
+                        image = opened.copy()
+                    image.thumbnail((conf.SWEEP_THUMB_SIZE, conf.SWEEP_THUMB_SIZE))
+                else:
+                    path = os.path.join(out_dir, name)
+                    image = refined[refine_key][seed]
+                    with trace.span("save", path=path):
+                        image.save(path)
+                outputs[seed].append((cell, path, image))
+
+    # One comparison sheet per seed: rows = values of the first swept setting
+    rows = len(grid[next(iter(grid))])
+    cols = len(cells) // rows
+    index = []
+    for seed, cells_out in outputs.items():
+        labels = ["\n".join(f"{n.lower()}={v}" for n, v in cell.items()) for cell, _, _ in cells_out]
+        sheet = comparison_grid([image for _, _, image in cells_out], labels, rows, cols)
+        sheet_path = os.path.join(out_dir, f"grid_seed{seed}.png")
+        sheet.save(sheet_path)
+        index.append({"seed": seed, "grid": sheet_path,
+                      "cells": [{"params": cell, "output": path} for cell, path, _ in cells_out]})
+    with open(os.path.join(out_dir, "sweep.json"), "w", encoding="utf-8") as f:
+        json.dump({"grid": grid, "seeds": index}, f, indent=1)
+
+    print("========================================")
+    print(f"[INFO] Stage 1: {memo.computed} computed, {memo.loaded} from cache for "
+          f"{len(seeds) * len(cells)} outputs; {len(refined)} refine settings")
+    print(f"[INFO] Sweep took {time.perf_counter() - start:.1f}s -> {out_dir}")
+    print("Sweep completed!")
+    return out_dir
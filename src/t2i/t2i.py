@@ -1,40 +1,93 @@
 # src/t2i/t2i.py
 
-import torch
-from diffusers import StableDiffusionXLPipeline, AutoPipelineForText2Image, AutoPipelineForImage2Image, EulerAncestralDiscreteScheduler
 import os
 import sys
+import json
+import secrets
+import time
+import uuid
 
 # Adjusted imports for new structure
 from src.conf import conf
 from src.conf import prompt as pt
+from src.t2i.embed import get_prompt_embeds
+from src.t2i import model_cache
+from src.utils.background import BackgroundWriter
+from src.utils import trace
+from src.utils import devices
+from src.utils import budget
+from src.utils import manifest as manifest_lib
+from src.utils.manifest import RunManifest
+from src.utils.hashing import text_digest
+
+# torch / diffusers take seconds to import: they are loaded on first use, so --help, --dry-run
+# and early errors stay fast. The diffusers classes below become module attributes on demand.
+DIFFUSERS_NAMES = (
+    "StableDiffusionXLPipeline", "AutoPipelineForText2Image", "AutoPipelineForImage2Image",
+    "EulerAncestralDiscreteScheduler",
+)
+
+def _require_diffusers():
+    """Imports the diffusers classes into this module (names already set, e.g. patched, are kept)."""
+    missing = [name for name in DIFFUSERS_NAMES if name not in globals()]
+    if missing:
+        import diffusers
+        for name in missing:
+            globals()[name] = getattr(diffusers, name)
+
+def __getattr__(name):
+    if name in DIFFUSERS_NAMES:
+        _require_diffusers()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 ##### Section I : Core Logic #####
 
-def load_initial_pipeline(model_path):
+def get_available_memory(device):
+    """
+    Returns the free memory (bytes) on device, or None if it cannot be determined.
+    cuda: free VRAM reported by the driver; cpu: MemAvailable of the host.
+    """
+    try:
+        if device == "cuda":
+            import torch
+            free, _ = torch.cuda.mem_get_info()
+            return free
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, RuntimeError, AttributeError):
+        return None
+
+def load_initial_pipeline(model_path, device=None):
+    """
+    device: "cuda", "cuda:<index>" or "cpu" (default: cuda if available).
+    The execution profile (offload, dtype, threads, ...) comes from conf.DEVICE_PROFILE.
+    """
+    with trace.span("load_model", path=model_path):
+        return _load_initial_pipeline(model_path, device)
+
+def _load_initial_pipeline(model_path, device=None):
+    _require_diffusers()
+
     print(f"[INFO] Loading SDXL Model from: {model_path} ...")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"[INFO] Device: {device}")
+    profile = devices.resolve(device=device)
+    print(f"[INFO] Device profile: {devices.describe(profile)}")
     
     try:
-        # Loading single files (.safetensors)
-        pipe = StableDiffusionXLPipeline.from_single_file(
-            model_path,
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-            use_safetensors=True,
-        )
+        pipe = load_pipeline_weights(model_path, profile["dtype"])
         
         # Scheduler
         pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(
             pipe.scheduler.config
         )
 
-        # --- Optimizations for 8GB VRAM (RTX 4060) ---
-        pipe.enable_model_cpu_offload() 
-        pipe.vae.enable_slicing()
-        pipe.vae.enable_tiling()
+        # Offload / VAE slicing+tiling only where they pay off (low-VRAM GPUs)
+        devices.apply(pipe, profile)
         
-        print("[INFO] Model loaded successfully with VRAM optimizations!")
+        print("[INFO] Model loaded successfully!")
         return pipe
     except Exception as e:
         print(f"[ERROR] Failed to load model: {e}")
@@ -42,96 +95,484 @@ def load_initial_pipeline(model_path):
         traceback.print_exc()
         sys.exit(1)
 
-def process_two_stage_generation(pipe, index, total_images):
-    print(f"\n[INFO] Processing Task {index + 1}/{total_images} ...")
+def load_pipeline_weights(model_path, dtype):
+    """
+    The bare pipeline in `dtype`: from the converted diffusers-layout cache if there is a valid one
+    for this checkpoint, else converted from the single file (and cached for the next start).
+    """
+    pipe = model_cache.load(model_path, dtype)
+    if pipe is None:
+        # Loading single files (.safetensors): key remapping, text encoder setup and casts
+        with trace.span("load_model.single_file", path=model_path):
+            pipe = StableDiffusionXLPipeline.from_single_file(
+                model_path,
+                torch_dtype=dtype,
+                use_safetensors=True,
+            )
+        model_cache.store(pipe, model_path, dtype)
+    return pipe
+
+def convert_model(model_path=None, device=None):
+    """One-time conversion of the checkpoint into the model cache. Returns the cache path or None."""
+    _require_diffusers()
+
+    model_path = model_path or conf.MODEL_PATH
+    if not os.path.exists(model_path):
+        print(f"[ERROR] Model not found at {model_path}")
+        return None
+    dtype = devices.resolve(device=device)["dtype"]
+    path = model_cache.cache_path(model_path, dtype)
+    if model_cache.is_valid(path, model_cache.checkpoint_digest(model_path), dtype):
+        print(f"[INFO] Model cache is up to date: {path}")
+        return path
+    load_pipeline_weights(model_path, dtype)
+    return path if os.path.isdir(path) else None
+
+class PipelineRegistry:
+    """
+    Builds the text2img / img2img variants of one loaded pipeline once and hands them out per stage.
+    Variants share the UNet / VAE / text encoders (and their offload hooks) of the base pipeline.
+    build_counts: how many times each variant was constructed.
+    memory: offload / VAE tiling after out-of-memory fallback steps (see budget.fallback).
+    """
+    def __init__(self, pipe):
+        _require_diffusers()
+        self.base = pipe
+        self.build_counts = {"text2img": 0, "img2img": 0}
+        self.memory = None
+        self._variants = {}
+        # The single-file loader already returns a text2img pipeline
+        if isinstance(pipe, StableDiffusionXLPipeline):
+            self._variants["text2img"] = pipe
+
+    def get(self, kind):
+        if kind not in self._variants:
+            if kind == "text2img":
+                self._variants[kind] = AutoPipelineForText2Image.from_pipe(self.base)
+            elif kind == "img2img":
+                self._variants[kind] = AutoPipelineForImage2Image.from_pipe(self.base)
+            else:
+                raise ValueError(f"Unknown pipeline variant: {kind}")
+            self.build_counts[kind] += 1
+        return self._variants[kind]
+
+    def text2img(self):
+        return self.get("text2img")
+
+    def img2img(self):
+        return self.get("img2img")
+
+def as_registry(pipe):
+    """Wraps a loaded pipeline in a PipelineRegistry (registries are returned unchanged)."""
+    if isinstance(pipe, PipelineRegistry):
+        return pipe
+    return PipelineRegistry(pipe)
+
+def new_seed():
+    """Random 32-bit seed for one image."""
+    return secrets.randbits(32)
+
+def is_oom_error(e):
+    """True for out-of-memory errors of any device (CUDA OOM, failed CPU allocation)."""
+    if isinstance(e, MemoryError):
+        return True
+    import torch
+    oom_type = getattr(torch.cuda, "OutOfMemoryError", None)
+    if oom_type is not None and isinstance(e, oom_type):
+        return True
+    message = str(e).lower()
+    return isinstance(e, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+def decode_latents(pipe, latents):
+    """
+    VAE-decodes SDXL latents (as returned with output_type="latent") to PIL images.
+    Mirrors the pipeline's own decode: fp16 VAE upcast, latents mean/std denormalization.
+    """
+    import torch
+
+    vae = pipe.vae
+    with trace.span("t2i.vae_decode", images=len(latents)), torch.no_grad():
+        needs_upcasting = vae.dtype == torch.float16 and vae.config.force_upcast
+        if needs_upcasting:
+            pipe.upcast_vae()
+        latents = latents.to(next(iter(vae.post_quant_conv.parameters())).dtype)
+
+        latents_mean = getattr(vae.config, "latents_mean", None)
+        latents_std = getattr(vae.config, "latents_std", None)
+        if latents_mean is not None and latents_std is not None:
+            mean = torch.tensor(latents_mean).view(1, 4, 1, 1).to(latents.device, latents.dtype)
+            std = torch.tensor(latents_std).view(1, 4, 1, 1).to(latents.device, latents.dtype)
+            latents = latents * std / vae.config.scaling_factor + mean
+        else:
+            latents = latents / vae.config.scaling_factor
+
+        image = vae.decode(latents, return_dict=False)[0]
+        if needs_upcasting:
+            vae.to(dtype=torch.float16)
+
+    return pipe.image_processor.postprocess(image, output_type="pil")
+
+def generate_stage1(registry, generators, output_type="latent"):
+    """Stage 1 (text2img) for one image per generator. Returns latents or PIL images."""
+    pipe = registry.text2img()
+    count = len(generators)
+    embeds = get_prompt_embeds(pipe, pt.PROMPT_TEXT, pt.NEGATIVE_PROMPT_TEXT, count=count)
+    with trace.span("t2i.stage1", images=count, steps=conf.BASE_INFERENCE_STEPS), devices.autocast():
+        return pipe(
+            **embeds,
+            height=conf.IMAGE_HEIGHT, 
+            width=conf.IMAGE_WIDTH,   
+            guidance_scale=conf.BASE_GUIDANCE_SCALE, 
+            num_inference_steps=conf.BASE_INFERENCE_STEPS, 
+            target_size=conf.TARGET_SIZE,
+            original_size=conf.ORIGINAL_SIZE, 
+            negative_original_size=conf.NEGATIVE_ORIGINAL_SIZE,
+            generator=generators,
+            output_type=output_type,
+            callback_on_step_end=trace.step_callback("t2i.stage1"),
+        ).images
+
+def refine_stage2(registry, stage1, generators):
+    """Stage 2 (img2img refinement) of stage 1 latents / images. Returns PIL images."""
+    pipe = registry.img2img()
+    count = len(generators)
+    embeds = get_prompt_embeds(pipe, pt.PROMPT_REFINE_TEXT, pt.NEGATIVE_PROMPT_TEXT, count=count)
+    with trace.span("t2i.stage2", images=count, steps=conf.REFINE_INFERENCE_STEPS), devices.autocast():
+        return pipe(
+            **embeds,
+            image=stage1,
+            strength=conf.REFINE_STRENGTH,
+            guidance_scale=conf.REFINE_GUIDANCE_SCALE,
+            num_inference_steps=conf.REFINE_INFERENCE_STEPS,
+            target_size=conf.TARGET_SIZE,
+            original_size=conf.ORIGINAL_SIZE, 
+            negative_original_size=conf.NEGATIVE_ORIGINAL_SIZE,
+            generator=generators,
+            callback_on_step_end=trace.step_callback("t2i.stage2"),
+        ).images
+
+def process_two_stage_batch(registry, seeds, index, total_images, raise_oom=False):
+    """
+    Runs stage 1 and stage 2 over len(seeds) images in one pipeline call per stage.
+    Every image has its own generator, so each one is reproducible from its seed alone.
+    With T2I_LATENT_HANDOFF, stage 1 hands its latents straight to stage 2 (no VAE decode +
+    re-encode in between); base_image is then only decoded if T2I_SAVE_BASE is set.
+    Returns a list of (base_image, refined_image, seed); failed images have None entries.
+    raise_oom: re-raise out-of-memory errors (for adaptive batching) instead of failing the batch.
+    """
+    count = len(seeds)
+    if count == 1:
+        print(f"\n[INFO] Processing Task {index + 1}/{total_images} ...")
+    else:
+        print(f"\n[INFO] Processing Tasks {index + 1}-{index + count}/{total_images} (batch of {count}) ...")
+    print(f"   |-- Seeds: {seeds}")
     
-    # Generate a random seed
-    seed = torch.randint(0, 2**32, (1,)).item()
+    import torch
+
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    generator = torch.Generator(device).manual_seed(seed)
+    generators = [torch.Generator(device).manual_seed(seed) for seed in seeds]
     
     # Stage 1: Text to Image
     print(f"   |-- [Stage 1] Generating Base Structure (CFG: {conf.BASE_GUIDANCE_SCALE})...")
     
-    if not isinstance(pipe, AutoPipelineForText2Image):
-        pipe = AutoPipelineForText2Image.from_pipe(pipe)
+    handoff = conf.T2I_LATENT_HANDOFF
     
     try:
-        base_image = pipe(
-            prompt=pt.PROMPT_TEXT,
-            negative_prompt=pt.NEGATIVE_PROMPT_TEXT,
-            height=conf.IMAGE_HEIGHT, 
-            width=conf.IMAGE_WIDTH,   
-            guidance_scale=conf.BASE_GUIDANCE_SCALE, 
-            num_inference_steps=conf.BASE_INFERENCE_STEPS, 
-            target_size=conf.TARGET_SIZE,
-            original_size=conf.ORIGINAL_SIZE, 
-            negative_original_size=conf.NEGATIVE_ORIGINAL_SIZE,
-            generator=generator,
-            output_type="pil"
-        ).images[0]
+        stage1 = generate_stage1(registry, generators, output_type="latent" if handoff else "pil")
+        
+        if not handoff:
+            base_images = stage1
+        elif conf.T2I_SAVE_BASE:
+            base_images = decode_latents(registry.text2img(), stage1)
+        else:
+            base_images = [None] * count
     except Exception as e:
+        if raise_oom and is_oom_error(e):
+            raise
         print(f"[ERROR] Stage 1 failed: {e}")
-        return None, None, None, pipe
+        return [(None, None, None)] * count
 
     # Stage 2: Refinement
     print(f"   |-- [Stage 2] Refining Texture (CFG: {conf.REFINE_GUIDANCE_SCALE}, Str: {conf.REFINE_STRENGTH})...")
     
-    pipe = AutoPipelineForImage2Image.from_pipe(pipe)
-    
     try:
-        refined_image = pipe(
-            prompt=pt.PROMPT_REFINE_TEXT,
-            negative_prompt=pt.NEGATIVE_PROMPT_TEXT,
-            image=base_image,
-            strength=conf.REFINE_STRENGTH,
-            guidance_scale=conf.REFINE_GUIDANCE_SCALE,
-            num_inference_steps=conf.REFINE_INFERENCE_STEPS,
-            target_size=conf.TARGET_SIZE,
-            original_size=conf.ORIGINAL_SIZE, 
-            negative_original_size=conf.NEGATIVE_ORIGINAL_SIZE,
-            generator=generator
-        ).images[0]
+        refined_images = refine_stage2(registry, stage1, generators)
         
-        return base_image, refined_image, seed, pipe
+        return list(zip(base_images, refined_images, seeds))
     except Exception as e:
+        if raise_oom and is_oom_error(e):
+            raise
         print(f"[ERROR] Stage 2 failed: {e}")
-        return base_image, None, seed, pipe
+        return [(base, None, seed) for base, seed in zip(base_images, seeds)]
+
+def process_two_stage_generation(registry, index, total_images, seed=None):
+    """
+    Single image version of process_two_stage_batch. Returns (base_image, refined_image, seed).
+    Out of memory: retried with the same seed one fallback step lower (see budget.recover).
+    """
+    seed = new_seed() if seed is None else seed
+    retried = False
+    while True:
+        try:
+            result = process_two_stage_batch(registry, [seed], index, total_images, raise_oom=True)[0]
+        except Exception as e:
+            if not is_oom_error(e):
+                raise
+            if budget.recover(registry, "t2i", f"seed {seed}"):
+                retried = True
+                continue
+            print(f"[ERROR] Out of memory on seed {seed}: {e}")
+            return (None, None, seed)
+        if retried and result[1] is not None:
+            budget.report(registry, "t2i", f"Seed {seed}", batch=1)
+        return result
 
 ##### Section II : Module Execution Entry #####
 
-def run_task(num_images=None):
+def check_config():
+    """Returns the problems of the T2I settings (empty if they are usable)."""
+    problems = []
+    if conf.IMAGE_WIDTH <= 0 or conf.IMAGE_HEIGHT <= 0 or conf.IMAGE_WIDTH % 8 or conf.IMAGE_HEIGHT % 8:
+        problems.append(f"IMAGE_WIDTH x IMAGE_HEIGHT ({conf.IMAGE_WIDTH}x{conf.IMAGE_HEIGHT}) must be positive multiples of 8")
+    if conf.BASE_INFERENCE_STEPS < 1:
+        problems.append(f"BASE_INFERENCE_STEPS ({conf.BASE_INFERENCE_STEPS}) must be at least 1")
+    if not 0 < conf.REFINE_STRENGTH <= 1:
+        problems.append(f"REFINE_STRENGTH ({conf.REFINE_STRENGTH}) must be in (0, 1]")
+    elif int(conf.REFINE_INFERENCE_STEPS * conf.REFINE_STRENGTH) < 1:
+        problems.append(f"REFINE_INFERENCE_STEPS * REFINE_STRENGTH ({conf.REFINE_INFERENCE_STEPS} * "
+                        f"{conf.REFINE_STRENGTH}) runs no denoising step")
+    if conf.T2I_BATCH_SIZE < 1:
+        problems.append(f"T2I_BATCH_SIZE ({conf.T2I_BATCH_SIZE}) must be at least 1")
+    return problems
+
+def steps_per_image():
+    """Denoising steps of one image: stage 1 + the img2img share of stage 2."""
+    return conf.BASE_INFERENCE_STEPS + int(conf.REFINE_INFERENCE_STEPS * conf.REFINE_STRENGTH)
+
+def plan_jobs(count, manifest=None, model=None, seeds=None, tasks=("t2i",), precision=None):
+    """
+    Plans the jobs of a batch of `count` images: dicts with key, seed, index, output, ...
+    The key covers model hash, prompt hash, seed and the output-relevant conf settings of
+    `tasks`, and names the output file. An interrupted batch with the same settings is resumed
+    with its seeds.
+    model: checkpoint digest (default: manifest.model_hash()).
+    seeds: fixed seeds of the images (e.g. picked by triage) instead of T2I_SEED / random ones.
+    tasks: ("t2i", "sr") for images that also go through SR (fused runs).
+    precision: devices.precision() of the run (default: resolved now).
+    """
+    model = model or manifest_lib.model_hash()
+    prompts = [pt.PROMPT_TEXT, pt.PROMPT_REFINE_TEXT, pt.NEGATIVE_PROMPT_TEXT]
+    if "sr" in tasks:
+        prompts.append(pt.PROMPT_SR_TEXT)
+    prompt_hash = text_digest(*prompts)
+    params = manifest_lib.output_params(tasks, precision)
+    signature = text_digest(model, prompt_hash, json.dumps(params, sort_keys=True), count,
+                            conf.T2I_SEED if seeds is None else list(seeds))
+
+    resumed = manifest.latest_open_batch(signature) if manifest else None
+    if seeds is not None:
+        seeds = list(seeds)
+        batch, created = uuid.uuid4().hex[:12], time.time()
+    elif resumed and len(resumed) == count:
+        print(f"[INFO] Resuming interrupted batch {resumed[0]['batch']}")
+        seeds = [job["seed"] for job in resumed]
+        batch, created = resumed[0]["batch"], resumed[0]["created"]
+    else:
+        if conf.T2I_SEED is not None:
+            seeds = [(conf.T2I_SEED + n) % 2**32 for n in range(count)]
+        else:
+            seeds = [new_seed() for _ in range(count)]
+        batch, created = uuid.uuid4().hex[:12], time.time()
+
+    jobs = []
+    for n, seed in enumerate(seeds, 1):
+        key = manifest_lib.job_key(model, prompt_hash, params, seed)
+        jobs.append({
+            "key": key,
+            "task": "t2i",
+            "seed": seed,
+            "index": n,
+            "batch": batch,
+            "created": created,
+            "signature": signature,
+            "model_hash": model,
+            "prompt_hash": prompt_hash,
+            "params": params,
+            "output": os.path.join(conf.OUTPUT_DIR_T2I, f"{conf.BASE_FILENAME_PREFIX}_{key[:16]}_final.png"),
+        })
+    return jobs
+
+def run_task(num_images=None, pipe=None, batch_size=None, workers=None, config=None):
     """
     Entry point for the T2I module.
+    pipe: an already loaded pipeline (e.g. resident in the server); loaded from MODEL_PATH if None.
+    batch_size: images per pipeline call (default: T2I_BATCH_SIZE).
+    workers: number of worker processes, each with its own pipeline (default: WORKER_COUNT).
+             Ignored when pipe is given.
+    config: RuntimeConfig of this run (default: the active conf).
+    Returns the list of saved file paths (including outputs completed by an earlier run).
     """
+    if config is not None:
+        with config.apply():
+            return run_task(num_images, pipe, batch_size, workers)
+
     # Determine number of images
     count = num_images if num_images is not None else conf.NUM_IMAGES_TO_GENERATE
-    
-    if not os.path.exists(conf.MODEL_PATH):
-        print(f"[ERROR] Model file not found: {conf.MODEL_PATH}")
-        return
+    batch_size = max(1, batch_size or conf.T2I_BATCH_SIZE)
+    saved = []
 
+    problems = check_config()
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        return saved
+    
     if not os.path.exists(conf.OUTPUT_DIR_T2I):
         os.makedirs(conf.OUTPUT_DIR_T2I)
 
+    # Skip jobs completed by an earlier (possibly interrupted) run
+    manifest = RunManifest(conf.OUTPUT_DIR_T2I) if conf.MANIFEST_ENABLED else None
+    jobs = plan_jobs(count, manifest)
+    if manifest:
+        done, jobs = manifest.split_done(jobs)
+        for job in done:
+            print(f"[SKIP] Already done: {os.path.basename(job['output'])} (Seed: {job['seed']})")
+            saved.append(job["output"])
+
+    if not jobs:
+        print("[INFO] All images of this batch are already done.")
+        return saved
+
+    if pipe is None and not os.path.exists(conf.MODEL_PATH):
+        print(f"[ERROR] Model file not found: {conf.MODEL_PATH}")
+        return saved
+
+    workers = workers or conf.WORKER_COUNT
+    if pipe is None and workers > 1:
+        # Every worker process loads its own pipeline; this process only writes the outputs
+        from src.workers import pool
+        return saved + pool.run_sharded("t2i", jobs, workers, batch_size=batch_size, total=count, manifest=manifest)
+
     # Load Initial Pipeline
-    pipe = load_initial_pipeline(conf.MODEL_PATH)
+    if pipe is None:
+        pipe = load_initial_pipeline(conf.MODEL_PATH)
+    return saved + run_jobs(as_registry(pipe), jobs, count, batch_size, manifest)
 
+def run_jobs(registry, jobs, total, batch_size, manifest=None):
+    """Generates planned jobs in this process and writes them. Returns the saved file paths."""
+    saved = []
     print("========================================")
-    print(f"Batch Task: {count} images (Two-Stage Optimized)")
+    print(f"Batch Task: {len(jobs)} images (Two-Stage Optimized)")
     print("========================================")
 
-    for i in range(count):
-        # Pass 0 as index for now or track manually
-        base_img, final_img, seed, pipe = process_two_stage_generation(pipe, i, count)
+    # PNG encoding runs in the background while the next batch is generated
+    image_writer = BackgroundWriter(conf.IO_WRITER_THREADS, conf.IO_MAX_PENDING_WRITES)
+    start = time.perf_counter()
+    try:
+        generate_batches(registry, jobs, total, batch_size, image_writer, saved, manifest)
+    finally:
+        failed = image_writer.close()
+    elapsed = time.perf_counter() - start
+    saved = [p for p in saved if p not in {path for path, _ in failed}]
 
-        if final_img:
-            filename = f"{conf.BASE_FILENAME_PREFIX}_{i+1:02d}_final.png"
-            save_path = os.path.join(conf.OUTPUT_DIR_T2I, filename)
-            final_img.save(save_path)
-            print(f"[SUCCESS] Saved: {filename} (Seed: {seed})")
-        else:
-            print(f"[SKIP] Failed to generate image {i+1}")
+    print("========================================")
+    handoff = "latent" if conf.T2I_LATENT_HANDOFF else "pil"
+    print(f"[INFO] {elapsed / len(jobs):.2f}s per image (stage 1 -> 2 handoff: {handoff})")
+    print(f"[INFO] Pipeline variants built: {registry.build_counts}")
+    print("T2I tasks completed!")
+    return saved
 
+def dry_run(num_images=None, batch_size=None):
+    """
+    Validates the settings and prints what run_task would do (outputs, seeds, steps) without
+    importing torch / diffusers or loading the model. Returns the list of problems found.
+    """
+    count = num_images if num_images is not None else conf.NUM_IMAGES_TO_GENERATE
+    batch_size = max(1, batch_size or conf.T2I_BATCH_SIZE)
+    problems = check_config()
+    if not os.path.isfile(conf.MODEL_PATH):
+        problems.append(f"Model file not found: {conf.MODEL_PATH}")
+
+    # Hashing a multi-GB checkpoint is the real run's job
+    model = manifest_lib.model_hash(cached_only=True)
+    # Resolving the device profile imports torch
+    precision = devices.precision(cached_only=True)
+    manifest = RunManifest(conf.OUTPUT_DIR_T2I) if conf.MANIFEST_ENABLED else None
+    jobs = plan_jobs(count, manifest, model=model or "unhashed",
+                     precision=precision or {"dtype": "unresolved", "autocast": None})
+    todo = [job for job in jobs if not (manifest and manifest.is_done(job["key"]))]
+
+    print("========================================")
+    print(f"T2I Dry Run: {count} images ({len(jobs) - len(todo)} already done), batch of {batch_size}")
     print("========================================")
-    print("T2I tasks completed!")
\ No newline at end of file
+    print(f"   |-- Size: {conf.IMAGE_WIDTH}x{conf.IMAGE_HEIGHT}, handoff: {'latent' if conf.T2I_LATENT_HANDOFF else 'pil'}")
+    print(f"   |-- Steps per image: {conf.BASE_INFERENCE_STEPS} (stage 1) + "
+          f"{int(conf.REFINE_INFERENCE_STEPS * conf.REFINE_STRENGTH)} (stage 2) = {steps_per_image()}")
+    print(f"   |-- Steps to run: {steps_per_image() * len(todo)}")
+    if model is None:
+        print("   |-- Output names are provisional: the checkpoint has not been hashed yet")
+    if precision is None:
+        print("   |-- Output names are provisional: the device profile is resolved by the real run")
+    for job in jobs:
+        state = "done" if job not in todo else "todo"
+        print(f"       > [{state}] {job['output']} (Seed: {job['seed']})")
+    for problem in problems:
+        print(f"[ERROR] {problem}")
+    return problems
+
+def iter_batches(registry, jobs, total, batch_size):
+    """
+    Generates the planned jobs in batches, halving the batch on OOM. A batch of 1 that still runs
+    out of memory is retried one fallback step lower (VAE tiling, offload; see budget.recover).
+    Yields (batch jobs, results) with results as returned by process_two_stage_batch.
+    """
+    i = 0
+    retried = False
+    while i < len(jobs):
+        size = min(batch_size, len(jobs) - i)
+        batch = jobs[i:i + size]
+        # Seeds are fixed by the plan, so an OOM retry regenerates exactly the same images
+        seeds = [job["seed"] for job in batch]
+
+        try:
+            results = process_two_stage_batch(registry, seeds, batch[0]["index"] - 1, total,
+                                              raise_oom=conf.T2I_ADAPTIVE_BATCH or conf.MEM_OOM_FALLBACK)
+        except Exception as e:
+            if not is_oom_error(e):
+                raise
+            if size > 1 and conf.T2I_ADAPTIVE_BATCH:
+                batch_size = max(1, size // 2)
+                print(f"[WARN] Out of memory with a batch of {size}, retrying with {batch_size}")
+                budget.free_device_cache()
+                retried = True
+                continue
+            if budget.recover(registry, "t2i", f"seeds {seeds}"):
+                retried = True
+                continue
+            print(f"[ERROR] Out of memory even with a batch of {size}: {e}")
+            results = [(None, None, seed) for seed in seeds]
+
+        if retried and any(refined is not None for _, refined, _ in results):
+            budget.report(registry, "t2i", f"Seeds {seeds}", batch=size)
+            retried = False
+        yield batch, results
+        i += size
+
+def generate_batches(registry, jobs, total, batch_size, image_writer, saved, manifest=None):
+    """Generates the planned jobs in batches (halving on OOM) and queues them on image_writer."""
+    for batch, results in iter_batches(registry, jobs, total, batch_size):
+        for job, (base_img, final_img, seed) in zip(batch, results):
+            save_path = job["output"]
+            if base_img is not None and conf.T2I_SAVE_BASE:
+                image_writer.submit(base_img, save_path.replace("_final.png", "_base.png"))
+            if final_img:
+                on_saved = None
+                if manifest:
+                    on_saved = lambda key=job["key"]: manifest.mark(key, "done")
+                image_writer.submit(final_img, save_path, on_saved=on_saved)
+                saved.append(save_path)
+                print(f"[SUCCESS] Saved: {os.path.basename(save_path)} (Seed: {job['seed']})")
+            else:
+                if manifest:
+                    manifest.mark(job["key"], "failed")
+                print(f"[SKIP] Failed to generate image {job['index']}")
@@ -0,0 +1,271 @@
+# src/t2i/triage.py
+
+import os
+import json
+import time
+import importlib
+import uuid
+
+import numpy as np
+from PIL import Image
+
+from src.conf import conf
+from src.conf import prompt as pt
+from src.t2i import t2i
+from src.t2i.embed import get_prompt_embeds
+from src.utils import trace
+from src.utils import devices
+from src.utils.manifest import RunManifest
+
+# Linear SDXL latent -> RGB approximation (per latent channel, plus bias), in [-1, 1]
+LATENT_RGB_FACTORS = (
+    (0.3651, 0.4232, 0.4341),
+    (-0.2533, -0.0042, 0.1068),
+    (0.1076, 0.1111, -0.0362),
+    (-0.3165, -0.2492, -0.2188),
+)
+LATENT_RGB_BIAS = (0.1084, -0.0175, -0.0011)
+
+##### Section I : Metrics #####
+
+def _gray(image):
+    return np.asarray(image.convert("L"), dtype=np.float32)
+
+def sharpness(image):
+    """Variance of the 4-neighbour Laplacian of the grayscale image (higher = more detail)."""
+    g = _gray(image)
+    if g.shape[0] < 3 or g.shape[1] < 3:
+        return 0.0
+    lap = (g[:-2, 1:-1] + g[2:, 1:-1] + g[1:-1, :-2] + g[1:-1, 2:]) - 4 * g[1:-1, 1:-1]
+    return float(lap.var())
+
+def exposure(image):
+    """
+    1.0 for a histogram centred on mid-grey without clipping. Loses the share of clipped
+    shadows / highlights and the distance of the mean luminance from mid-grey.
+    """
+    hist = np.bincount(_gray(image).astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    hist /= max(hist.sum(), 1)
+    clipped = hist[:3].sum() + hist[253:].sum()
+    mean = (hist * np.arange(256)).sum() / 255
+    return float((1 - clipped) * (1 - 2 * abs(mean - 0.5)))
+
+def load_scorer(spec):
+    """Resolves TRIAGE_SCORER ("package.module:function") to the callable, or None."""
+    if not spec:
+        return None
+    module_name, _, name = spec.partition(":")
+    if not name:
+        raise ValueError(f"TRIAGE_SCORER must look like 'package.module:function', got {spec!r}")
+    return getattr(importlib.import_module(module_name), name)
+
+def _ranks(values):
+    """Ranks scaled to [0, 1] (best = 1, ties share their mean rank)."""
+    if len(values) == 1:
+        return [1.0]
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 / (len(values) - 1)
+        i = j + 1
+    return ranks
+
+def score_candidates(candidates, scorer=None, weights=None):
+    """
+    Adds "metrics" and "score" to every candidate ({"seed", "image"}) and returns them best first.
+    Each metric is ranked across the candidates and the score is the weighted mean rank, so
+    metrics with different scales (Laplacian variance, [0, 1] exposure, the scorer) can be mixed.
+    """
+    weights = weights if weights is not None else conf.TRIAGE_WEIGHTS
+    metrics = {"sharpness": sharpness, "exposure": exposure}
+    if scorer is not None:
+        metrics["scorer"] = lambda image, seed: scorer(image, seed)
+    metrics = {name: fn for name, fn in metrics.items() if weights.get(name, 0) > 0}
+
+    with trace.span("triage.score", images=len(candidates)):
+        for cand in candidates:
+            cand["metrics"] = {
+                name: float(fn(cand["image"], cand["seed"]) if name == "scorer" else fn(cand["image"]))
+                for name, fn in metrics.items()
+            }
+        total = sum(weights[name] for name in metrics) or 1.0
+        scores = [0.0] * len(candidates)
+        for name in metrics:
+            for i, rank in enumerate(_ranks([c["metrics"][name] for c in candidates])):
+                scores[i] += weights[name] * rank / total
+        for cand, score in zip(candidates, scores):
+            cand["score"] = score
+    return sorted(candidates, key=lambda c: -c["score"])
+
+##### Section II : Drafts #####
+
+def latent_preview(latents):
+    """Approximate RGB previews (1/8 resolution) of SDXL latents, without the VAE."""
+    import torch
+
+    factors = torch.tensor(LATENT_RGB_FACTORS, dtype=torch.float32)
+    bias = torch.tensor(LATENT_RGB_BIAS, dtype=torch.float32)
+    rgb = torch.einsum("bchw,cr->bhwr", latents.float().cpu(), factors) + bias
+    rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).round().to(torch.uint8).numpy()
+    return [Image.fromarray(img) for img in rgb]
+
+def draft_size():
+    """(height, width) of the drafts: TRIAGE_SCALE of the final size, multiples of 8."""
+    scale = lambda value: max(8, int(value * conf.TRIAGE_SCALE) // 8 * 8)
+    return scale(conf.IMAGE_HEIGHT), scale(conf.IMAGE_WIDTH)
+
+def draft_batch(registry, seeds):
+    """Stage 1 only, with TRIAGE_STEPS steps. Returns one preview image per seed."""
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    generators = [torch.Generator(device).manual_seed(seed) for seed in seeds]
+    height, width = draft_size()
+    pipe = registry.text2img()
+
+    embeds = get_prompt_embeds(pipe, pt.PROMPT_TEXT, pt.NEGATIVE_PROMPT_TEXT, count=len(seeds))
+    with trace.span("triage.draft", images=len(seeds), steps=conf.TRIAGE_STEPS), devices.autocast():
+        latents = pipe(
+            **embeds,
+            height=height,
+            width=width,
+            guidance_scale=conf.BASE_GUIDANCE_SCALE,
+            num_inference_steps=conf.TRIAGE_STEPS,
+            # Same micro-conditioning as the final images
+            target_size=conf.TARGET_SIZE,
+            original_size=conf.ORIGINAL_SIZE,
+            negative_original_size=conf.NEGATIVE_ORIGINAL_SIZE,
+            generator=generators,
+            output_type="latent",
+            callback_on_step_end=trace.step_callback("triage.draft"),
+        ).images
+    if conf.TRIAGE_PREVIEW == "vae":
+        return t2i.decode_latents(pipe, latents)
+    return latent_preview(latents)
+
+def draft_steps(count):
+    """Denoising work of `count` drafts, in full-size steps (cost scales with the pixel count)."""
+    height, width = draft_size()
+    return count * conf.TRIAGE_STEPS * height * width / (conf.IMAGE_HEIGHT * conf.IMAGE_WIDTH)
+
+##### Section III : Module Execution Entry #####
+
+def check_config(candidates, keep):
+    """Returns the problems of the triage settings (empty if they are usable)."""
+    problems = []
+    if keep < 1:
+        problems.append(f"keep ({keep}) must be at least 1")
+    if candidates < 1:
+        problems.append(f"Number of candidates ({candidates}) must be at least 1")
+    if conf.TRIAGE_STEPS < 1:
+        problems.append(f"TRIAGE_STEPS ({conf.TRIAGE_STEPS}) must be at least 1")
+    if not 0 < conf.TRIAGE_SCALE <= 1:
+        problems.append(f"TRIAGE_SCALE ({conf.TRIAGE_SCALE}) must be in (0, 1]")
+    if conf.TRIAGE_PREVIEW not in ("latent", "vae"):
+        problems.append(f"TRIAGE_PREVIEW must be 'latent' or 'vae', got {conf.TRIAGE_PREVIEW!r}")
+    try:
+        load_scorer(conf.TRIAGE_SCORER)
+    except (ImportError, AttributeError, ValueError) as e:
+        problems.append(f"TRIAGE_SCORER ({conf.TRIAGE_SCORER}) cannot be loaded: {e}")
+    return problems
+
+def candidate_seeds(count):
+    if conf.T2I_SEED is not None:
+        return [(conf.T2I_SEED + n) % 2**32 for n in range(count)]
+    return [t2i.new_seed() for _ in range(count)]
+
+def _save_report(candidates, kept):
+    out_dir = os.path.join(conf.OUTPUT_DIR_T2I, "triage")
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    report = []
+    for rank, cand in enumerate(candidates, 1):
+        preview = os.path.join(out_dir, f"{conf.BASE_FILENAME_PREFIX}_{stamp}_{rank:03d}_{cand['seed']}.png")
+        cand["image"].save(preview)
+        report.append({"rank": rank, "seed": cand["seed"], "score": cand["score"], "metrics": cand["metrics"],
+                       "kept": cand["seed"] in kept, "preview": preview})
+    path = os.path.join(out_dir, f"triage_{stamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    return path
+
+def run_task(candidates, keep=None, pipe=None, batch_size=None, scorer=None):
+    """
+    Drafts `candidates` seeds, keeps the best `keep` (default: TRIAGE_KEEP) and runs the full
+    two-stage pipeline on those seeds only. The kept images are regular T2I jobs (manifest,
+    content-addressed names), so a kept seed gives the same file as a plain run with that seed.
+    scorer: callable(image, seed) -> float (default: TRIAGE_SCORER).
+    Returns the list of saved file paths.
+    """
+    keep = keep or conf.TRIAGE_KEEP
+    batch_size = max(1, batch_size or conf.T2I_BATCH_SIZE)
+    problems = t2i.check_config() + check_config(candidates, keep)
+    if problems:
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        return []
+    if keep > candidates:
+        print(f"[WARN] Keeping {keep} of {candidates} candidates: every candidate is kept")
+        keep = candidates
+    scorer = scorer or load_scorer(conf.TRIAGE_SCORER)
+
+    if pipe is None:
+        if not os.path.exists(conf.MODEL_PATH):
+            print(f"[ERROR] Model file not found: {conf.MODEL_PATH}")
+            return []
+        pipe = t2i.load_initial_pipeline(conf.MODEL_PATH)
+    registry = t2i.as_registry(pipe)
+
+    height, width = draft_size()
+    print("========================================")
+    print(f"Triage: {candidates} drafts ({width}x{height}, {conf.TRIAGE_STEPS} steps, "
+          f"{conf.TRIAGE_PREVIEW} preview), keeping {keep}")
+    print("========================================")
+    start = time.perf_counter()
+    seeds = candidate_seeds(candidates)
+    drafts = []
+    for i in range(0, len(seeds), batch_size):
+        batch = seeds[i:i + batch_size]
+        print(f"[INFO] Drafting {i + 1}-{i + len(batch)}/{candidates} ...")
+        try:
+            images = draft_batch(registry, batch)
+        except Exception as e:
+            print(f"[ERROR] Draft failed for seeds {batch}: {e}")
+            continue
+        drafts.extend({"seed": seed, "image": image} for seed, image in zip(batch, images))
+    if not drafts:
+        print("[ERROR] No draft succeeded")
+        return []
+
+    ranked = score_candidates(drafts, scorer)
+    kept = [cand["seed"] for cand in ranked[:keep]]
+    for rank, cand in enumerate(ranked, 1):
+        metrics = ", ".join(f"{name} {value:.3g}" for name, value in cand["metrics"].items())
+        print(f"   |-- #{rank} Seed {cand['seed']}: score {cand['score']:.3f} ({metrics})"
+              + (" [keep]" if cand["seed"] in kept else ""))
+    if conf.TRIAGE_SAVE_PREVIEWS:
+        print(f"[INFO] Triage report: {_save_report(ranked, kept)}")
+
+    # Full cost for the keepers only
+    full = t2i.steps_per_image()
+    spent = draft_steps(len(drafts)) + full * len(kept)
+    print(f"[INFO] Triage took {time.perf_counter() - start:.1f}s; "
+          f"~{spent:.0f} full-size steps instead of {full * len(drafts)} for {len(drafts)} full images")
+
+    manifest = RunManifest(conf.OUTPUT_DIR_T2I) if conf.MANIFEST_ENABLED else None
+    jobs = t2i.plan_jobs(len(kept), manifest, seeds=kept)
+    saved = []
+    if manifest:
+        done, jobs = manifest.split_done(jobs)
+        for job in done:
+            print(f"[SKIP] Already done: {os.path.basename(job['output'])} (Seed: {job['seed']})")
+            saved.append(job["output"])
+    if not jobs:
+        return saved
+    os.makedirs(conf.OUTPUT_DIR_T2I, exist_ok=True)
+    return saved + t2i.run_jobs(registry, jobs, len(kept), batch_size, manifest)
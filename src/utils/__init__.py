@@ -0,0 +1 @@
+# src/utils/__init__.py
\ No newline at end of file
@@ -0,0 +1,138 @@
+# src/utils/background.py
+
+import os
+import uuid
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils import trace
+
+##### Section I : Background Image Writer #####
+
+class BackgroundWriter:
+    """
+    Encodes and saves images on a small thread pool so the denoiser does not wait for zlib.
+
+    At most `max_pending` images are queued or being written; submit() blocks beyond that
+    (backpressure keeps memory bounded). Images are written under a temporary name and renamed
+    once complete: a failed write leaves neither a partial file nor damage to an existing one.
+    """
+    def __init__(self, workers=2, max_pending=4):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="image-writer")
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._futures = []
+        self._lock = threading.Lock()
+        self.written = []
+        self.failed = []
+
+    @staticmethod
+    def _save(image, path):
+        # Same directory (rename stays atomic), same extension (the format follows it)
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.{uuid.uuid4().hex[:8]}.tmp{ext}"
+        try:
+            if callable(image):
+                # Deferred image (e.g. an SR canvas merge): built on the writer thread as well
+                image = image()
+            with trace.span("save", path=path):
+                image.save(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # Never leave a truncated file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _done(self, path, future, on_saved):
+        self._slots.release()
+        err = future.exception()
+        with self._lock:
+            if err is None:
+                self.written.append(path)
+            else:
+                self.failed.append((path, err))
+                print(f"[ERROR] Could not save {path}: {err}")
+        if err is None and on_saved is not None:
+            on_saved()
+
+    def submit(self, image, path, on_saved=None):
+        """
+        Queues image for saving to path (blocks while max_pending writes are in flight).
+        image: PIL image, or a callable returning one (run on the writer thread).
+        on_saved: optional callable run on the writer thread once the file is complete.
+        """
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._save, image, path)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._done(path, f, on_saved))
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def flush(self):
+        """Waits for every queued write. Returns the list of (path, error) that failed so far."""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            # Errors are collected by _done
+            future.exception()
+        with self._lock:
+            return list(self.failed)
+
+    def close(self):
+        failed = self.flush()
+        self._pool.shutdown(wait=True)
+        return failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+##### Section II : Prefetcher #####
+
+class Prefetcher:
+    """
+    Iterates over `items`, running load_fn(item) up to `depth` items ahead on a thread pool.
+
+    Yields (item, result, error) in the original order; error is the exception raised by
+    load_fn (result is then None). Only `depth` results are held at any time.
+    """
+    def __init__(self, items, load_fn, depth=2, workers=None):
+        self.items = items
+        self.load_fn = load_fn
+        self.depth = max(1, depth)
+        self.workers = workers or self.depth
+
+    def __iter__(self):
+        pending = deque()
+        source = iter(self.items)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch") as pool:
+            def fill():
+                while len(pending) < self.depth:
+                    try:
+                        item = next(source)
+                    except StopIteration:
+                        return
+                    pending.append((item, pool.submit(self.load_fn, item)))
+
+            fill()
+            try:
+                while pending:
+                    item, future = pending.popleft()
+                    try:
+                        result, err = future.result(), None
+                    except Exception as e:
+                        result, err = None, e
+                    # Start the next load before handing this one to the (slow) consumer
+                    fill()
+                    yield item, result, err
+            finally:
+                for _, future in pending:
+                    future.cancel()
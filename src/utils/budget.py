@@ -0,0 +1,189 @@
+# src/utils/budget.py
+
+from src.conf import conf
+from src.utils import devices
+
+# SR tiles shrink in steps of this many pixels (down to MEM_MIN_TILE_SIZE)
+TILE_STEP = 256
+# Planned setting each conf setting pins when the user has set it
+PINNED = {"T2I_BATCH_SIZE": "batch", "SR_TILE_SIZE": "tile_size",
+          "DEVICE_VAE_TILING": "vae_tiling", "DEVICE_OFFLOAD": "offload"}
+
+##### Section I : Planning #####
+
+def _area(width, height):
+    """Size relative to a 1024x1024 image, the unit of the cost model."""
+    return width * height / float(1024 * 1024)
+
+def estimate(setting, width=None, height=None, fp32=False):
+    """
+    Peak memory (MB) of `setting` for T2I at width x height (default: IMAGE_WIDTH x IMAGE_HEIGHT)
+    and SR with its tiles: what the offload strategy keeps resident plus the larger of denoising
+    one batch and VAE-decoding one image (decodes are sliced).
+    """
+    width = width or conf.IMAGE_WIDTH
+    height = height or conf.IMAGE_HEIGHT
+    resident = {
+        "none": conf.MEM_PIPELINE_MB,
+        "model": conf.MEM_MODEL_OFFLOAD_MB,
+        "sequential": conf.MEM_SEQUENTIAL_OFFLOAD_MB,
+    }[setting["offload"]]
+    working = 0
+    for area in (_area(width, height), _area(setting["tile_size"], setting["tile_size"])):
+        denoise = conf.SR_TILE_MEMORY_MB * area * setting["batch"]
+        decode = conf.MEM_VAE_TILED_MB if setting["vae_tiling"] else conf.MEM_VAE_DECODE_MB * area
+        working = max(working, denoise, decode)
+    return (resident + working) * (2 if fp32 else 1)
+
+def degrade(setting, offload=True, fixed=()):
+    """
+    The next setting down the ladder, None at the bottom: halve the batch, tile the VAE decode,
+    model offload, smaller SR tiles, sequential offload (slowest last).
+    offload=False skips the offload steps (cpu: weights live in RAM either way).
+    fixed: keys of `setting` that keep their value (their steps are skipped).
+    """
+    offload = offload and "offload" not in fixed
+    if setting["batch"] > 1 and "batch" not in fixed:
+        return dict(setting, batch=setting["batch"] // 2)
+    if not setting["vae_tiling"] and "vae_tiling" not in fixed:
+        return dict(setting, vae_tiling=True)
+    if offload and setting["offload"] == "none":
+        return dict(setting, offload="model")
+    if setting["tile_size"] - TILE_STEP >= conf.MEM_MIN_TILE_SIZE and "tile_size" not in fixed:
+        return dict(setting, tile_size=setting["tile_size"] - TILE_STEP)
+    if offload and setting["offload"] == "model":
+        return dict(setting, offload="sequential")
+    return None
+
+def plan(budget_gb=None, profile=None, fixed=None):
+    """
+    Least degraded setting that fits budget_gb (default: MEM_BUDGET_GB) on `profile` (default:
+    devices.resolve()), as a dict: batch, tile_size, vae_tiling, offload. Starts from a batch of
+    MEM_MAX_BATCH, SR_TILE_SIZE tiles, untiled VAE and everything resident.
+    fixed: {key: value} of the setting that is not planned (the user's own choices).
+    Returns (setting, estimated MB); the bottom of the ladder if nothing fits.
+    """
+    budget_mb = (budget_gb or conf.MEM_BUDGET_GB) * 1024
+    profile = profile or devices.resolve()
+    fp32 = str(profile["dtype"]).endswith("float32")
+    offload = profile["device"] != "cpu"
+
+    setting = {"batch": max(1, conf.MEM_MAX_BATCH), "tile_size": conf.SR_TILE_SIZE,
+               "vae_tiling": False, "offload": "none"}
+    setting.update(fixed or {})
+    while estimate(setting, fp32=fp32) > budget_mb:
+        lower = degrade(setting, offload=offload, fixed=fixed or ())
+        if lower is None:
+            break
+        setting = lower
+    return setting, estimate(setting, fp32=fp32)
+
+def overrides(setting):
+    """conf settings that put `setting` into effect (for RuntimeConfig.override)."""
+    return {
+        "T2I_BATCH_SIZE": setting["batch"],
+        "SR_TILE_BATCH_SIZE": setting["batch"],
+        "SR_TILE_SIZE": setting["tile_size"],
+        "DEVICE_VAE_TILING": setting["vae_tiling"],
+        "DEVICE_OFFLOAD": setting["offload"],
+    }
+
+def fit(config, explicit=()):
+    """
+    `config` (RuntimeConfig) with the batch, SR tile, VAE tiling and offload settings planned for
+    its MEM_BUDGET_GB. Applied before any job is planned: the SR tile size is part of the job keys.
+    explicit: names of the settings the user has set (--set, --config, ...): they keep their
+    value and the rest is planned around them.
+    """
+    fixed = {}
+    for name, key in PINNED.items():
+        value = getattr(config, name)
+        if name in explicit and value is not None:
+            fixed[key] = ("none" if value is False else value) if key == "offload" else value
+    with config.apply():
+        setting, peak = plan(fixed=fixed)
+    print(f"[MEM] Budget {config.MEM_BUDGET_GB:g} GB: {describe(setting)} (~{peak / 1024:.1f} GB estimated)")
+    if peak > config.MEM_BUDGET_GB * 1024:
+        print("[WARN] The lowest memory setting does not fit the budget by the estimate, using it anyway")
+    kept = sorted(name for name in overrides(setting) if name in explicit)
+    if kept:
+        print(f"[MEM] Keeping {', '.join(kept)} as set")
+    return config.override({name: value for name, value in overrides(setting).items() if name not in explicit})
+
+def describe(setting):
+    offload = "resident" if setting["offload"] == "none" else f"{setting['offload']} CPU offload"
+    vae = "VAE tiling" if setting["vae_tiling"] else "untiled VAE"
+    return f"batch of {setting['batch']}, {setting['tile_size']}px SR tiles, {vae}, {offload}"
+
+##### Section II : Out-of-Memory Fallback #####
+
+def free_device_cache():
+    """Returns the blocks cached by the allocator after an out-of-memory error."""
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def _state(registry):
+    """Offload / VAE tiling of the registry's pipeline (from the active profile, then the fallback steps)."""
+    if registry.memory is None:
+        profile = devices.active() or {}
+        registry.memory = {
+            "device": profile.get("device", "cpu"),
+            "offload": profile.get("offload") or "none",
+            "vae_tiling": bool(profile.get("vae_tiling")),
+        }
+    return registry.memory
+
+def current(registry, task, batch=None):
+    """The memory settings `task` ("t2i" or "sr") runs with now, as a log string."""
+    state = _state(registry)
+    if task == "sr":
+        tiles = conf.SR_TILE_BATCH_SIZE or "auto"
+        parts = [f"SR tile batch of {tiles}", f"{conf.SR_TILE_SIZE}px SR tiles"]
+    else:
+        parts = [f"batch of {batch or conf.T2I_BATCH_SIZE}"]
+    parts.append("VAE tiling" if state["vae_tiling"] else "untiled VAE")
+    parts.append("resident" if state["offload"] == "none" else f"{state['offload']} CPU offload")
+    return ", ".join(parts)
+
+def fallback(registry, task):
+    """
+    Takes one step down the out-of-memory ladder for `task` ("t2i" or "sr"): smaller SR tile
+    batch, VAE tiling, model offload, sequential offload. T2I batches are halved by
+    t2i.iter_batches; SR tiles keep their size, since it is part of the output. The SR tile batch
+    is restored by sr.process_single_image_sr once the image is done; VAE tiling and offload stay
+    on the pipeline for later jobs. Returns a description of the step, None at the bottom of the ladder.
+    """
+    state = _state(registry)
+    if task == "sr" and conf.SR_TILE_BATCH_SIZE != 1:
+        # 0 = sized from the free memory, which just failed
+        conf.SR_TILE_BATCH_SIZE = conf.SR_TILE_BATCH_SIZE // 2 or 1
+        return f"SR tile batch of {conf.SR_TILE_BATCH_SIZE}"
+    if not state["vae_tiling"]:
+        registry.base.vae.enable_slicing()
+        registry.base.vae.enable_tiling()
+        state["vae_tiling"] = True
+        return "VAE tiling"
+    if state["device"] != "cpu" and state["offload"] != "sequential":
+        mode = "model" if state["offload"] == "none" else "sequential"
+        # Variants share the components, so the hooks apply to them as well
+        devices.enable_offload(registry.base, mode, state["device"])
+        state["offload"] = mode
+        return f"{mode} CPU offload"
+    return None
+
+def recover(registry, task, what):
+    """
+    Handles an out-of-memory error of job `what` (for the log): frees the cached device memory
+    and, with MEM_OOM_FALLBACK, takes one fallback step. True if the job should be retried.
+    """
+    free_device_cache()
+    step = fallback(registry, task) if conf.MEM_OOM_FALLBACK else None
+    if step is None:
+        return False
+    print(f"[MEM] Out of memory on {what}, retrying with {step}")
+    return True
+
+def report(registry, task, what, batch=None):
+    """Logs the settings a job succeeded with after recover()."""
+    print(f"[MEM] {what} succeeded with {current(registry, task, batch)}")
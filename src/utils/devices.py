@@ -0,0 +1,184 @@
+# src/utils/devices.py
+
+import os
+from contextlib import nullcontext
+
+from src.conf import conf
+
+PROFILES = ("gpu_lowvram", "gpu_highvram", "cpu")
+# DEVICE_OFFLOAD values, least to most memory saving ("none": everything resident)
+OFFLOAD_MODES = ("none", "model", "sequential")
+
+# Profile applied by the last load_initial_pipeline of this process
+_active = None
+# (DEVICE_PROFILE, GPU_HIGHVRAM_MIN_GB, CPU_AUTOCAST_BF16) -> precision() of the resolved profile
+_precisions = {}
+
+##### Section I : Profiles #####
+
+def cpu_supports_bf16():
+    """True if this CPU runs bfloat16 natively (AVX512-BF16 / AMX); emulated bf16 is slower than fp32."""
+    import torch
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def detect(device=None):
+    """Profile name for `device` (default: cuda if available): by device type and total VRAM."""
+    import torch
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    if not device.startswith("cuda"):
+        return "cpu"
+    index = int(device.split(":")[1]) if ":" in device else torch.cuda.current_device()
+    total = torch.cuda.get_device_properties(index).total_memory
+    return "gpu_highvram" if total >= conf.GPU_HIGHVRAM_MIN_GB * 2**30 else "gpu_lowvram"
+
+def _cpu_threads():
+    if conf.CPU_THREADS:
+        return conf.CPU_THREADS
+    # Worker processes are pinned to their core slice before they load
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def resolve(name=None, device=None):
+    """
+    Execution settings of profile `name` (default: conf.DEVICE_PROFILE, "auto" = detect()) as a dict:
+    name, device, dtype, offload (False, "model" or "sequential"), vae_slicing, vae_tiling,
+    channels_last, compile, autocast (dtype or None), threads / interop_threads (None = torch default).
+    DEVICE_OFFLOAD / DEVICE_VAE_TILING override the offload and VAE tiling of the profile.
+    device: "cuda", "cuda:<index>" or "cpu" (default: cuda if available, cpu for the cpu profile).
+    """
+    if conf.DEVICE_OFFLOAD is not None and conf.DEVICE_OFFLOAD not in OFFLOAD_MODES:
+        raise ValueError(f"Unknown offload mode: {conf.DEVICE_OFFLOAD} (expected one of {', '.join(OFFLOAD_MODES)})")
+    profile = _profile(name, device)
+    if conf.DEVICE_OFFLOAD is not None and profile["device"] != "cpu":
+        profile["offload"] = False if conf.DEVICE_OFFLOAD == "none" else conf.DEVICE_OFFLOAD
+    if conf.DEVICE_VAE_TILING is not None:
+        profile["vae_tiling"] = conf.DEVICE_VAE_TILING
+        # Tiles are decoded one image at a time
+        profile["vae_slicing"] = profile["vae_slicing"] or conf.DEVICE_VAE_TILING
+    return profile
+
+def _profile(name, device):
+    import torch
+
+    name = name or conf.DEVICE_PROFILE
+    if name == "auto":
+        name = detect(device)
+    if name not in PROFILES:
+        raise ValueError(f"Unknown device profile: {name} (expected auto or one of {', '.join(PROFILES)})")
+    if name != "cpu" and not torch.cuda.is_available():
+        print(f"[WARN] Device profile {name} needs CUDA, using cpu")
+        name = "cpu"
+    if name == "cpu":
+        device = "cpu"
+    else:
+        device = device if device and device.startswith("cuda") else "cuda"
+
+    if name == "gpu_lowvram":
+        # Tuned for 8GB cards (RTX 4060): components move to the GPU only while they run
+        return {"name": name, "device": device, "dtype": torch.float16, "offload": "model",
+                "vae_slicing": True, "vae_tiling": True, "channels_last": False, "compile": False,
+                "autocast": None, "threads": None, "interop_threads": None}
+    if name == "gpu_highvram":
+        # Everything stays resident: no offload hooks moving weights every call
+        return {"name": name, "device": device, "dtype": torch.float16, "offload": False,
+                "vae_slicing": False, "vae_tiling": False, "channels_last": True, "compile": False,
+                "autocast": None, "threads": None, "interop_threads": None}
+    # CPU throughput: float32 weights, bfloat16 compute where the CPU has it, no offload hooks
+    autocast = torch.bfloat16 if conf.CPU_AUTOCAST_BF16 and cpu_supports_bf16() else None
+    return {"name": name, "device": device, "dtype": torch.float32, "offload": False,
+            "vae_slicing": True, "vae_tiling": False, "channels_last": conf.CPU_CHANNELS_LAST,
+            "compile": conf.CPU_COMPILE_UNET, "autocast": autocast,
+            "threads": _cpu_threads(), "interop_threads": conf.CPU_INTEROP_THREADS or None}
+
+def describe(profile):
+    parts = [profile["name"], profile["device"], str(profile["dtype"]).replace("torch.", "")]
+    if profile["autocast"] is not None:
+        parts.append(f"{str(profile['autocast']).replace('torch.', '')} autocast")
+    if profile["offload"] == "sequential":
+        parts.append("sequential cpu offload")
+    elif profile["offload"]:
+        parts.append("cpu offload")
+    if profile["channels_last"]:
+        parts.append("channels_last")
+    if profile["compile"]:
+        parts.append("compiled unet")
+    if profile["threads"]:
+        parts.append(f"{profile['threads']} threads")
+    return ", ".join(parts)
+
+##### Section II : Application #####
+
+def apply(pipe, profile):
+    """Moves / configures a freshly loaded pipeline for `profile` and makes it the active profile."""
+    global _active
+    import torch
+
+    if profile["threads"]:
+        torch.set_num_threads(profile["threads"])
+    if profile["interop_threads"]:
+        try:
+            torch.set_num_interop_threads(profile["interop_threads"])
+        except RuntimeError:
+            # Only settable before the first inter-op parallel work of the process
+            pass
+
+    if profile["offload"]:
+        enable_offload(pipe, profile["offload"], profile["device"])
+    else:
+        pipe.to(profile["device"])
+    if profile["vae_slicing"]:
+        pipe.vae.enable_slicing()
+    if profile["vae_tiling"]:
+        pipe.vae.enable_tiling()
+    if profile["channels_last"]:
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    if profile["compile"]:
+        # Compiled on the first call; variants built later from this pipe share the compiled UNet
+        pipe.unet = torch.compile(pipe.unet)
+
+    _active = profile
+    return pipe
+
+def enable_offload(pipe, mode, device):
+    """Attaches the offload hooks of `mode` ("model" or "sequential") for `device` to pipe."""
+    enable = pipe.enable_sequential_cpu_offload if mode == "sequential" else pipe.enable_model_cpu_offload
+    if device.startswith("cuda:"):
+        enable(gpu_id=int(device.split(":")[1]))
+    else:
+        enable()
+
+def active():
+    return _active
+
+def precision(cached_only=False):
+    """
+    {"dtype", "autocast"} (names, autocast None if off) the pipelines run at: the active profile,
+    else the profile conf resolves to (imports torch). None with cached_only if neither is known
+    without torch.
+    """
+    if _active is not None:
+        profile = _active
+    else:
+        setting = (conf.DEVICE_PROFILE, conf.GPU_HIGHVRAM_MIN_GB, conf.CPU_AUTOCAST_BF16)
+        if setting in _precisions or cached_only:
+            return _precisions.get(setting)
+        profile = resolve()
+    result = {
+        "dtype": str(profile["dtype"]).replace("torch.", ""),
+        "autocast": str(profile["autocast"]).replace("torch.", "") if profile["autocast"] is not None else None,
+    }
+    if _active is None:
+        _precisions[setting] = result
+    return result
+
+def autocast():
+    """Autocast context of the active profile for pipeline calls (no-op without one)."""
+    if _active is None or _active["autocast"] is None:
+        return nullcontext()
+    import torch
+    return torch.autocast(_active["device"].split(":")[0], dtype=_active["autocast"])
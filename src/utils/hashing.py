@@ -0,0 +1,84 @@
+# src/utils/hashing.py
+
+import os
+import json
+import hashlib
+import threading
+
+##### Section I : Content Hashing #####
+
+# Digests of large files, keyed by (abspath, size, mtime) so each file is read once per process
+_file_digests = {}
+_lock = threading.Lock()
+
+def text_digest(*parts):
+    """sha256 hex digest of the given strings (None allowed), separated unambiguously."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(repr(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def file_digest(path, index_path=None, chunk_size=8 * 1024 * 1024, cached_only=False):
+    """
+    sha256 hex digest of a file's content.
+
+    Multi-GB checkpoints are expensive to hash, so results are memoized per (path, size, mtime)
+    in-process and, if index_path is given, in a small JSON index on disk shared across runs.
+    cached_only: return None instead of reading a file that has not been hashed yet.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    key = (path, st.st_size, st.st_mtime_ns)
+
+    with _lock:
+        if key in _file_digests:
+            return _file_digests[key]
+
+    index = {}
+    if index_path and os.path.isfile(index_path):
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        entry = index.get(path)
+        if entry and entry.get("stamp") == stamp:
+            with _lock:
+                _file_digests[key] = entry["sha256"]
+            return entry["sha256"]
+
+    if cached_only:
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _lock:
+        _file_digests[key] = digest
+
+    if index_path:
+        index[path] = {"stamp": stamp, "sha256": digest}
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            tmp_path = index_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f, indent=1)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            pass
+
+    return digest
+
+def model_digest(model_path, index_path=None, cached_only=False):
+    """
+    Identity of a model checkpoint: its content digest, or "path:<abspath>" when the file
+    does not exist (e.g. a mocked pipeline). Callers must not persist path-based identities.
+    cached_only: None if the checkpoint has not been hashed yet (see file_digest).
+    """
+    if os.path.isfile(model_path):
+        return file_digest(model_path, index_path=index_path, cached_only=cached_only)
+    return "path:" + os.path.abspath(model_path)
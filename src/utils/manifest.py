@@ -0,0 +1,160 @@
+# src/utils/manifest.py
+
+import os
+import json
+import time
+import threading
+
+from src.conf import conf
+from src.utils import devices
+from src.utils.hashing import model_digest, text_digest
+
+# conf settings that never change the pixels of an output (paths, caches, I/O, server, batching).
+# Everything else is part of a job key, so a new setting invalidates old results by default.
+# The device settings are replaced by the dtype / autocast they resolve to (see output_params).
+RUNTIME_ONLY_PARAMS = {
+    "ROOT_DIR", "NUM_IMAGES_TO_GENERATE", "T2I_BATCH_SIZE", "T2I_ADAPTIVE_BATCH", "T2I_SAVE_BASE",
+    "SR_TILE_BATCH_SIZE", "SR_TILE_MEMORY_MB", "SR_CANVAS_MODE", "SR_CANVAS_BAND_ROWS",
+    "SR_MASK_CACHE_SIZE", "SR_PREFETCH_DEPTH", "PROMPT_CACHE_SIZE", "PROMPT_CACHE_PERSIST",
+    "MANIFEST_ENABLED", "T2I_SEED", "BASE_FILENAME_PREFIX",
+}
+RUNTIME_ONLY_PREFIXES = ("OUTPUT_DIR", "SERVE_", "IO_", "WORKER_", "PROFILE_", "MODEL_CACHE_", "TRIAGE_", "DEVICE_", "GPU_", "CPU_", "SWEEP_", "FUSED_", "WATCH_", "MEM_")
+RUNTIME_ONLY_SUFFIXES = ("_DIR", "_PATH", "_FILENAME")
+# Settings read by one task only (by name prefix): they are not part of the other task's keys.
+# Output settings outside every task (text encoding, negative size conditioning, new settings)
+# are part of every key.
+TASK_PREFIXES = {
+    "t2i": ("BASE_", "REFINE_", "T2I_", "IMAGE_", "TARGET_SIZE", "ORIGINAL_SIZE"),
+    "sr": ("SR_",),
+}
+
+##### Section I : Job Keys #####
+
+def output_params(tasks=None, precision=None):
+    """
+    Every conf setting that can influence an output of `tasks` ("t2i", "sr" or both for
+    T2I -> SR; default: all tasks), as a JSON-able dict, plus the resolved DTYPE / AUTOCAST.
+    precision: devices.precision() result (default: resolved now).
+    """
+    tasks = (tasks,) if isinstance(tasks, str) else tuple(tasks or TASK_PREFIXES)
+    others = tuple(prefix for task, prefixes in TASK_PREFIXES.items() if task not in tasks for prefix in prefixes)
+    params = {}
+    for name in sorted(dir(conf)):
+        if not name.isupper() or name in RUNTIME_ONLY_PARAMS:
+            continue
+        if name.startswith(RUNTIME_ONLY_PREFIXES) or name.endswith(RUNTIME_ONLY_SUFFIXES):
+            continue
+        if others and name.startswith(others):
+            continue
+        value = getattr(conf, name)
+        if isinstance(value, tuple):
+            value = list(value)
+        if value is None or isinstance(value, (bool, int, float, str, list)):
+            params[name] = value
+    # fp16 GPU and fp32 / bf16 CPU outputs differ; thread counts and offload do not matter
+    precision = precision or devices.precision()
+    params["DTYPE"], params["AUTOCAST"] = precision["dtype"], precision["autocast"]
+    return params
+
+def model_hash(cached_only=False):
+    """Digest of conf.MODEL_PATH (None with cached_only if it has not been hashed yet)."""
+    return model_digest(conf.MODEL_PATH, os.path.join(conf.CACHE_DIR, "digests.json"), cached_only=cached_only)
+
+def job_key(model, prompt_hash, params, seed=None, input_hash=None):
+    """Content key of one job: identical key == identical output."""
+    return text_digest(model, prompt_hash, json.dumps(params, sort_keys=True), seed, input_hash)
+
+##### Section II : Manifest #####
+
+class RunManifest:
+    """
+    Append-only JSONL log of jobs (OUTPUT_DIR/manifest.jsonl); the last record of a key wins.
+
+    Each record: key, task, status (pending/done/failed), seed, batch, index, model_hash,
+    prompt_hash, params, input, input_hash, output, time. A torn last line (crash while
+    writing) is ignored on load.
+    """
+    FILENAME = "manifest.jsonl"
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, self.FILENAME)
+        self._records = {}
+        self._lock = threading.Lock()
+        self._writable = True
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._records[record["key"]] = record
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+    def get(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            return dict(record) if record else None
+
+    def records(self):
+        with self._lock:
+            return [dict(r) for r in self._records.values()]
+
+    def is_done(self, key):
+        """Completed and its output still exists."""
+        record = self.get(key)
+        return bool(record and record["status"] == "done" and record.get("output")
+                    and os.path.exists(record["output"]))
+
+    def mark(self, record_key, status, **fields):
+        """Updates a job and appends the new record (thread-safe; called from writer threads)."""
+        with self._lock:
+            record = dict(self._records.get(record_key, {}))
+            record.update(fields)
+            record["key"] = record_key
+            record["status"] = status
+            record["time"] = time.time()
+            self._records[record_key] = record
+            if not self._writable:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                # Keep generating; only resuming is lost
+                self._writable = False
+                print(f"[WARN] Manifest {self.path} is not writable ({e}), resume disabled")
+
+    def split_done(self, jobs):
+        """
+        Splits planned jobs into (done, todo): the stored records of completed jobs, and the
+        remaining jobs, which are marked pending.
+        """
+        done, todo = [], []
+        for job in jobs:
+            if self.is_done(job["key"]):
+                done.append(self.get(job["key"]))
+            else:
+                self.mark(job["key"], "pending", **job)
+                todo.append(job)
+        return done, todo
+
+    def latest_open_batch(self, signature):
+        """Jobs (sorted by index) of the newest batch with this signature that is not complete."""
+        batches = {}
+        for record in self.records():
+            if record.get("signature") == signature and record.get("batch"):
+                batches.setdefault(record["batch"], []).append(record)
+        open_batches = [
+            jobs for jobs in batches.values()
+            if any(not self.is_done(job["key"]) for job in jobs)
+        ]
+        if not open_batches:
+            return None
+        newest = max(open_batches, key=lambda jobs: jobs[0].get("created", 0))
+        return sorted(newest, key=lambda job: job["index"])
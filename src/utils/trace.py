@@ -0,0 +1,253 @@
+# src/utils/trace.py
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+_tracer = None
+
+##### Section I : Resource Probes #####
+
+def current_rss():
+    """Resident set size of this process in bytes, or None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss():
+    """Highest resident set size of this process so far in bytes, or None."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _device_peak():
+    import torch
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated()
+    return None
+
+def _reset_device_peak():
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+##### Section II : Tracer #####
+
+class Tracer:
+    """
+    Records spans (named, timed regions) and per-step events.
+
+    Every finished span becomes one event: name, ts / dur (seconds), pid, tid, args and the
+    resource fields rss, peak_rss, py_peak (tracemalloc) and device_peak (torch CUDA).
+    Peaks are per span: nested spans fold their peak into the enclosing one (the counters are
+    process-wide, so spans running concurrently on other threads share them).
+    fmt "jsonl" appends one JSON event per line as it finishes; "chrome" writes a Chrome trace
+    (chrome://tracing, Perfetto) on close().
+    """
+    def __init__(self, path=None, fmt="jsonl", steps=True, trace_malloc=True):
+        if fmt not in ("jsonl", "chrome"):
+            raise ValueError(f"Unknown trace format: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.steps = steps
+        self.trace_malloc = trace_malloc
+        self.events = []
+
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if fmt == "jsonl":
+                self._file = open(path, "w", encoding="utf-8", buffering=1)
+        if trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _emit(self, event):
+        with self._lock:
+            self.events.append(event)
+            if self._file is not None:
+                self._file.write(json.dumps(event) + "\n")
+
+    @contextmanager
+    def span(self, name, **args):
+        stack = self._stack()
+        # Fold the peaks reached so far into the enclosing span before resetting them
+        if stack:
+            parent = stack[-1]
+            parent["py_peak"] = max(parent["py_peak"], self._py_peak())
+            parent["device_peak"] = max(parent["device_peak"], _device_peak() or 0)
+        if self.trace_malloc:
+            tracemalloc.reset_peak()
+        _reset_device_peak()
+
+        frame = {"py_peak": 0, "device_peak": 0}
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            frame["py_peak"] = max(frame["py_peak"], self._py_peak())
+            frame["device_peak"] = max(frame["device_peak"], _device_peak() or 0)
+            if stack:
+                stack[-1]["py_peak"] = max(stack[-1]["py_peak"], frame["py_peak"])
+                stack[-1]["device_peak"] = max(stack[-1]["device_peak"], frame["device_peak"])
+
+            self._emit({
+                "name": name,
+                "ts": start - self._origin,
+                "dur": end - start,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "depth": len(stack),
+                "args": args,
+                "rss": current_rss(),
+                "peak_rss": peak_rss(),
+                "py_peak": frame["py_peak"] if self.trace_malloc else None,
+                "device_peak": frame["device_peak"] or None,
+            })
+
+    def _py_peak(self):
+        return tracemalloc.get_traced_memory()[1] if self.trace_malloc and tracemalloc.is_tracing() else 0
+
+    def step_callback(self, name):
+        """
+        diffusers callback_on_step_end that records one "<name>.step" event per denoising step.
+        The first call records "<name>.setup" instead (prompt encoding, latent preparation and
+        scheduler setup plus the first step): the callback only sees the end of each step.
+        Returns None when per-step tracing is off.
+        """
+        if not self.steps:
+            return None
+        # [end of the previous step, steps seen]
+        last = [time.perf_counter(), 0]
+
+        def callback(pipe, step, timestep, callback_kwargs):
+            now = time.perf_counter()
+            self._emit({
+                "name": f"{name}.step" if last[1] else f"{name}.setup",
+                "ts": last[0] - self._origin,
+                "dur": now - last[0],
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "depth": len(self._stack()),
+                "args": {"step": step},
+            })
+            last[0] = now
+            last[1] += 1
+            return callback_kwargs
+
+        return callback
+
+    def summary(self):
+        """Per event name: count, total / mean / max seconds and the highest memory peaks."""
+        rows = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            row = rows.setdefault(event["name"], {
+                "count": 0, "total": 0.0, "max": 0.0, "peak_rss": None, "py_peak": None, "device_peak": None,
+            })
+            row["count"] += 1
+            row["total"] += event["dur"]
+            row["max"] = max(row["max"], event["dur"])
+            for field in ("peak_rss", "py_peak", "device_peak"):
+                if event.get(field) is not None:
+                    row[field] = max(row[field] or 0, event[field])
+        for row in rows.values():
+            row["mean"] = row["total"] / row["count"]
+        return rows
+
+    def print_summary(self):
+        rows = self.summary()
+        if not rows:
+            return
+        mb = lambda value: f"{value / 2**20:10.1f}" if value is not None else f"{'-':>10}"
+        print("========================================")
+        print(f"{'Stage':<24}{'Count':>7}{'Total s':>10}{'Mean ms':>10}{'Max ms':>10}"
+              f"{'RSS MB':>10}{'Py MB':>10}{'Dev MB':>10}")
+        # Slowest stages first
+        for name, row in sorted(rows.items(), key=lambda item: -item[1]["total"]):
+            print(f"{name:<24}{row['count']:>7}{row['total']:>10.2f}{row['mean'] * 1000:>10.1f}"
+                  f"{row['max'] * 1000:>10.1f}{mb(row['peak_rss'])}{mb(row['py_peak'])}{mb(row['device_peak'])}")
+        print("========================================")
+
+    def close(self):
+        """Writes the Chrome trace / closes the JSONL file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path and self.fmt == "chrome":
+            trace_events = [{
+                "name": e["name"], "ph": "X", "ts": e["ts"] * 1e6, "dur": e["dur"] * 1e6,
+                "pid": e["pid"], "tid": e["tid"],
+                "args": dict(e["args"], **{k: e[k] for k in ("rss", "peak_rss", "py_peak", "device_peak")
+                                           if e.get(k) is not None}),
+            } for e in self.events]
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+        if self.trace_malloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+##### Section III : Module Level Access #####
+
+def enable(path=None, fmt="jsonl", steps=True, trace_malloc=True):
+    """Starts tracing for this process and returns the Tracer."""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(path, fmt, steps, trace_malloc)
+    return _tracer
+
+def start(task, fmt=None, suffix=""):
+    """Enables tracing with the PROFILE_* settings, writing PROFILE_DIR/<task>_<time><suffix>.<ext>."""
+    from src.conf import conf
+
+    fmt = fmt or conf.PROFILE_FORMAT
+    ext = "json" if fmt == "chrome" else "jsonl"
+    name = f"{task}_{time.strftime('%Y%m%d_%H%M%S')}{suffix}.{ext}"
+    return enable(os.path.join(conf.PROFILE_DIR, name), fmt, conf.PROFILE_STEPS, conf.PROFILE_TRACEMALLOC)
+
+def disable():
+    """Stops tracing and returns the Tracer that was active (closed), or None."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+    return tracer
+
+def enabled():
+    return _tracer is not None
+
+@contextmanager
+def span(name, **args):
+    """Traces the enclosed block as `name` (no-op while tracing is off)."""
+    if _tracer is None:
+        yield args
+        return
+    with _tracer.span(name, **args) as span_args:
+        yield span_args
+
+def step_callback(name):
+    """callback_on_step_end for a pipeline call traced as `name`, or None while tracing is off."""
+    return _tracer.step_callback(name) if _tracer is not None else None
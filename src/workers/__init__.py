@@ -0,0 +1 @@
+# src/workers/__init__.py
\ No newline at end of file
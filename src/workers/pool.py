@@ -0,0 +1,250 @@
+# src/workers/pool.py
+
+import os
+import queue
+import threading
+import time
+import multiprocessing as mp
+import torch
+
+from src.conf import conf
+from src.utils.background import BackgroundWriter
+
+##### Section I : Worker Placement #####
+
+def usable_cores():
+    """CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def plan_workers(count, cores=None, gpus=None):
+    """
+    Places `count` workers: round-robin over the CUDA devices if there are any, else "cpu".
+    Every worker also gets an equal, disjoint slice of the CPU cores (shared if there are
+    more workers than cores). Returns a list of {"id", "device", "cores"}.
+    """
+    cores = cores if cores is not None else usable_cores()
+    if gpus is None:
+        gpus = torch.cuda.device_count() if torch.cuda.is_available() else 0
+
+    specs = []
+    for i in range(count):
+        share = cores[i * len(cores) // count:(i + 1) * len(cores) // count] or [cores[i % len(cores)]]
+        specs.append({
+            "id": i,
+            "device": f"cuda:{i % gpus}" if gpus else "cpu",
+            "cores": share,
+        })
+    return specs
+
+def pin_worker(spec):
+    """Restricts the current process to its device and core slice."""
+    if hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, spec["cores"])
+        except OSError as e:
+            print(f"[WARN] Worker {spec['id']}: could not set CPU affinity: {e}")
+    torch.set_num_threads(len(spec["cores"]))
+    if spec["device"].startswith("cuda:"):
+        torch.cuda.set_device(int(spec["device"].split(":")[1]))
+
+##### Section II : Worker Process #####
+
+class QueueWriter:
+    """
+    Stands in for a BackgroundWriter inside a worker: finished images are sent to the collector,
+    which writes them and records them as done (on_saved callbacks stay with the collector).
+    """
+    def __init__(self, worker_id, results):
+        self.worker_id = worker_id
+        self.results = results
+
+    def submit(self, image, path, on_saved=None):
+        # Deferred images (e.g. the SR canvas merge) are finished here: only the uint8 result
+        # crosses the process boundary, not the float canvas and weight map
+        if callable(image):
+            image = image()
+        self.results.put(("image", self.worker_id, path, image))
+
+def _iter_chunks(jobs):
+    """Yields job chunks from the shared queue until this worker's stop marker."""
+    while True:
+        chunk = jobs.get()
+        if chunk is None:
+            return
+        yield chunk
+
+def _run_t2i(registry, spec, options, jobs, writer):
+    from src.t2i import t2i
+
+    for chunk in _iter_chunks(jobs):
+        # Adaptive batching (OOM halving) stays per worker
+        t2i.generate_batches(registry, chunk, options["total"], options["batch_size"], writer, [])
+
+def _run_sr(registry, spec, options, jobs, writer):
+    from src.sr import sr
+    from src.utils.background import Prefetcher
+
+    def job_stream():
+        for chunk in _iter_chunks(jobs):
+            yield from chunk
+
+    # Decode + pre-upscale the next input of this worker while the current one is refined
+    prefetcher = Prefetcher(job_stream(), lambda job: sr.load_sr_input(job["input"]), depth=conf.SR_PREFETCH_DEPTH)
+    for job, upscaled_img, err in prefetcher:
+        if err is not None:
+            print(f"\n[ERROR] Worker {spec['id']}: could not open image {job['input']}: {err}")
+            continue
+        # Streamed canvases are written by the worker itself and only reported
+        on_saved = lambda path=job["output"]: writer.results.put(("saved", spec["id"], path, None))
+        sr.process_single_image_sr(registry, job["input"], conf.OUTPUT_DIR_SR, upscaled_img=upscaled_img,
+                                   image_writer=writer, save_name=job["save_name"], on_saved=on_saved)
+
+TASK_RUNNERS = {"t2i": _run_t2i, "sr": _run_sr}
+
+def worker_main(spec, task, options, settings, jobs, results, loader):
+    """
+    Process entry: applies the parent's conf, pins itself, loads its pipeline once and runs
+    job chunks from `jobs` until its stop marker. Messages to the collector on `results`:
+    ("ready" | "image" | "saved" | "error" | "exit", worker id, path, payload).
+    """
+    for name, value in settings.items():
+        setattr(conf, name, value)
+
+    from src.t2i import t2i
+    from src.utils import trace
+
+    if conf.PROFILE_ENABLED:
+        trace.start(task, suffix=f"_w{spec['id']}")
+    pin_worker(spec)
+    try:
+        registry = t2i.as_registry(loader(conf.MODEL_PATH, device=spec["device"]))
+    except BaseException as e:
+        # load_initial_pipeline exits on failure; report it instead of dying silently
+        results.put(("error", spec["id"], None, f"{type(e).__name__}: {e}"))
+        return
+
+    results.put(("ready", spec["id"], None, None))
+    try:
+        TASK_RUNNERS[task](registry, spec, options, jobs, QueueWriter(spec["id"], results))
+    except BaseException as e:
+        results.put(("error", spec["id"], None, f"{type(e).__name__}: {e}"))
+        return
+    finally:
+        # Each worker writes its own trace file
+        trace.disable()
+    results.put(("exit", spec["id"], None, None))
+
+##### Section III : Collector #####
+
+def _conf_settings():
+    """Upper-case conf values, so workers see what the parent runs with (incl. CLI overrides)."""
+    return {name: getattr(conf, name) for name in dir(conf) if name.isupper()}
+
+def _default_loader(model_path, device=None):
+    from src.t2i import t2i
+    return t2i.load_initial_pipeline(model_path, device=device)
+
+def run_sharded(task, jobs, workers, batch_size=1, total=None, manifest=None, loader=None):
+    """
+    Runs planned t2i / sr jobs (from t2i.plan_jobs / sr.plan_jobs) on `workers` processes.
+
+    Jobs are handed out in chunks of batch_size (t2i) or one by one (sr) through a shared
+    queue, so faster workers take more of them. This process is the single collector: it
+    writes the returned images, records them in the manifest and prints the summary.
+    loader(model_path, device=...): pipeline factory run in every worker.
+    Returns the list of saved file paths.
+    """
+    workers = max(1, min(workers, len(jobs)))
+    specs = plan_workers(workers)
+    chunk = max(1, batch_size) if task == "t2i" else 1
+    options = {"total": total or len(jobs), "batch_size": max(1, batch_size)}
+    keys = {job["output"]: job["key"] for job in jobs}
+
+    ctx = mp.get_context(conf.WORKER_START_METHOD)
+    job_queue = ctx.Queue()
+    results = ctx.Queue()
+    for i in range(0, len(jobs), chunk):
+        job_queue.put(jobs[i:i + chunk])
+    for _ in specs:
+        job_queue.put(None)
+
+    print("========================================")
+    print(f"{task.upper()} Task: {len(jobs)} images on {workers} workers")
+    for spec in specs:
+        print(f"   |-- Worker {spec['id']}: {spec['device']}, {len(spec['cores'])} cores")
+    print("========================================")
+
+    processes = [
+        ctx.Process(target=worker_main, name=f"{task}-worker-{spec['id']}",
+                    args=(spec, task, options, _conf_settings(), job_queue, results, loader or _default_loader))
+        for spec in specs
+    ]
+    for process in processes:
+        process.start()
+
+    saved = []
+    per_worker = {spec["id"]: 0 for spec in specs}
+    running = set(per_worker)
+
+    lock = threading.Lock()
+
+    def on_saved(path, worker_id):
+        # Runs on the writer threads; extra files (e.g. T2I_SAVE_BASE) are not jobs
+        if path not in keys:
+            return
+        with lock:
+            saved.append(path)
+            per_worker[worker_id] += 1
+        if manifest:
+            manifest.mark(keys[path], "done")
+
+    start = time.perf_counter()
+    image_writer = BackgroundWriter(conf.IO_WRITER_THREADS, conf.IO_MAX_PENDING_WRITES)
+    try:
+        while running:
+            try:
+                kind, worker_id, path, payload = results.get(timeout=1.0)
+            except queue.Empty:
+                # A worker killed without a word (e.g. by the OOM killer) must not hang the run
+                for spec, process in zip(specs, processes):
+                    if spec["id"] in running and not process.is_alive():
+                        print(f"[ERROR] Worker {spec['id']} died (exit code {process.exitcode})")
+                        running.discard(spec["id"])
+                continue
+
+            if kind == "image":
+                image_writer.submit(payload, path, on_saved=lambda p=path, w=worker_id: on_saved(p, w))
+            elif kind == "saved":
+                on_saved(path, worker_id)
+            elif kind == "ready":
+                print(f"[INFO] Worker {worker_id} ready")
+            elif kind == "error":
+                print(f"[ERROR] Worker {worker_id} failed: {payload}")
+                running.discard(worker_id)
+            elif kind == "exit":
+                running.discard(worker_id)
+    finally:
+        image_writer.close()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        job_queue.cancel_join_thread()
+
+    elapsed = time.perf_counter() - start
+    written = set(saved)
+    missing = [job for job in jobs if job["output"] not in written]
+    if manifest:
+        for job in missing:
+            manifest.mark(job["key"], "failed")
+
+    print("========================================")
+    for worker_id, count in per_worker.items():
+        print(f"[INFO] Worker {worker_id}: {count} images")
+    if missing:
+        print(f"[WARN] {len(missing)} of {len(jobs)} images failed")
+    print(f"[INFO] {elapsed:.1f}s for {len(saved)} images on {workers} workers")
+    print(f"{task.upper()} tasks completed!")
+    return [job["output"] for job in jobs if job["output"] in written]
@@ -31,8 +31,15 @@ class DummyPipeBase:
         self.scheduler = MagicMock()
         self.scheduler.config = {}
         self.vae = MagicMock()
+        self.unet = MagicMock()
     
+    def encode_prompt(self, prompt=None, negative_prompt=None, **kwargs):
+        # 模拟 SDXL 的两个文本编码器输出 (prompt, negative, pooled, negative pooled)
+        import torch
+        return torch.zeros(1, 77, 2048), torch.zeros(1, 77, 2048), torch.zeros(1, 1280), torch.zeros(1, 1280)
+
     def enable_model_cpu_offload(self): pass
+    def to(self, *args, **kwargs): return self
     def enable_slicing(self): pass
     def enable_tiling(self): pass
     
@@ -58,6 +65,26 @@ class DummyI2I(DummyPipeBase):
     def from_pipe(cls, pipe):
         return cls()
 
+class FileImage:
+    """模拟 PIL 图像：save() 写出一个小文件 (可跨进程 pickle)"""
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(b"png")
+
+class WorkerPipe(DummyPipeBase):
+    """工作进程中使用的伪造 Pipeline"""
+    def __call__(self, generator=None, **kwargs):
+        out = DummyOutput()
+        out.images = [FileImage() for _ in generator]
+        return out
+
+def load_worker_pipe(model_path, device=None):
+    """工作进程的 loader：直接返回已构建好变体的 registry"""
+    pipe = WorkerPipe()
+    registry = t2i.PipelineRegistry(pipe)
+    registry._variants.update(text2img=pipe, img2img=pipe)
+    return registry
+
 # ==========================================
 # 测试逻辑
 # ==========================================
@@ -79,6 +106,1254 @@ class TestDeepSeseLogic(unittest.TestCase):
         self.assertEqual(tr_x, 896)
         print("[PASS] SR Coordinates logic is valid.")
 
+    def test_sr_mask_benchmark(self):
+        """
+        Micro-benchmark: vectorized + cached masks vs. the original per-row loops.
+        """
+        print("\n[TEST] Benchmarking SR Tile Masks...")
+        import time
+        import numpy as np
+
+        def legacy_mask(tile_size, overlap, sides):
+            # 原始实现 (逐行/逐列循环)，作为基准
+            mask = np.ones((tile_size, tile_size), dtype=np.float32)
+            fade_ramp = np.linspace(0, 1, overlap)
+            if sides["top"]:
+                for i in range(overlap):
+                    mask[i, :] *= fade_ramp[i]
+            if sides["bottom"]:
+                for i in range(overlap):
+                    mask[tile_size - 1 - i, :] *= fade_ramp[i]
+            if sides["left"]:
+                for i in range(overlap):
+                    mask[:, i] *= fade_ramp[i]
+            if sides["right"]:
+                for i in range(overlap):
+                    mask[:, tile_size - 1 - i] *= fade_ramp[i]
+            return mask[:, :, np.newaxis]
+
+        coords = sr.get_tile_coordinates()
+        for _, _, _, sides in coords:
+            np.testing.assert_allclose(
+                sr.create_tile_mask(1024, 128, sides, ramp="linear"),
+                legacy_mask(1024, 128, sides), rtol=1e-6, atol=1e-7)
+
+        for ramp in ("cosine", "gaussian"):
+            curve = sr.fade_ramp(128, ramp)
+            self.assertAlmostEqual(curve[0], 0.0)
+            self.assertAlmostEqual(curve[-1], 1.0)
+            self.assertTrue(np.all(np.diff(curve) >= 0))
+
+        rounds = 5
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for _, _, _, sides in coords:
+                legacy_mask(1024, 128, sides)
+        t_legacy = time.perf_counter() - start
+
+        sr.clear_mask_cache()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for _, _, _, sides in coords:
+                sr.clear_mask_cache()
+                sr.create_tile_mask(1024, 128, sides)
+        t_vector = time.perf_counter() - start
+
+        for _, _, _, sides in coords:
+            sr.create_tile_mask(1024, 128, sides)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for _, _, _, sides in coords:
+                sr.create_tile_mask(1024, 128, sides)
+        t_cached = time.perf_counter() - start
+
+        n = rounds * len(coords)
+        print(f"       loops     : {t_legacy / n * 1000:.2f} ms/mask")
+        print(f"       vectorized: {t_vector / n * 1000:.2f} ms/mask ({t_legacy / t_vector:.1f}x)")
+        print(f"       cached    : {t_cached / n * 1000:.4f} ms/mask ({t_legacy / max(t_cached, 1e-9):.0f}x)")
+
+        # Cached masks are shared, so they must be read-only
+        self.assertFalse(sr.create_tile_mask(1024, 128, coords[0][3]).flags.writeable)
+        # The cache size follows the setting at run time
+        with patch.object(conf, "SR_MASK_CACHE_SIZE", 2):
+            for _, _, _, sides in coords:
+                sr.create_tile_mask(1024, 128, sides)
+            self.assertLessEqual(len(sr._mask_cache), 2)
+        print("[PASS] SR Tile Masks are equivalent and cached.")
+
+    def test_sr_tile_plan(self):
+        """
+        Test the N x M tile planner on non-square and larger outputs.
+        """
+        print("\n[TEST] Verifying SR Tile Planner...")
+        # Portrait input keeps its aspect ratio
+        self.assertEqual(sr.get_output_size(832, 1216, target_size=1920), (1312, 1920))
+
+        for width, height in [(1312, 1920), (3840, 2160), (1920, 640), (512, 768)]:
+            plan = sr.plan_tiles(width, height, tile_size=1024, min_overlap=128)
+            tw, th = plan["tile_width"], plan["tile_height"]
+            self.assertEqual(len(plan["tiles"]), plan["rows"] * plan["cols"])
+
+            # Every pixel is covered and no tile leaves the canvas
+            for _, x, y, _ in plan["tiles"]:
+                self.assertLessEqual(x + tw, width)
+                self.assertLessEqual(y + th, height)
+            xs = sorted({t[1] for t in plan["tiles"]})
+            ys = sorted({t[2] for t in plan["tiles"]})
+            for starts, tile, length in [(xs, tw, width), (ys, th, height)]:
+                self.assertEqual(starts[0], 0)
+                self.assertEqual(starts[-1] + tile, length)
+                for a, b in zip(starts, starts[1:]):
+                    self.assertGreaterEqual(a + tile - b, 128)
+
+            # Smallest grid: one tile less per axis would not keep the overlap
+            if plan["cols"] > 1:
+                self.assertLess((plan["cols"] - 1) * (1024 - 128) + 128, width)
+        
+        # 3840x2160 -> 5x3 grid instead of squashing into a square
+        plan = sr.plan_tiles(3840, 2160, tile_size=1024, min_overlap=128)
+        self.assertEqual((plan["cols"], plan["rows"]), (5, 3))
+        print("[PASS] SR Tile Planner is valid.")
+
+    def test_sr_tile_batching(self):
+        """
+        Batched tile inference: K tiles per call, per-tile seeds independent of K.
+        """
+        print("\n[TEST] Verifying SR Tile Batching...")
+        import tempfile
+        import numpy as np
+        from PIL import Image
+
+        class RecordingPipe(DummyI2I):
+            def __init__(self):
+                super().__init__()
+                self.calls = []
+            def __call__(self, image=None, generator=None, **kwargs):
+                self.calls.append([g.initial_seed() for g in generator])
+                out = DummyOutput()
+                out.images = [img.copy() for img in image]
+                return out
+
+        with tempfile.TemporaryDirectory() as tmp:
+            src_path = os.path.join(tmp, "in.png")
+            # Textured, so no tile is skipped as low-detail
+            rng = np.random.default_rng(0)
+            Image.fromarray(rng.integers(0, 256, (512, 512, 3), dtype=np.uint8)).save(src_path)
+
+            results = {}
+            for k in (1, 3, 4):
+                pipe = RecordingPipe()
+                with patch.object(conf, "SR_TILE_BATCH_SIZE", k), \
+                     patch('src.t2i.t2i.AutoPipelineForImage2Image.from_pipe', new=lambda p: p):
+                    sr.process_single_image_sr(pipe, src_path, os.path.join(tmp, str(k)))
+                results[k] = pipe.calls
+
+            self.assertEqual(len(results[1]), 4)
+            self.assertEqual(len(results[4]), 1)
+            self.assertEqual([len(c) for c in results[3]], [3, 1])
+            # Same seed for the same tile, whatever the batch size
+            flat = {k: [seed for call in calls for seed in call] for k, calls in results.items()}
+            self.assertEqual(flat[1], flat[3])
+            self.assertEqual(flat[1], flat[4])
+        print("[PASS] SR Tile Batching is deterministic.")
+
+    def test_sr_adaptive_tiles(self):
+        """
+        Content-adaptive SR: flat tiles keep their Lanczos pixels, mildly textured tiles get a
+        reduced strength, detailed tiles the full pass; seeds stay tied to the tile index.
+        """
+        print("\n[TEST] Verifying SR Adaptive Tiles...")
+        import numpy as np
+        from PIL import Image
+        from src.sr.blend import TileBlender
+
+        class StrengthPipe(DummyI2I):
+            def __init__(self):
+                super().__init__()
+                self.calls = []
+            def __call__(self, image=None, generator=None, strength=None, **kwargs):
+                self.calls.append(([g.initial_seed() for g in generator], strength))
+                out = DummyOutput()
+                out.images = [Image.new("RGB", img.size, (0, 0, 0)) for img in image]
+                return out
+
+        rng = np.random.default_rng(0)
+        pixels = np.full((128, 128, 3), 128, dtype=np.float32)
+        pixels[:64, 64:] += rng.normal(0, 40, (64, 64, 3))   # detailed
+        pixels[64:, 64:] += rng.normal(0, 2, (64, 64, 3))    # low detail
+        upscaled = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+        plan = sr.plan_tiles(128, 128, 64, 0)
+        pipe = StrengthPipe()
+        blender = TileBlender(128, 128)
+        with patch.object(conf, "SR_ADAPTIVE", True), patch.object(conf, "SR_STRENGTH", 0.2), \
+             patch.object(conf, "SR_INFERENCE_STEPS", 40), patch.object(conf, "SR_SEED", 42):
+            report = sr.diffuse_tiles(pipe, upscaled, plan, blender, batch_size=4)
+        out = np.asarray(blender.to_image())
+        blender.close()
+
+        self.assertEqual(pipe.calls, [([43], 0.2), ([45], 0.1)])
+        self.assertEqual((report["skipped"], report["reduced"]), (2, 1))
+        self.assertEqual((report["steps"], report["steps_full"]), (8 + 4, 4 * 8))
+        # Skipped tiles come from the upscale, refined ones from the pipeline
+        self.assertTrue((out[:, :64] == 128).all())
+        self.assertTrue((out[:, 64:] == 0).all())
+        print("[PASS] SR Adaptive Tiles work.")
+
+    def test_sr_blend_canvas(self):
+        """
+        memmap / stream canvases (and the streaming PNG encoder) match the in-memory canvas.
+        """
+        print("\n[TEST] Verifying SR Blending Canvas Modes...")
+        import tempfile
+        import numpy as np
+        from PIL import Image
+        from src.sr.blend import TileBlender, PngStreamWriter
+
+        plan = sr.plan_tiles(400, 272, tile_size=128, min_overlap=32)
+        rng = np.random.RandomState(0)
+        tiles = [rng.randint(0, 256, (plan["tile_height"], plan["tile_width"], 3)).astype(np.uint8)
+                 for _ in plan["tiles"]]
+
+        def blend(blender):
+            for (name, x, y, sides), tile in zip(plan["tiles"], tiles):
+                mask = sr.create_tile_mask((plan["tile_height"], plan["tile_width"]), plan["overlap"], sides)
+                blender.add(tile, mask, x, y)
+
+        reference = TileBlender(400, 272, mode="memory", band_rows=50)
+        blend(reference)
+        expected = np.asarray(reference.to_image())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in ("memmap", "stream"):
+                path = os.path.join(tmp, f"{mode}.png")
+                writer = PngStreamWriter(path, 400, 272)
+                blender = TileBlender(400, 272, mode=mode, band_rows=50, tmp_dir=tmp, sink=writer.write)
+                blend(blender)
+                blender.finish()
+                writer.close()
+                blender.close()
+                np.testing.assert_array_equal(np.asarray(Image.open(path)), expected)
+            # An aborted encode keeps the earlier output; memmap files are removed on close
+            writer = PngStreamWriter(os.path.join(tmp, "stream.png"), 400, 272)
+            writer.write(expected[:10])
+            writer.abort()
+            np.testing.assert_array_equal(np.asarray(Image.open(os.path.join(tmp, "stream.png"))), expected)
+            self.assertListEqual(sorted(os.listdir(tmp)), ["memmap.png", "stream.png"])
+
+        # float16 accumulator stays within one level
+        half = TileBlender(400, 272, dtype="float16")
+        blend(half)
+        diff = np.abs(np.asarray(half.to_image()).astype(int) - expected.astype(int))
+        self.assertLessEqual(diff.max(), 1)
+        print("[PASS] SR Blending Canvas Modes are consistent.")
+
+    def test_prompt_embedding_cache(self):
+        """
+        Prompt embeddings are encoded once per (model, precision, prompt, negative, clip skip) and persisted.
+        """
+        print("\n[TEST] Verifying Prompt Embedding Cache...")
+        import tempfile
+        import torch
+        from src.t2i.embed import PromptEmbeddingCache, repeat_embeds
+        from src.utils import devices
+
+        class CountingPipe(DummyPipeBase):
+            encodes = 0
+            def encode_prompt(self, **kwargs):
+                CountingPipe.encodes += 1
+                return super().encode_prompt(**kwargs)
+
+        pipe = CountingPipe()
+        # No profile applied (another test may have left one active)
+        with tempfile.TemporaryDirectory() as tmp, patch.object(conf, "CACHE_DIR", tmp), \
+                patch.object(devices, "_active", None):
+            model_path = os.path.join(tmp, "model.safetensors")
+            with open(model_path, "wb") as f:
+                f.write(b"fake checkpoint")
+            cache_dir = os.path.join(tmp, "prompt")
+
+            cache = PromptEmbeddingCache(model_path, max_entries=2, cache_dir=cache_dir)
+            first = cache.get(pipe, "a", "neg")
+            self.assertIs(cache.get(pipe, "a", "neg"), first)
+            cache.get(pipe, "a", "neg", clip_skip=2)
+            self.assertEqual(CountingPipe.encodes, 2)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+            # A fresh process (new cache object) reads the safetensors from disk
+            cache = PromptEmbeddingCache(model_path, max_entries=2, cache_dir=cache_dir)
+            cache.get(pipe, "a", "neg")
+            self.assertEqual(CountingPipe.encodes, 2)
+
+            # Another precision (e.g. the bf16 autocast cpu profile) does not reuse them
+            with patch.object(devices, "_active", dict(devices.resolve("cpu"), autocast=torch.bfloat16)):
+                cache.get(pipe, "a", "neg")
+            self.assertEqual(CountingPipe.encodes, 3)
+
+            # A changed checkpoint invalidates the key
+            with open(model_path, "ab") as f:
+                f.write(b" v2")
+            os.utime(model_path, ns=(1, 1))
+            cache = PromptEmbeddingCache(model_path, max_entries=2, cache_dir=cache_dir)
+            cache.get(pipe, "a", "neg")
+            self.assertEqual(CountingPipe.encodes, 4)
+
+        batch = repeat_embeds(first, 3)
+        self.assertEqual(tuple(batch["prompt_embeds"].shape), (3, 77, 2048))
+        self.assertEqual(tuple(batch["pooled_prompt_embeds"].shape), (3, 1280))
+        print("[PASS] Prompt Embedding Cache works.")
+
+    def test_job_server(self):
+        """
+        Resident server: priority FIFO ordering and a localhost submit/status round trip.
+        """
+        print("\n[TEST] Verifying Job Queue & Server...")
+        from src.serve import serve
+
+        jobs = serve.JobQueue()
+        a = jobs.submit("t2i", {"nums": 1})
+        b = jobs.submit("sr", {"file": "x.png"}, priority=5)
+        c = jobs.submit("t2i", {"nums": 2})
+        order = [jobs.next(timeout=1)["id"] for _ in range(3)]
+        self.assertListEqual(order, [b["id"], a["id"], c["id"]])
+        self.assertEqual(jobs.get(a["id"])["status"], "running")
+        with self.assertRaises(ValueError):
+            jobs.submit("video")
+
+        ran = []
+        def runner(job):
+            ran.append(job["params"])
+            if job["params"].get("nums") == 0:
+                raise SystemExit(1)
+            return [f"out_{job['id']}.png"]
+
+        server = serve.JobServer(runner, host="127.0.0.1", port=0)
+        server.start()
+        try:
+            host, port = server.address
+            job = serve.submit_job("t2i", {"nums": 3}, host=host, port=port)
+            done = serve.wait_for_job(job["id"], poll=0.05, host=host, port=port)
+            self.assertEqual(done["status"], "done")
+            self.assertListEqual(done["results"], [f"out_{job['id']}.png"])
+
+            # A task calling sys.exit() fails the job, not the server
+            bad = serve.submit_job("t2i", {"nums": 0}, host=host, port=port)
+            self.assertEqual(serve.wait_for_job(bad["id"], poll=0.05, host=host, port=port)["status"], "failed")
+            with self.assertRaises(RuntimeError):
+                serve.submit_job("video", host=host, port=port)
+        finally:
+            server.shutdown()
+        self.assertEqual(len(ran), 2)
+        print("[PASS] Job Queue & Server work.")
+
+    def test_lazy_imports_and_dry_run(self):
+        """
+        CLI startup: the task modules import without torch / diffusers, and the dry run plans
+        a task (tile plan, outputs, steps) without them.
+        """
+        print("\n[TEST] Verifying Lazy Imports and Dry Run...")
+        import subprocess
+        import tempfile
+
+        code = ("import sys; import src.main, src.sr.sr, src.t2i.t2i, src.serve.serve; "
+                "print(sorted(m for m in ('torch', 'diffusers', 'transformers') if m in sys.modules))")
+        out = subprocess.run([sys.executable, "-c", code], cwd=project_root, capture_output=True, text=True)
+        self.assertEqual(out.stdout.strip(), "[]", out.stderr)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            from PIL import Image
+            Image.new("RGB", (200, 300)).save(os.path.join(tmp, "a.png"))
+            script = ("import sys; from src.sr import sr; sr.dry_run(folder_path=sys.argv[1]); "
+                      "print(sorted(m for m in ('torch', 'diffusers') if m in sys.modules))")
+            out = subprocess.run([sys.executable, "-c", script, tmp], cwd=tmp, capture_output=True, text=True,
+                                 env=dict(os.environ, PYTHONPATH=project_root))
+            self.assertIn("2x2 tiles of 1024x1024", out.stdout, out.stderr)
+            self.assertIn("Steps to run: 32", out.stdout)
+            self.assertTrue(out.stdout.strip().endswith("[]"))
+            # Nothing is written by a dry run
+            self.assertListEqual(os.listdir(tmp), ["a.png"])
+
+        with patch.object(conf, "SR_INFERENCE_STEPS", 4):
+            self.assertEqual(len(sr.check_config()), 1)
+        with patch.object(conf, "IMAGE_WIDTH", 1020):
+            self.assertEqual(len(t2i.check_config()), 1)
+
+        # Flags a mode would silently ignore are rejected up front
+        import argparse
+        from src import main as cli
+        from src.conf.runtime import RuntimeConfig
+
+        def check(**flags):
+            defaults = dict(t2i=False, sr=False, keep=None, sweep=None, prompts=None, jobs=None,
+                            workers=None, dry_run=False, submit=False, watch=False)
+            return cli.check_args(argparse.Namespace(**dict(defaults, **flags)), RuntimeConfig())
+
+        self.assertListEqual(check(t2i=True, workers=2), [])
+        self.assertEqual(len(check(t2i=True, keep=5, workers=2)), 1)
+        self.assertEqual(len(check(t2i=True, keep=5, dry_run=True)), 1)
+        self.assertEqual(len(check(prompts=["prompt/"], workers=2, dry_run=True)), 2)
+        self.assertEqual(len(check(t2i=True, sweep=["refine_strength=0.3,0.4"], workers=2, dry_run=True)), 2)
+        self.assertEqual(len(check(t2i=True, sr=True, workers=2)), 1)
+        self.assertEqual(len(check(t2i=True, sr=True, dry_run=True)), 1)
+        self.assertEqual(len(check(t2i=True, sr=True, submit=True)), 1)
+        self.assertEqual(len(check(t2i=True, keep=5, submit=True)), 1)
+        self.assertEqual(len(check(t2i=True, sweep=["refine_strength=0.3,0.4"], submit=True)), 1)
+        self.assertEqual(len(check(t2i=True, workers=2, submit=True)), 1)
+        self.assertEqual(len(check(prompts=["prompt/"], submit=True)), 1)
+        self.assertListEqual(check(t2i=True, submit=True), [])
+        self.assertEqual(len(check(sr=True, watch=True, workers=2, dry_run=True)), 2)
+        self.assertEqual(len(check(sr=True, watch=True, submit=True)), 1)
+        print("[PASS] Lazy Imports and Dry Run work.")
+
+    @patch('src.t2i.t2i.StableDiffusionXLPipeline', new=DummySDXL)
+    @patch('src.t2i.t2i.AutoPipelineForText2Image', new=DummyT2I)
+    @patch('src.t2i.t2i.AutoPipelineForImage2Image', new=DummyI2I)
+    def test_pipeline_registry(self):
+        """
+        Pipeline variants are built once per registry, not once per image.
+        """
+        print("\n[TEST] Verifying Pipeline Registry...")
+        registry = t2i.PipelineRegistry(DummySDXL())
+        for i in range(3):
+            t2i.process_two_stage_generation(registry, i, 3)
+        self.assertIsInstance(registry.img2img(), DummyI2I)
+        self.assertIs(registry.text2img(), registry.base)
+        self.assertEqual(registry.build_counts, {"text2img": 0, "img2img": 1})
+        self.assertIs(t2i.as_registry(registry), registry)
+
+        # Non-SDXL base (e.g. an img2img pipe) builds its text2img variant once
+        other = t2i.PipelineRegistry(DummyI2I())
+        other.text2img()
+        other.text2img()
+        self.assertEqual(other.build_counts["text2img"], 1)
+        print("[PASS] Pipeline Registry reuses variants.")
+
+    def test_model_cache(self):
+        """
+        Model cache: the first load converts the single file and writes the cache, later loads
+        come from the cache, and a changed checkpoint invalidates (and removes) the old entry.
+        """
+        print("\n[TEST] Verifying Model Cache...")
+        import tempfile
+        import torch
+        from src.t2i import model_cache
+
+        class CachePipe(DummySDXL):
+            calls = []
+
+            @classmethod
+            def from_single_file(cls, path, **kwargs):
+                cls.calls.append("single_file")
+                return cls()
+
+            @classmethod
+            def from_pretrained(cls, path, **kwargs):
+                cls.calls.append("cache")
+                return cls()
+
+            def save_pretrained(self, path, **kwargs):
+                os.makedirs(path, exist_ok=True)
+                open(os.path.join(path, "model.safetensors"), "wb").close()
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(conf, "CACHE_DIR", os.path.join(tmp, "cache")), \
+                patch.object(conf, "MODEL_CACHE_DIR", os.path.join(tmp, "mod_cache")), \
+                patch('src.t2i.t2i.StableDiffusionXLPipeline', new=CachePipe):
+            model_path = os.path.join(tmp, "model.safetensors")
+            with open(model_path, "wb") as f:
+                f.write(b"v1")
+
+            for _ in range(2):
+                t2i.load_pipeline_weights(model_path, torch.float32)
+            self.assertListEqual(CachePipe.calls, ["single_file", "cache"])
+            old_entry = model_cache.cache_path(model_path, torch.float32)
+            # fp16 (CUDA) is a separate conversion, and storing it keeps the fp32 one
+            old_fp16 = model_cache.cache_path(model_path, torch.float16)
+            self.assertNotEqual(old_fp16, old_entry)
+            t2i.load_pipeline_weights(model_path, torch.float16)
+            self.assertTrue(os.path.isdir(old_entry) and os.path.isdir(old_fp16))
+            CachePipe.calls.clear()
+
+            with open(model_path, "wb") as f:
+                f.write(b"v2 changed")
+            t2i.load_pipeline_weights(model_path, torch.float32)
+            t2i.load_pipeline_weights(model_path, torch.float32)
+            self.assertListEqual(CachePipe.calls, ["single_file", "cache"])
+            self.assertListEqual(os.listdir(conf.MODEL_CACHE_DIR),
+                                 [os.path.basename(model_cache.cache_path(model_path, torch.float32))])
+            self.assertFalse(os.path.exists(old_entry) or os.path.exists(old_fp16))
+
+            # Concurrent writers (workers that all missed the cache) each use their own directory
+            import threading
+            import time
+
+            class SlowPipe(CachePipe):
+                def save_pretrained(self, path, **kwargs):
+                    for i in range(5):
+                        with open(os.path.join(path, f"part{i}.safetensors"), "wb") as f:
+                            f.write(path.encode())
+                        time.sleep(0.01)
+
+            with open(model_path, "wb") as f:
+                f.write(b"v3")
+            digest = model_cache.checkpoint_digest(model_path)
+            results = []
+            writers = [threading.Thread(target=lambda: results.append(
+                model_cache.store(SlowPipe(), model_path, torch.float16, digest))) for _ in range(2)]
+            for writer in writers:
+                writer.start()
+            for writer in writers:
+                writer.join()
+            entry = model_cache.cache_path(model_path, torch.float16, digest)
+            self.assertListEqual(results, [entry, entry])
+            self.assertTrue(model_cache.is_valid(entry, digest, torch.float16))
+            # All parts come from one writer, and nothing is left behind
+            contents = set()
+            for i in range(5):
+                with open(os.path.join(entry, f"part{i}.safetensors"), "rb") as f:
+                    contents.add(f.read())
+            self.assertEqual(len(contents), 1)
+            self.assertListEqual(os.listdir(conf.MODEL_CACHE_DIR), [os.path.basename(entry)])
+        print("[PASS] Model Cache works.")
+
+    def test_triage(self):
+        """
+        Triage: metrics rank sharp / well exposed drafts first, the scorer hook takes part,
+        and only the kept seeds pay for the full two-stage pipeline.
+        """
+        print("\n[TEST] Verifying Triage...")
+        import tempfile
+        import numpy as np
+        from PIL import Image
+        from src.t2i import triage
+        from src.utils.manifest import RunManifest
+        from benchmarks.tiny import stub_registry
+
+        rng = np.random.default_rng(0)
+        flat = Image.new("L", (32, 32), 128)
+        detailed = Image.fromarray(rng.integers(60, 200, (32, 32), dtype=np.uint8))
+        self.assertGreater(triage.sharpness(detailed), triage.sharpness(flat))
+        self.assertGreater(triage.exposure(flat), triage.exposure(Image.new("L", (32, 32), 255)))
+        self.assertEqual(triage._ranks([3.0, 1.0, 3.0]), [0.75, 0.0, 0.75])
+
+        ranked = triage.score_candidates([{"seed": 1, "image": flat}, {"seed": 2, "image": detailed}],
+                                         weights={"sharpness": 1.0})
+        self.assertListEqual([c["seed"] for c in ranked], [2, 1])
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(conf, "OUTPUT_DIR_T2I", tmp), \
+                patch.object(conf, "IMAGE_HEIGHT", 64), patch.object(conf, "IMAGE_WIDTH", 64), \
+                patch.object(conf, "T2I_SEED", 100), patch.object(conf, "TRIAGE_STEPS", 5), \
+                patch.object(conf, "TRIAGE_WEIGHTS", {"scorer": 1.0}):
+            registry = stub_registry(step_cost=0.0)
+            # The scorer prefers the highest seeds
+            saved = triage.run_task(6, keep=2, pipe=registry, batch_size=4, scorer=lambda image, seed: seed)
+            self.assertEqual(len(saved), 2)
+            self.assertEqual(registry.base.steps_run, 6 * 5 + 2 * t2i.steps_per_image())
+            seeds = sorted(record["seed"] for record in RunManifest(tmp).records() if record["status"] == "done")
+            self.assertListEqual(seeds, [104, 105])
+            self.assertEqual(len([f for f in os.listdir(os.path.join(tmp, "triage")) if f.endswith(".png")]), 6)
+        print("[PASS] Triage works.")
+
+    def test_device_profiles(self):
+        """
+        Device profiles: the CPU profile attaches no offload hooks and sets up threads /
+        channels_last / autocast; GPU profiles fall back to it without CUDA.
+        """
+        print("\n[TEST] Verifying Device Profiles...")
+        import torch
+        from src.utils import devices
+
+        with patch.object(conf, "CPU_THREADS", 3), patch.object(conf, "DEVICE_PROFILE", "cpu"):
+            profile = devices.resolve()
+        self.assertEqual((profile["device"], profile["dtype"], profile["threads"]), ("cpu", torch.float32, 3))
+        self.assertFalse(profile["offload"])
+        if not torch.cuda.is_available():
+            self.assertEqual(devices.resolve("gpu_highvram")["name"], "cpu")
+        with self.assertRaises(ValueError):
+            devices.resolve("tpu")
+
+        pipe = MagicMock()
+        threads = torch.get_num_threads()
+        try:
+            devices.apply(pipe, dict(profile, autocast=torch.bfloat16, compile=False))
+            pipe.enable_model_cpu_offload.assert_not_called()
+            pipe.to.assert_called_once_with("cpu")
+            pipe.unet.to.assert_called_once_with(memory_format=torch.channels_last)
+            self.assertEqual(torch.get_num_threads(), 3)
+            with devices.autocast():
+                self.assertEqual((torch.ones(2, 2) @ torch.ones(2, 2)).dtype, torch.bfloat16)
+        finally:
+            devices._active = None
+            torch.set_num_threads(threads)
+        with devices.autocast():
+            self.assertEqual((torch.ones(2, 2) @ torch.ones(2, 2)).dtype, torch.float32)
+        print("[PASS] Device Profiles work.")
+
+    def test_prompt_library(self):
+        """
+        Prompt library: jobs are grouped by prompt module, each prompt is encoded once for its
+        group and the images land in per-prompt folders.
+        """
+        print("\n[TEST] Verifying Prompt Library...")
+        import json
+        import tempfile
+        from src.conf import prompt as pt
+        from src.t2i import library
+        from benchmarks.tiny import stub_registry
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("a", "b"):
+                with open(os.path.join(tmp, f"{name}.py"), "w") as f:
+                    f.write(f"PROMPT_TEXT = 'library test prompt {name} {tmp}'\n")
+            job_file = os.path.join(tmp, "jobs.json")
+            with open(job_file, "w") as f:
+                json.dump({"jobs": [{"prompt": "a.py", "count": 2}, {"prompt": "b.py", "count": 1},
+                                    {"prompt": "a.py", "count": 1}]}, f)
+
+            jobs = library.read_job_file(job_file)
+            groups = library.group_jobs(jobs)
+            self.assertListEqual([(p["name"], n) for p, n in groups], [("a", 3), ("b", 1)])
+            self.assertEqual(groups[0][0]["PROMPT_REFINE_TEXT"], groups[0][0]["PROMPT_TEXT"])
+
+            registry = stub_registry(step_cost=0.0)
+            encoded = []
+            encode = registry.base.encode_prompt
+            registry.base.encode_prompt = lambda prompt=None, **kw: encoded.append(prompt) or encode(prompt, **kw)
+            original = pt.PROMPT_TEXT
+            with patch.object(conf, "OUTPUT_DIR_T2I", os.path.join(tmp, "out")), \
+                 patch.object(conf, "IMAGE_HEIGHT", 64), patch.object(conf, "IMAGE_WIDTH", 64):
+                results = library.run_task(jobs, pipe=registry, batch_size=2)
+                self.assertEqual(conf.OUTPUT_DIR_T2I, os.path.join(tmp, "out"))
+
+            self.assertEqual({name: len(saved) for name, saved in results.items()}, {"a": 3, "b": 1})
+            self.assertEqual(len(os.listdir(os.path.join(tmp, "out", "a"))), 3 + 1)  # + manifest
+            self.assertEqual(len(encoded), 2)
+            self.assertEqual(pt.PROMPT_TEXT, original)
+        print("[PASS] Prompt Library works.")
+
+    def test_sweep(self):
+        """
+        Sweeps: stage 1 runs once per seed for the whole grid, refine once per seed and setting,
+        and every cell plus one comparison grid per seed is written.
+        """
+        print("\n[TEST] Verifying Parameter Sweeps...")
+        import json
+        import tempfile
+        from src.t2i import sweep
+        from benchmarks.tiny import stub_registry
+
+        grid = sweep.parse_sweep(["refine_strength=0.4,0.6", "refine_inference_steps=10"])
+        self.assertEqual(grid, {"REFINE_STRENGTH": [0.4, 0.6], "REFINE_INFERENCE_STEPS": [10]})
+        self.assertEqual(len(sweep.grid_cells(grid)), 2)
+        for bad in (["base_inference_steps=5"], ["refine_strength"], ["refine_inference_steps=a"],
+                    ["refine_strength=0.4", "refine_strength=0.6"]):
+            with self.assertRaises(ValueError):
+                sweep.parse_sweep(bad)
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(conf, "OUTPUT_DIR_T2I", tmp), patch.object(conf, "CACHE_DIR", tmp), \
+                patch.object(conf, "IMAGE_HEIGHT", 64), patch.object(conf, "IMAGE_WIDTH", 64), \
+                patch.object(conf, "T2I_SEED", 100):
+            registry = stub_registry(step_cost=0.0)
+            out_dir = sweep.run_task(["refine_strength=0.4,0.6"], num_images=2, pipe=registry, batch_size=2)
+            refine_steps = sum(int(conf.REFINE_INFERENCE_STEPS * s) for s in (0.4, 0.6))
+            self.assertEqual(registry.base.steps_run, 2 * conf.BASE_INFERENCE_STEPS + 2 * refine_steps)
+            files = sorted(os.listdir(out_dir))
+            self.assertIn("grid_seed100.png", files)
+            self.assertIn("seed101_refine_strength-0.6.png", files)
+            with open(os.path.join(out_dir, "sweep.json")) as f:
+                self.assertEqual(len(json.load(f)["seeds"][0]["cells"]), 2)
+            self.assertIsNone(sweep.run_task(["refine_strength=1.5"], num_images=1, pipe=registry))
+        print("[PASS] Parameter Sweeps work.")
+
+    def test_fused_t2i_sr(self):
+        """
+        Fused T2I -> SR: refined images go into SR in memory, only the SR results are written
+        (intermediates on request), and a rerun skips the finished images.
+        """
+        print("\n[TEST] Verifying Fused T2I -> SR...")
+        import tempfile
+        from PIL import Image
+        from src.t2i import fused
+        from benchmarks.tiny import stub_registry
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(conf, "OUTPUT_DIR_T2I", os.path.join(tmp, "t2i")), \
+                patch.object(conf, "OUTPUT_DIR_SR", os.path.join(tmp, "sr")), \
+                patch.object(conf, "IMAGE_HEIGHT", 64), patch.object(conf, "IMAGE_WIDTH", 64), \
+                patch.object(conf, "SR_SCALE", 2), patch.object(conf, "SR_CANVAS_MODE", "memory"), \
+                patch.object(conf, "T2I_SEED", 100):
+            registry = stub_registry(step_cost=0.0)
+            saved = fused.run_task(3, pipe=registry, batch_size=2)
+            self.assertEqual(len(saved), 3)
+            self.assertFalse(os.path.exists(conf.OUTPUT_DIR_T2I))
+            with Image.open(saved[0]) as img:
+                self.assertEqual(img.size, (128, 128))
+
+            steps = registry.base.steps_run
+            self.assertListEqual(fused.run_task(3, pipe=registry, batch_size=2), saved)
+            self.assertEqual(registry.base.steps_run, steps)
+
+            with patch.object(conf, "T2I_SEED", 200):
+                fused.run_task(1, pipe=registry, save_intermediates=True)
+            self.assertEqual(len(os.listdir(conf.OUTPUT_DIR_T2I)), 1)
+        print("[PASS] Fused T2I -> SR works.")
+
+    def test_runtime_config(self):
+        """
+        Runtime config: file < env < CLI layering with typed values, derived settings follow,
+        up-front validation, and per-job configs on one resident pipeline leave conf untouched.
+        """
+        print("\n[TEST] Verifying Runtime Config...")
+        import json
+        import tempfile
+        from PIL import Image
+        from src.conf import runtime
+        from src.conf.runtime import RuntimeConfig
+        from src.serve import serve
+        from benchmarks.tiny import stub_registry
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "run.json")
+            with open(path, "w") as f:
+                json.dump({"image_width": 832, "SR_STRENGTH": 0.3}, f)
+            config = runtime.load(path, ["SR_TILE_SIZE=768", "T2I_SEED=5"],
+                                  environ={"DEEPSESE_SR_STRENGTH": "0.25", "DEEPSESE_T2I_LATENT_HANDOFF": "false"})
+        self.assertEqual((config.IMAGE_WIDTH, config.SR_STRENGTH, config.SR_TILE_SIZE, config.T2I_SEED),
+                         (832, 0.25, 768, 5))
+        self.assertIs(config.T2I_LATENT_HANDOFF, False)
+        self.assertEqual(config.TARGET_SIZE, (conf.IMAGE_HEIGHT, 832))
+        for bad in ({"SR_TILE_SIZE": "big"}, {"NO_SUCH_SETTING": 1}, {"IMAGE_WIDTH": None}):
+            with self.assertRaises(ValueError):
+                config.override(bad)
+        with self.assertRaises(ValueError):
+            config.override({"MODEL_FILENAME": "other.safetensors"}, load_time=False)
+
+        self.assertListEqual(config.validate(), [])
+        self.assertTrue(config.override({"SR_OVERLAP": 768}).validate())
+        self.assertTrue(config.override({"SR_TARGET_SIZE": 512}).validate(("sr",)))
+        self.assertListEqual(config.override({"SR_TARGET_SIZE": 512}).validate(("t2i",)), [])
+
+        registry = stub_registry(step_cost=0.0)
+        width = conf.IMAGE_WIDTH
+        with tempfile.TemporaryDirectory() as tmp:
+            for size in (64, 96):
+                job = {"type": "t2i", "params": {"nums": 1, "config": {
+                    "IMAGE_WIDTH": size, "IMAGE_HEIGHT": 64, "T2I_SEED": 1, "OUTPUT_DIR_T2I": tmp}}}
+                saved = serve.run_job(registry, job)
+                with Image.open(saved[0]) as img:
+                    self.assertEqual(img.size, (size, 64))
+            with self.assertRaises(ValueError):
+                serve.run_job(registry, {"type": "t2i", "params": {"config": {"REFINE_STRENGTH": 2.0}}})
+        self.assertEqual(conf.IMAGE_WIDTH, width)
+
+        # One applied config at a time; other threads build theirs from the process settings
+        import threading
+        applied, release = threading.Event(), threading.Event()
+        strength = conf.SR_STRENGTH
+
+        def job():
+            with RuntimeConfig().override({"SR_STRENGTH": 0.55}).apply():
+                applied.set()
+                release.wait(5)
+
+        worker = threading.Thread(target=job)
+        worker.start()
+        try:
+            self.assertTrue(applied.wait(5))
+            self.assertEqual(RuntimeConfig().SR_STRENGTH, strength)
+            self.assertFalse(runtime._apply_lock.acquire(blocking=False))
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(conf.SR_STRENGTH, strength)
+        print("[PASS] Runtime Config works.")
+
+    def test_sr_watch(self):
+        """
+        Hot folder: unchanged directories are not listed again, files are only taken once they
+        stop growing, duplicate content is skipped and the watch stops cleanly.
+        """
+        print("\n[TEST] Verifying SR Hot Folder...")
+        import shutil
+        import tempfile
+        import threading
+        import time
+        from PIL import Image
+        from src.sr import watch
+        from benchmarks.tiny import stub_registry
+
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "in")
+            os.makedirs(os.path.join(root, "a", "b"))
+            old = time.time() - 10
+            for path in (root, os.path.join(root, "a"), os.path.join(root, "a", "b")):
+                os.utime(path, (old, old))
+            scanner = watch.FolderScanner(root)
+            self.assertListEqual(scanner.scan(), [])
+            listed = scanner.listed
+            scanner.scan()
+            self.assertEqual(scanner.listed, listed)
+
+            with patch.object(conf, "OUTPUT_DIR_SR", os.path.join(tmp, "out")), \
+                    patch.object(conf, "CACHE_DIR", os.path.join(tmp, "cache")), \
+                    patch.object(conf, "SR_TARGET_SIZE", 128), \
+                    patch.object(conf, "WATCH_POLL_SECONDS", 0.05), patch.object(conf, "WATCH_SETTLE_SECONDS", 0.3):
+                stop = threading.Event()
+                saved = []
+                runner = threading.Thread(target=lambda: saved.extend(
+                    watch.run_task(root, pipe=stub_registry(step_cost=0.0), stop=stop)))
+                runner.start()
+                try:
+                    # Written in two steps: still growing at the first polls
+                    image = os.path.join(root, "a", "b", "x.png")
+                    Image.new("RGB", (64, 64), (200, 50, 50)).save(image)
+                    with open(image, "ab") as f:
+                        f.write(b"\0" * 16)
+                    time.sleep(0.15)
+                    with open(image, "ab") as f:
+                        f.write(b"\0" * 16)
+                    shutil.copy(image, os.path.join(root, "a", "copy.png"))
+                    deadline = time.time() + 10
+                    while time.time() < deadline and not os.path.isdir(conf.OUTPUT_DIR_SR):
+                        time.sleep(0.05)
+                    time.sleep(1.0)
+                finally:
+                    stop.set()
+                    runner.join(timeout=10)
+                self.assertFalse(runner.is_alive())
+                self.assertEqual(len(saved), 1)
+                self.assertEqual(len([f for f in os.listdir(conf.OUTPUT_DIR_SR) if f.startswith("SR_")]), 1)
+
+                # A failed job's content is forgotten, so saving the image again retries it
+                folder = watch.HotFolder(root, include_existing=False)
+                folder.queued.add("feed")
+                folder.release({"input_hash": "feed"})
+                self.assertNotIn("feed", folder.queued)
+        print("[PASS] SR Hot Folder works.")
+
+    def test_t2i_batching(self):
+        """
+        Batched T2I: one generator per image, batch halved and retried on out-of-memory.
+        """
+        print("\n[TEST] Verifying T2I Batching with OOM Fallback...")
+        import tempfile
+        from PIL import Image
+
+        class BatchPipe(DummyPipeBase):
+            def __init__(self):
+                super().__init__()
+                self.calls = []
+            def __call__(self, generator=None, **kwargs):
+                seeds = [g.initial_seed() for g in generator]
+                if len(seeds) > 2:
+                    raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+                self.calls.append(seeds)
+                out = DummyOutput()
+                out.images = [Image.new("RGB", (8, 8)) for _ in seeds]
+                return out
+
+        pipe = BatchPipe()
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch.object(conf, "OUTPUT_DIR_T2I", tmp), \
+             patch('src.t2i.t2i.AutoPipelineForImage2Image.from_pipe', new=lambda p: p), \
+             patch('src.t2i.t2i.AutoPipelineForText2Image.from_pipe', new=lambda p: p):
+            saved = t2i.run_task(num_images=5, pipe=pipe, batch_size=4)
+
+        self.assertEqual(len(saved), 5)
+        # Stage 1 + stage 2 per batch: 2, 2, 1 images after halving 4 -> 2
+        self.assertListEqual([len(c) for c in pipe.calls], [2, 2, 2, 2, 1, 1])
+        # Stage 2 reuses the seeds of stage 1, and every image has its own seed
+        self.assertListEqual(pipe.calls[0], pipe.calls[1])
+        seeds = pipe.calls[0] + pipe.calls[2] + pipe.calls[4]
+        self.assertEqual(len(set(seeds)), 5)
+
+        # Only out-of-memory errors are retried with smaller batches
+        self.assertTrue(t2i.is_oom_error(MemoryError()))
+        self.assertFalse(t2i.is_oom_error(ValueError("bad prompt")))
+        print("[PASS] T2I Batching works.")
+
+    def test_mem_budget(self):
+        """
+        Memory budget: the least degraded setting that fits is planned; an out-of-memory job is
+        retried one fallback step lower (same seed) instead of being dropped.
+        """
+        print("\n[TEST] Verifying Memory Budget and OOM Fallback...")
+        import io
+        import tempfile
+        import contextlib
+        import numpy as np
+        import torch
+        from PIL import Image
+        from src.conf import runtime
+        from src.utils import budget, devices
+
+        gpu = {"dtype": torch.float16, "device": "cuda"}
+        self.assertEqual(budget.plan(24, gpu)[0], {"batch": 8, "tile_size": 1024, "vae_tiling": False, "offload": "none"})
+        self.assertEqual(budget.plan(8, gpu)[0], {"batch": 1, "tile_size": 1024, "vae_tiling": True, "offload": "model"})
+        self.assertEqual(budget.plan(4, gpu)[0], {"batch": 1, "tile_size": 512, "vae_tiling": True, "offload": "sequential"})
+        # float32 on the cpu: no offload step, the bottom of the ladder if nothing fits
+        setting, peak = budget.plan(8, {"dtype": torch.float32, "device": "cpu"})
+        self.assertEqual((setting["offload"], setting["tile_size"]), ("none", 512))
+        self.assertGreater(peak, 8 * 1024)
+
+        with patch.object(devices, "resolve", return_value={"dtype": torch.float32, "device": "cpu"}):
+            config = budget.fit(runtime.RuntimeConfig().override({"MEM_BUDGET_GB": 32}))
+        self.assertEqual((config.T2I_BATCH_SIZE, config.SR_TILE_BATCH_SIZE, config.DEVICE_OFFLOAD), (4, 4, "none"))
+        with config.override({"DEVICE_VAE_TILING": True}).apply():
+            self.assertTrue(devices.resolve("cpu")["vae_tiling"])
+        # Settings the user chose are kept and the rest is planned around them
+        with patch.object(devices, "resolve", return_value={"dtype": torch.float32, "device": "cpu"}):
+            config = budget.fit(runtime.RuntimeConfig().override({"MEM_BUDGET_GB": 32, "T2I_BATCH_SIZE": 8,
+                                                                  "SR_TILE_BATCH_SIZE": 2}),
+                                explicit={"T2I_BATCH_SIZE", "SR_TILE_BATCH_SIZE"})
+        self.assertEqual((config.T2I_BATCH_SIZE, config.SR_TILE_BATCH_SIZE, config.DEVICE_VAE_TILING), (8, 2, True))
+
+        class FlakyPipe(DummyPipeBase):
+            """Out of memory on the first `failures` calls."""
+            def __init__(self, failures):
+                super().__init__()
+                self.failures = failures
+                self.calls = []
+                self.enable_model_cpu_offload = MagicMock()
+            def __call__(self, image=None, generator=None, **kwargs):
+                if self.failures:
+                    self.failures -= 1
+                    raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+                self.calls.append([g.initial_seed() for g in generator])
+                out = DummyOutput()
+                out.images = [img.copy() for img in image] if image else [Image.new("RGB", (8, 8)) for _ in generator]
+                return out
+
+        # T2I: batch of 1 -> VAE tiling -> model offload, then the same seed succeeds
+        pipe = FlakyPipe(failures=2)
+        log = io.StringIO()
+        gpu_profile = dict(devices.resolve("cpu"), device="cuda", offload=False, vae_tiling=False, autocast=None)
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch.object(conf, "OUTPUT_DIR_T2I", tmp), patch.object(devices, "_active", gpu_profile), \
+             patch('src.t2i.t2i.AutoPipelineForImage2Image.from_pipe', new=lambda p: p), \
+             patch('src.t2i.t2i.AutoPipelineForText2Image.from_pipe', new=lambda p: p), \
+             contextlib.redirect_stdout(log):
+            saved = t2i.run_task(num_images=1, pipe=pipe, batch_size=1)
+        self.assertEqual(len(saved), 1)
+        pipe.vae.enable_tiling.assert_called_once()
+        pipe.enable_model_cpu_offload.assert_called_once()
+        self.assertIn("succeeded with batch of 1, VAE tiling, model CPU offload", log.getvalue())
+
+        # SR: the automatic tile batch drops to 1 for this image, the tiles (and their seeds) stay the same
+        with tempfile.TemporaryDirectory() as tmp:
+            src_path = os.path.join(tmp, "in.png")
+            Image.fromarray(np.random.default_rng(0).integers(0, 256, (512, 512, 3), dtype=np.uint8)).save(src_path)
+            pipe = FlakyPipe(failures=1)
+            with patch.object(conf, "SR_TILE_BATCH_SIZE", 0), \
+                 patch('src.t2i.t2i.AutoPipelineForImage2Image.from_pipe', new=lambda p: p):
+                self.assertTrue(sr.process_single_image_sr(pipe, src_path, tmp))
+                self.assertEqual(conf.SR_TILE_BATCH_SIZE, 0)
+            self.assertEqual([len(c) for c in pipe.calls], [1, 1, 1, 1])
+
+            # Without fallback the error surfaces as before
+            with patch.object(conf, "MEM_OOM_FALLBACK", False), \
+                 patch('src.t2i.t2i.AutoPipelineForImage2Image.from_pipe', new=lambda p: p):
+                with self.assertRaises(RuntimeError):
+                    sr.process_single_image_sr(FlakyPipe(failures=1), src_path, tmp)
+        print("[PASS] Memory Budget works.")
+
+    def test_run_manifest(self):
+        """
+        Run manifest: completed jobs are skipped on rerun, an interrupted batch resumes with
+        its seeds, and a torn last line is ignored.
+        """
+        print("\n[TEST] Verifying Run Manifest Resume...")
+        import tempfile
+        from src.utils.manifest import RunManifest
+
+        class CountingPipe(DummyPipeBase):
+            def __init__(self, fail_after=None):
+                super().__init__()
+                self.seeds = []
+                self.fail_after = fail_after
+            def __call__(self, generator=None, image=None, **kwargs):
+                seeds = [g.initial_seed() for g in generator]
+                if image is None:
+                    if self.fail_after is not None and len(self.seeds) >= self.fail_after:
+                        raise KeyboardInterrupt()
+                else:
+                    # Stage 2: the image is complete
+                    self.seeds.extend(seeds)
+                out = DummyOutput()
+                out.images = [FileImage() for _ in seeds]
+                return out
+
+        def run(pipe, count):
+            return t2i.run_task(num_images=count, pipe=pipe, batch_size=1)
+
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch.object(conf, "OUTPUT_DIR_T2I", tmp), \
+             patch.object(conf, "T2I_SEED", None), \
+             patch('src.t2i.t2i.AutoPipelineForImage2Image.from_pipe', new=lambda p: p), \
+             patch('src.t2i.t2i.AutoPipelineForText2Image.from_pipe', new=lambda p: p):
+            # Interrupted after 2 of 4 images
+            first = CountingPipe(fail_after=2)
+            with self.assertRaises(KeyboardInterrupt):
+                run(first, 4)
+
+            # Torn record from the crash
+            with open(os.path.join(tmp, RunManifest.FILENAME), "a") as f:
+                f.write('{"key": "torn')
+
+            # Resume: only the 2 missing images are generated, with the planned seeds
+            second = CountingPipe()
+            saved = run(second, 4)
+            self.assertEqual(len(saved), 4)
+            self.assertEqual(len(second.seeds), 2)
+            self.assertEqual(len(set(first.seeds + second.seeds)), 4)
+            self.assertTrue(all(os.path.exists(p) for p in saved))
+
+            # Complete batch: a new run with random seeds is a new batch
+            third = CountingPipe()
+            run(third, 4)
+            self.assertEqual(len(third.seeds), 4)
+
+            manifest = RunManifest(tmp)
+            self.assertEqual(sum(r["status"] == "done" for r in manifest.records()), 8)
+
+            # Fixed seeds: a rerun is fully skipped without touching the pipeline
+            with patch.object(conf, "T2I_SEED", 1234):
+                run(CountingPipe(), 2)
+                again = run(None, 2)
+            self.assertEqual(len(again), 2)
+
+        # Keys only cover the settings of their task
+        from src.utils import manifest as manifest_lib
+        with patch.object(conf, "SR_STRENGTH", 0.5):
+            t2i_params, sr_params = manifest_lib.output_params("t2i"), manifest_lib.output_params("sr")
+        self.assertEqual(t2i_params, manifest_lib.output_params("t2i"))
+        self.assertNotEqual(sr_params, manifest_lib.output_params("sr"))
+        self.assertNotIn("REFINE_STRENGTH", sr_params)
+        self.assertIn("CLIP_SKIP", sr_params)
+        self.assertIn("SR_STRENGTH", manifest_lib.output_params(("t2i", "sr")))
+        # The resolved precision is part of the key, the profile name and thread counts are not
+        fp16, fp32 = {"dtype": "float16", "autocast": None}, {"dtype": "float32", "autocast": "bfloat16"}
+        self.assertNotEqual(manifest_lib.output_params("sr", fp16), manifest_lib.output_params("sr", fp32))
+        params = manifest_lib.output_params("sr", fp16)
+        with patch.object(conf, "CPU_THREADS", 3):
+            self.assertEqual(manifest_lib.output_params("sr", fp16), params)
+        self.assertNotIn("DEVICE_PROFILE", manifest_lib.output_params("sr", fp16))
+        print("[PASS] Run Manifest works.")
+
+    def test_worker_pool(self):
+        """
+        Sharded execution: workers get disjoint core slices, pull jobs from a shared queue and
+        the collector writes every output once and records it in the manifest.
+        """
+        print("\n[TEST] Verifying Multi-Process Workers...")
+        import tempfile
+        from src.utils.manifest import RunManifest
+        from src.workers import pool
+
+        specs = pool.plan_workers(3, cores=list(range(8)), gpus=0)
+        self.assertListEqual([len(s["cores"]) for s in specs], [2, 3, 3])
+        self.assertEqual(len(set(sum((s["cores"] for s in specs), []))), 8)
+        self.assertListEqual([s["device"] for s in pool.plan_workers(3, cores=[0], gpus=2)],
+                             ["cuda:0", "cuda:1", "cuda:0"])
+
+        with tempfile.TemporaryDirectory() as tmp, \
+             patch.object(conf, "OUTPUT_DIR_T2I", tmp), \
+             patch.object(conf, "T2I_SEED", 7):
+            manifest = RunManifest(tmp)
+            _, jobs = manifest.split_done(t2i.plan_jobs(5, manifest))
+            saved = pool.run_sharded("t2i", jobs, 2, batch_size=2, manifest=manifest, loader=load_worker_pipe)
+
+            self.assertListEqual(saved, [job["output"] for job in jobs])
+            self.assertTrue(all(os.path.exists(p) for p in saved))
+            self.assertTrue(all(RunManifest(tmp).is_done(job["key"]) for job in jobs))
+
+        # Deferred images (SR canvas merge) are finished in the worker, not pickled as a callable
+        import queue
+        results = queue.Queue()
+        pool.QueueWriter(0, results).submit(lambda: "merged", "out.png")
+        self.assertEqual(results.get_nowait(), ("image", 0, "out.png", "merged"))
+        print("[PASS] Multi-Process Workers work.")
+
+    def test_background_io(self):
+        """
+        Background writer (bounded, flushes on close) and ordered prefetcher.
+        """
+        print("\n[TEST] Verifying Background Writer & Prefetcher...")
+        import tempfile
+        import threading
+        import time
+        from PIL import Image
+        from src.utils.background import BackgroundWriter, Prefetcher
+
+        class SlowImage:
+            active = 0
+            peak = 0
+            lock = threading.Lock()
+            def save(self, path):
+                with SlowImage.lock:
+                    SlowImage.active += 1
+                    SlowImage.peak = max(SlowImage.peak, SlowImage.active)
+                time.sleep(0.02)
+                with open(path, "wb") as f:
+                    f.write(b"x")
+                with SlowImage.lock:
+                    SlowImage.active -= 1
+
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = BackgroundWriter(workers=2, max_pending=3)
+            paths = [os.path.join(tmp, f"{i}.png") for i in range(8)]
+            for path in paths:
+                writer.submit(SlowImage(), path)
+            # A failing write is reported and leaves no file behind
+            writer.submit(Image.new("RGB", (4, 4)), os.path.join(tmp, "missing", "x.png"))
+            failed = writer.close()
+            self.assertTrue(all(os.path.isfile(p) for p in paths))
+            self.assertEqual(len(failed), 1)
+            self.assertLessEqual(SlowImage.peak, 2)
+
+            # A failed rewrite keeps the existing good file and leaves no temporary file
+            class BrokenImage:
+                def save(self, path):
+                    with open(path, "wb") as f:
+                        f.write(b"partial")
+                    raise IOError("disk full")
+            with BackgroundWriter() as writer:
+                writer.submit(BrokenImage(), paths[0])
+            self.assertEqual(len(writer.failed), 1)
+            with open(paths[0], "rb") as f:
+                self.assertEqual(f.read(), b"x")
+            self.assertEqual(len(os.listdir(tmp)), len(paths))
+
+        loaded = []
+        def load(item):
+            loaded.append(item)
+            if item == 2:
+                raise IOError("broken file")
+            return item * 10
+
+        seen = []
+        for item, result, err in Prefetcher(range(5), load, depth=2):
+            # Never more than `depth` items ahead of the consumer
+            self.assertLessEqual(len(loaded), item + 3)
+            seen.append((item, result, err is not None))
+        self.assertListEqual(seen, [(0, 0, False), (1, 10, False), (2, None, True), (3, 30, False), (4, 40, False)])
+        print("[PASS] Background Writer & Prefetcher work.")
+
+    def test_benchmark_compare(self):
+        """
+        Benchmark suite: stats come from timed runs only, and a regression needs both the
+        relative threshold and the absolute noise floor to be exceeded.
+        """
+        print("\n[TEST] Verifying Benchmark Comparison...")
+        from benchmarks import bench
+        from benchmarks.tiny import stub_registry
+
+        calls = []
+        stats = bench.measure(lambda: calls.append(1), repeat=3, warmup=2)
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(stats["repeat"], 3)
+        self.assertLessEqual(stats["min"], stats["median"])
+
+        baseline = {"a": {"median": 0.100}, "b": {"median": 0.100}, "c": {"median": 0.0001}, "gone": {"median": 1.0}}
+        results = {"a": {"median": 0.110}, "b": {"median": 0.200}, "c": {"median": 0.0005}, "new": {"median": 1.0}}
+        rows = {name: regressed for name, _, _, _, regressed in bench.compare(results, baseline, threshold=0.15)}
+        # 10% slower: within threshold; 2x slower: regression; 5x slower but 0.4 ms: timer noise
+        self.assertDictEqual(rows, {"a": False, "b": True, "c": False})
+
+        # The stub charges img2img int(steps * strength) steps, like diffusers
+        registry = stub_registry(step_cost=0.0)
+        registry.img2img()(num_inference_steps=40, strength=0.25, image=[MagicMock()])
+        self.assertEqual(registry.base.steps_run, 10)
+        print("[PASS] Benchmark Comparison works.")
+
+    def test_stage_tracing(self):
+        """
+        Tracing: spans are no-ops while disabled, record wall time / memory peaks when enabled,
+        per-step events come from the step callback, and both file formats are written.
+        """
+        print("\n[TEST] Verifying Stage Tracing...")
+        import json
+        import tempfile
+        from src.utils import trace
+
+        with trace.span("idle") as args:
+            self.assertEqual(args, {})
+        self.assertIsNone(trace.step_callback("idle"))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for fmt in ("jsonl", "chrome"):
+                path = os.path.join(tmp, f"trace.{fmt}")
+                tracer = trace.enable(path, fmt=fmt)
+                with trace.span("outer", images=2):
+                    with trace.span("inner"):
+                        block = bytearray(4 * 2**20)
+                    del block
+                    callback = trace.step_callback("outer")
+                    for step in range(3):
+                        self.assertEqual(callback(None, step, 0, {"latents": 1}), {"latents": 1})
+                self.assertIs(trace.disable(), tracer)
+
+                rows = tracer.summary()
+                self.assertEqual(rows["outer"]["count"], 1)
+                # The first interval includes the work before the denoising loop
+                self.assertEqual((rows["outer.setup"]["count"], rows["outer.step"]["count"]), (1, 2))
+                # The inner allocation counts towards the peak of both spans
+                self.assertGreaterEqual(rows["inner"]["py_peak"], 4 * 2**20)
+                self.assertGreaterEqual(rows["outer"]["py_peak"], 4 * 2**20)
+                self.assertGreaterEqual(rows["outer"]["total"], rows["inner"]["total"])
+
+                with open(path) as f:
+                    if fmt == "jsonl":
+                        events = [json.loads(line) for line in f]
+                    else:
+                        events = json.load(f)["traceEvents"]
+                self.assertEqual(len(events), 5)
+                outer = next(e for e in events if e["name"] == "outer")
+                self.assertEqual(outer["args"]["images"], 2)
+        print("[PASS] Stage Tracing works.")
+
+    def test_t2i_latent_handoff(self):
+        """
+        Stage 1 latents go straight into stage 2; the base image is only decoded when saved.
+        """
+        print("\n[TEST] Verifying Latent Hand-off...")
+
+        class HandoffPipe(DummyPipeBase):
+            def __init__(self):
+                super().__init__()
+                self.calls = []
+            def __call__(self, output_type="pil", image=None, **kwargs):
+                self.calls.append((output_type, image))
+                out = DummyOutput()
+                out.images = "LATENTS" if output_type == "latent" else [MagicMock()]
+                return out
+
+        pipe = HandoffPipe()
+        registry = t2i.PipelineRegistry(pipe)
+        registry._variants = {"text2img": pipe, "img2img": pipe}
+
+        with patch.object(conf, "T2I_LATENT_HANDOFF", True), \
+             patch('src.t2i.t2i.decode_latents', return_value=[MagicMock()]) as decode:
+            base, refined, seed = t2i.process_two_stage_generation(registry, 0, 1, seed=7)
+            self.assertEqual(pipe.calls[0][0], "latent")
+            self.assertEqual(pipe.calls[1][1], "LATENTS")
+            self.assertIsNone(base)
+            self.assertIsNotNone(refined)
+            decode.assert_not_called()
+
+            with patch.object(conf, "T2I_SAVE_BASE", True):
+                t2i.process_two_stage_generation(registry, 0, 1, seed=7)
+            decode.assert_called_once()
+
+        pipe.calls = []
+        with patch.object(conf, "T2I_LATENT_HANDOFF", False):
+            base, refined, seed = t2i.process_two_stage_generation(registry, 0, 1, seed=7)
+        self.assertEqual(pipe.calls[0][0], "pil")
+        self.assertIs(pipe.calls[1][1][0], base)
+        print("[PASS] Latent Hand-off works.")
+
     # 使用 new=... 将源代码中的类替换为我们可以控制的 Dummy 类
     # 这样 isinstance(pipe, DummyT2I) 就是合法的语法
     @patch('src.t2i.t2i.StableDiffusionXLPipeline', new=DummySDXL)